@@ -0,0 +1,227 @@
+"""Times the aligners and the cut computation on synthetic transcripts of growing length, and compares them with
+a stored baseline. Runs offline: no Vosk model or ffmpeg is needed, but measuring memory needs a Unix system.
+
+python benchmarks/align.py                    # compare with benchmarks/align_baseline.json
+python benchmarks/align.py --save-baseline    # record a new baseline
+python benchmarks/align.py --sizes 10000 --check
+"""
+
+import argparse
+import ctypes
+import ctypes.util
+import datetime
+import gc
+import json
+import os
+import random
+import resource
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "src"))
+
+from vivideo.align import (  # noqa: E402
+    TranscriptIndex,
+    compute_cuts,
+    list_cuts,
+    pick_words_brute_force,
+    pick_words_dynamic,
+    pick_words_fuzzy,
+    pick_words_greedy,
+    pick_words_phrases,
+)
+from vivideo.transcribe import Transcript  # noqa: E402
+
+BASELINE = Path(__file__).resolve().parent / "align_baseline.json"
+SIZES = [10_000, 100_000, 1_000_000]
+VOCABULARY_SIZE = 20_000
+# Words in the synthetic edit. The same for every size, so the curves show how the aligners scale with the length
+# of the transcript.
+DESIRED_WORDS = 2_000
+# pick_words_brute_force is exponential in the number of repeated words, so it only gets a short edit, and is
+# skipped on the longest transcripts.
+BRUTE_FORCE_WORDS = 10
+BRUTE_FORCE_MAX_SIZE = 100_000
+PADDING = datetime.timedelta(milliseconds=50)
+
+
+def synthetic_transcript(n_words: int, rng: np.random.Generator) -> Transcript:
+    """Words drawn from a Zipfian vocabulary, so common words repeat like they do in speech: the most common word
+    is about a tenth of the transcript."""
+    frequencies = 1.0 / np.arange(1, VOCABULARY_SIZE + 1)
+    ranks = rng.choice(VOCABULARY_SIZE, size=n_words, p=frequencies / frequencies.sum())
+    gaps = rng.exponential(0.03, n_words)
+    durations = rng.uniform(0.1, 0.6, n_words)
+    start = np.cumsum(gaps + np.concatenate(([0.0], durations[:-1])))
+    words = [f"w{rank}" for rank in ranks.tolist()]
+    return Transcript.from_words(words, start, start + durations, np.ones(n_words))
+
+
+def synthetic_edit(words: list, n_desired: int, rng: random.Random, reorder: bool = True) -> str:
+    """Keeps sentences of 5 to 30 words and deletes the ones in between. With `reorder`, also repeats some phrases
+    and moves paragraphs around, which the greedy aligner can't follow."""
+    sentences = []
+    position = 0
+    n_chosen = 0
+    gap = max(0, 2 * (len(words) - n_desired) // max(n_desired // 15, 1))
+    while n_chosen < n_desired and position < len(words):
+        position += rng.randint(0, gap)
+        length = rng.randint(5, 30)
+        sentence = words[position : position + length]  # noqa: E203
+        if sentence:
+            sentences.append(sentence)
+            n_chosen += len(sentence)
+            if reorder and rng.random() < 0.05:
+                repeated = rng.choice(sentences)
+                sentences.append(repeated[: rng.randint(2, 6)])
+        position += length
+    paragraphs = [sentences[i : i + 10] for i in range(0, len(sentences), 10)]  # noqa: E203
+    if reorder:
+        rng.shuffle(paragraphs)
+    return "\n".join(" ".join(sentence) for paragraph in paragraphs for sentence in paragraph)
+
+
+def _memory_kb(field: str) -> int:
+    with open("/proc/self/status") as f:
+        for line in f:
+            if line.startswith(field + ":"):
+                return int(line.split()[1])
+    raise KeyError(field)
+
+
+def peak_memory_mb(function) -> float:
+    """Memory that `function` adds to the resident size at its peak, measured in a forked process so each
+    benchmark starts from the same state. tracemalloc would be exact but slows the aligners down too much.
+
+    On Linux, freed memory is first returned to the system and the peak is reset, so that allocations can't reuse
+    pages that are already resident. Elsewhere the peak is only a lower bound."""
+    read, write = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        os.close(read)
+        gc.collect()
+        if os.path.exists("/proc/self/clear_refs"):
+            ctypes.CDLL(ctypes.util.find_library("c")).malloc_trim(0)
+            with open("/proc/self/clear_refs", "w") as f:
+                f.write("5")
+            before = _memory_kb("VmRSS")
+            function()
+            peak_kb = _memory_kb("VmHWM") - before
+        else:
+            before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+            function()
+            # ru_maxrss is in kilobytes, except on macOS where it is in bytes
+            scale = 1024 if sys.platform == "darwin" else 1
+            peak_kb = (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - before) // scale
+        os.write(write, str(peak_kb).encode("utf-8"))
+        os._exit(0)
+    os.close(write)
+    with os.fdopen(read) as f:
+        peak_kb = f.read()
+    os.waitpid(pid, 0)
+    return int(peak_kb) / 1024
+
+
+def measure(function) -> dict:
+    """Wall time of the best of a few runs, and peak memory of a separate run."""
+    gc.collect()
+    times = []
+    for _ in range(3):
+        started = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - started)
+        if sum(times) > 5:
+            break
+    return {"seconds": min(times), "peak_mb": peak_memory_mb(function)}
+
+
+def run(sizes: list) -> dict:
+    results = {}
+    for n_words in sizes:
+        transcript = synthetic_transcript(n_words, np.random.default_rng(0))
+        words = transcript.words
+        index = TranscriptIndex.from_transcript(transcript)
+        desired = synthetic_edit(words, DESIRED_WORDS, random.Random(0))
+        in_order = synthetic_edit(words, DESIRED_WORDS, random.Random(0), reorder=False)
+        # One word in 20 is misspelled, as if the editor fixed what the recognizer got wrong
+        misrecognized = " ".join(word + "x" if i % 20 == 0 else word for i, word in enumerate(desired.split()))
+        short_desired = " ".join(desired.split()[:BRUTE_FORCE_WORDS])
+        chosen = np.asarray(pick_words_dynamic(index, desired))
+
+        benchmarks = {
+            "index": lambda: TranscriptIndex.from_transcript(transcript),
+            "pick_words_greedy": lambda: pick_words_greedy(index, in_order),
+            f"pick_words_brute_force_{BRUTE_FORCE_WORDS}": lambda: pick_words_brute_force(index, short_desired),
+            "pick_words_dynamic": lambda: pick_words_dynamic(index, desired),
+            "pick_words_fuzzy": lambda: pick_words_fuzzy(index, misrecognized),
+            "pick_words_phrases": lambda: pick_words_phrases(index, desired),
+            "compute_cuts": lambda: compute_cuts(transcript, chosen, PADDING),
+            "list_cuts_greedy": lambda: list_cuts(transcript, in_order, PADDING, method="greedy"),
+            "list_cuts_dynamic": lambda: list_cuts(transcript, desired, PADDING, method="dynamic"),
+        }
+        if n_words > BRUTE_FORCE_MAX_SIZE:
+            del benchmarks[f"pick_words_brute_force_{BRUTE_FORCE_WORDS}"]
+        for name, function in benchmarks.items():
+            result = measure(function)
+            results[f"{name}/{n_words}"] = result
+            print(f"{name:>28} {n_words:>9} {1000 * result['seconds']:>10.1f} ms {result['peak_mb']:>9.1f} MB")
+    return results
+
+
+def compare(results: dict, baseline: dict, tolerance: float) -> list:
+    """Names of the benchmarks that got slower than the baseline by more than `tolerance` times."""
+    regressions = []
+    print(f"\n{'benchmark':>38} {'baseline ms':>12} {'ms':>10} {'ratio':>7}")
+    for name, result in results.items():
+        if name not in baseline:
+            continue
+        ratio = result["seconds"] / max(baseline[name]["seconds"], 1e-9)
+        flag = " regression" if ratio > tolerance else ""
+        print(
+            f"{name:>38} {1000 * baseline[name]['seconds']:>12.1f} {1000 * result['seconds']:>10.1f} {ratio:>6.2f}x"
+            f"{flag}"
+        )
+        if flag:
+            regressions.append(name)
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Alignment benchmarks")
+    parser.add_argument("--sizes", default=",".join(map(str, SIZES)), help="Comma separated transcript lengths")
+    parser.add_argument("--baseline", default=str(BASELINE), help="Baseline JSON file")
+    parser.add_argument("--save-baseline", action="store_true", help="Save the results as the new baseline")
+    parser.add_argument("--tolerance", default=1.5, type=float, help="Slowdown that counts as a regression")
+    parser.add_argument("--check", action="store_true", help="Exit with an error if there are regressions")
+    args = parser.parse_args()
+
+    sizes = [int(size) for size in args.sizes.split(",")]
+    print(f"{'benchmark':>28} {'words':>9} {'time':>13} {'peak memory':>12}")
+    results = run(sizes)
+
+    if args.save_baseline:
+        baseline = {}
+        if Path(args.baseline).exists():
+            with open(args.baseline) as f:
+                baseline = json.load(f)
+        baseline.update(results)
+        with open(args.baseline, "w") as f:
+            json.dump(baseline, f, indent=2, sort_keys=True)
+        print("Saved baseline to", args.baseline)
+        return
+    if not Path(args.baseline).exists():
+        print("No baseline in", args.baseline)
+        return
+    with open(args.baseline) as f:
+        regressions = compare(results, json.load(f), args.tolerance)
+    if regressions:
+        print(f"{len(regressions)} regressions")
+        if args.check:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+"""Compares `compute_cuts` with the per-word timedelta loop it replaced.
+
+python benchmarks/compute_cuts.py
+"""
+
+import datetime
+import random
+import sys
+import timeit
+from pathlib import Path
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "src"))
+
+from vivideo.align import Cut, compute_cut_bounds, compute_cuts  # noqa: E402
+from vivideo.transcribe import Transcript  # noqa: E402
+
+
+def compute_cuts_loop(word_spans, chosen, padding):
+    """The original implementation, one `WordAndSpan` and a few timedeltas per chosen word."""
+    output = []
+    for index in chosen:
+        word_span = word_spans[index]
+        start = word_span.start
+        end = word_span.end
+        start = max(
+            start - padding, datetime.timedelta(0) if index == 0 else (start + word_spans[index - 1].end) / 2.0
+        )
+        end = min(
+            end + padding, end + padding if index + 1 == len(word_spans) else (end + word_spans[index + 1].start) / 2.0
+        )
+        if output and output[-1].end >= start and output[-1].start < start:
+            output[-1] = Cut(output[-1].start, end)
+        else:
+            output.append(Cut(start, end))
+    return output
+
+
+def synthetic_transcript(n_words: int, rng: np.random.Generator) -> Transcript:
+    gaps = rng.exponential(0.03, n_words)
+    durations = rng.uniform(0.1, 0.6, n_words)
+    start = np.cumsum(gaps + np.concatenate(([0.0], durations[:-1])))
+    return Transcript.from_words([f"w{i % 5000}" for i in range(n_words)], start, start + durations, np.ones(n_words))
+
+
+def synthetic_edit(n_words: int, n_chosen: int, rng: random.Random) -> list:
+    """Keeps sentences of 5 to 30 words until `n_chosen` words are chosen, then moves paragraphs around."""
+    chosen = []
+    position = 0
+    while len(chosen) < n_chosen and position < n_words:
+        position += rng.randint(0, 2 * (n_words - n_chosen) // n_chosen * 15)
+        length = rng.randint(5, 30)
+        chosen.extend(range(position, min(position + length, n_words)))
+        position += length
+    paragraphs = [chosen[i : i + 200] for i in range(0, len(chosen), 200)]
+    rng.shuffle(paragraphs)
+    return [index for paragraph in paragraphs for index in paragraph]
+
+
+def main():
+    padding = datetime.timedelta(milliseconds=50)
+    print(
+        f"{'words':>10} {'chosen':>10} {'cuts':>8} {'loop (ms)':>10} {'vectorized (ms)':>16} {'bounds (ms)':>12}"
+        f" {'speedup':>8}"
+    )
+    for n_words, n_chosen in [(10_000, 5_000), (100_000, 20_000), (1_000_000, 50_000)]:
+        transcript = synthetic_transcript(n_words, np.random.default_rng(0))
+        chosen = synthetic_edit(n_words, n_chosen, random.Random(0))
+        chosen_array = np.asarray(chosen)
+
+        cuts = compute_cuts(transcript, chosen_array, padding)
+        assert cuts == compute_cuts_loop(transcript, chosen, padding)
+
+        def best_of(function):
+            return min(timeit.repeat(function, number=1, repeat=3))
+
+        loop = best_of(lambda: compute_cuts_loop(transcript, chosen, padding))
+        vectorized = best_of(lambda: compute_cuts(transcript, chosen_array, padding))
+        bounds = best_of(lambda: compute_cut_bounds(transcript, chosen_array, 50_000))
+        print(
+            f"{n_words:>10} {len(chosen):>10} {len(cuts):>8} {1000 * loop:>10.1f} {1000 * vectorized:>16.1f}"
+            f" {1000 * bounds:>12.1f} {loop / vectorized:>7.0f}x"
+        )
+
+
+if __name__ == "__main__":
+    main()
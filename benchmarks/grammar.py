@@ -0,0 +1,87 @@
+"""Compares the real-time factor of recognition with and without a grammar, and with the grammar loop it replaced
+that rebuilt the grammar after every utterance. Needs a Vosk model, downloaded by name or given as a folder.
+
+python benchmarks/grammar.py [-m path/to/model] [-n model-name]
+"""
+
+import argparse
+import json
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "src"))
+
+from vosk import KaldiRecognizer, SetLogLevel  # noqa: E402
+
+from vivideo.transcribe import (  # noqa: E402
+    BLOCK_SIZE,
+    SAMPLE_RATE,
+    load_model,
+    media_duration,
+    read_grammar,
+    read_pcm,
+    recognize,
+)
+
+
+def recognize_loop(model, videofile, grammar, block_size=BLOCK_SIZE):
+    """The original grammar loop: a Python repr as the grammar, set again after every utterance."""
+    rec = KaldiRecognizer(model, SAMPLE_RATE, str(grammar))
+    rec.SetWords(True)
+    process = read_pcm(videofile)
+    results = []
+    while True:
+        data = process.stdout.read(block_size)
+        if len(data) == 0:
+            break
+        if rec.AcceptWaveform(data):
+            rec.SetGrammar(grammar)
+            results.append(json.loads(rec.Result()))
+    process.wait()
+    results.append(json.loads(rec.FinalResult()))
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("-i", "--input_media", default="samples/jfk.wav")
+    parser.add_argument("-g", "--grammar_file", default="samples/words.txt")
+    parser.add_argument("-m", "--model_path", default=None)
+    parser.add_argument("-n", "--model_name", default=None)
+    parser.add_argument("-r", "--repeat", default=3, type=int)
+    args = parser.parse_args()
+
+    SetLogLevel(-1)
+    try:
+        model = load_model(model_path=args.model_path, model_name=args.model_name)
+    except Exception as e:
+        print("Could not load a Vosk model, skipping the benchmark:", e)
+        return
+    grammar = read_grammar(args.grammar_file)
+    duration = media_duration(args.input_media)
+
+    def best_of(function):
+        times = []
+        for _ in range(args.repeat):
+            with tempfile.TemporaryDirectory() as folder:
+                started = time.perf_counter()
+                function(Path(folder) / "checkpoint.jsonl")
+                times.append(time.perf_counter() - started)
+        return min(times)
+
+    runs = {
+        "no grammar": lambda checkpoint: recognize(model, args.input_media, None, checkpoint),
+        "grammar": lambda checkpoint: recognize(model, args.input_media, grammar, checkpoint),
+        "grammar (old loop)": lambda checkpoint: recognize_loop(model, args.input_media, grammar),
+    }
+    print(f"{args.input_media}: {duration:.1f}s of audio, {len(grammar)} grammar phrases")
+    print(f"{'':>20} {'seconds':>8} {'RTF':>8}")
+    for name, function in runs.items():
+        seconds = best_of(function)
+        print(f"{name:>20} {seconds:>8.2f} {seconds / duration:>8.3f}")
+
+
+if __name__ == "__main__":
+    main()
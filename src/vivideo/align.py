@@ -1,11 +1,20 @@
 import datetime
+import json
 import re
-from collections import defaultdict, namedtuple, Counter
-from typing import List
+from collections import namedtuple, Counter
+from difflib import SequenceMatcher
+from functools import lru_cache
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Tuple, Union
 
-from vivideo.transcribe import WordAndSpan
+import numpy as np
 
-Cut = namedtuple("Cut", ["start", "end"])
+from vivideo.profiling import profiler
+from vivideo.silence import BoundarySnapper
+from vivideo.transcribe import MICROSECOND, Transcript, WordAndSpan
+
+# `source` is the media file of the cut when the edit uses several, and None when there is only one.
+Cut = namedtuple("Cut", ["start", "end", "source"], defaults=[None])
 
 WORD_PATTERN = re.compile(r"[^\s.,;]+")
 
@@ -14,17 +23,76 @@ def words_in_transcription(desired_transcription):
     return [w.lower() for w in WORD_PATTERN.findall(desired_transcription)]
 
 
+class TranscriptIndex:
+    """Inverted index of the lowercased words of a transcription.
+
+    Words are interned into ids, and the positions of each word are stored as a sorted int32 array, so finding
+    the next occurrence of a word is a binary search. Build it once per transcription and pass it to the
+    `pick_words_*` functions instead of the list of words.
+    """
+
+    def __init__(self, vocabulary: List[str], word_ids: np.ndarray):
+        self.vocabulary = list(vocabulary)
+        self.word_ids = np.asarray(word_ids, dtype=np.int32)
+        self._ids: Dict[str, int] = {word: i for i, word in enumerate(self.vocabulary)}
+        # Positions grouped by word id. A stable sort keeps the positions of each word sorted.
+        self._positions = np.argsort(self.word_ids, kind="stable").astype(np.int32)
+        self._offsets = np.zeros(len(self.vocabulary) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(self.word_ids, minlength=len(self.vocabulary)), out=self._offsets[1:])
+
+    @classmethod
+    def from_words(cls, words: List[str]) -> "TranscriptIndex":
+        ids: Dict[str, int] = {}
+        word_ids = np.fromiter((ids.setdefault(word.lower(), len(ids)) for word in words), np.int32, len(words))
+        return cls(list(ids), word_ids)
+
+    @classmethod
+    def from_word_spans(cls, word_spans: List[WordAndSpan]) -> "TranscriptIndex":
+        if isinstance(word_spans, Transcript):
+            return cls.from_transcript(word_spans)
+        return cls.from_words([word_span.word for word_span in word_spans])
+
+    @classmethod
+    def from_transcript(cls, transcript: Transcript) -> "TranscriptIndex":
+        """Builds the index by lowercasing the transcript's vocabulary rather than each of its words."""
+        ids: Dict[str, int] = {}
+        lowercase_ids = np.array([ids.setdefault(word.lower(), len(ids)) for word in transcript.vocabulary], np.int32)
+        return cls(list(ids), lowercase_ids[transcript.word_ids])
+
+    def __len__(self) -> int:
+        return len(self.word_ids)
+
+    def positions(self, word: str) -> np.ndarray:
+        """Sorted positions of a lowercased word. Empty if the word is not in the transcription."""
+        word_id = self._ids.get(word)
+        if word_id is None:
+            return self._positions[:0]
+        start, end = self._offsets[word_id], self._offsets[word_id + 1]
+        return self._positions[start:end]
+
+    def next_occurrence(self, word: str, position: int) -> Optional[int]:
+        """First position of a lowercased word at or after `position`, or None."""
+        positions = self.positions(word)
+        i = np.searchsorted(positions, position)
+        return int(positions[i]) if i < len(positions) else None
+
+
+def _as_index(words: Union[List[str], TranscriptIndex]) -> TranscriptIndex:
+    if isinstance(words, TranscriptIndex):
+        return words
+    return TranscriptIndex.from_words(words)
+
+
 def pick_words_greedy(
-    words: List[str],
+    words: Union[List[str], TranscriptIndex],
     desired_transcription: str,
 ) -> List[int]:
+    index = _as_index(words)
     word_index = 0
-    n_words = len(words)
     output = []
     for word in words_in_transcription(desired_transcription):
-        while word_index < n_words and words[word_index].lower() != word:
-            word_index += 1
-        if word_index == n_words:
+        word_index = index.next_occurrence(word, word_index)
+        if word_index is None:
             raise ValueError(f"Could not find all words in subtitles. First missing word: {word}")
         output.append(word_index)
         word_index += 1
@@ -32,29 +100,29 @@ def pick_words_greedy(
 
 
 def pick_words_brute_force(
-    words: List[str],
+    words: Union[List[str], TranscriptIndex],
     desired_transcription: str,
 ) -> List[int]:
     """Given a list of words from the original transcription and a desired transcription, return a list of
     words' indices that should be selected to achieve the desired transcription.
     """
-    word_positions = defaultdict(list)
-    for i, word in enumerate(words):
-        word_positions[word.lower()].append(i)
-
+    index = _as_index(words)
     desired_words = words_in_transcription(desired_transcription)
     desired_word_counts = Counter(desired_words)
+    word_positions = {word: index.positions(word).tolist() for word in desired_word_counts}
     for word, count in desired_word_counts.items():
         if count > len(word_positions[word]):
             raise ValueError(f"Could not find all words in subtitles. First missing word: {word}")
 
-    used = [False] * len(words)
+    used = [False] * len(index)
     path = []
     best = []
     best_cost = float("inf")
+    nodes = 0
 
     def backtrack(desired_word_index: int, cost: int, max_branch_factor: int = 3):
-        nonlocal best, best_cost, used, path
+        nonlocal best, best_cost, nodes
+        nodes += 1
         if cost > best_cost:
             return
         if desired_word_index == len(desired_words):
@@ -76,47 +144,742 @@ def pick_words_brute_force(
             path.pop()
 
     backtrack(0, 0)
+    profiler.count("brute_force_nodes", nodes)
     if not best:
         raise RuntimeError("Failed to find words for desired transcription.")
     return best
 
 
-def compute_cuts(word_spans: List[WordAndSpan], chosen: List[int], padding: datetime.timedelta) -> List[Cut]:
+def pick_words_dynamic(
+    words: Union[List[str], TranscriptIndex],
+    desired_transcription: str,
+    after: Optional[int] = None,
+    before: Optional[int] = None,
+) -> List[int]:
+    """Given a list of words from the original transcription and a desired transcription, return the list of
+    words' indices with the minimum total jump cost, using the same `abs(option - current_pos)` cost as
+    `pick_words_brute_force`. Ties are broken by picking the alignment with fewer non-contiguous jumps.
+
+    This is a Viterbi search over (desired word, candidate position) pairs. The `min(score[q] + |p - q|)`
+    transition is computed with running minimums over the sorted candidates, from the left for jumps forward and
+    from the right for jumps backwards, so both time and memory are linear in the number of candidate
+    occurrences. A word may not follow itself at the same position, but a repeated phrase may reuse source
+    material.
+
+    `after` and `before` are the positions of fixed words around the desired transcription, when it is a part of
+    a longer one. Jumps from `after` to the first word and from the last word to `before` are then part of the
+    cost, instead of the distance of the first word to the start of the transcription.
+    """
+    index = _as_index(words)
+    desired_words = words_in_transcription(desired_transcription)
+    bound = _anchored_jump_bound(index, desired_words, after, before)
+    word_positions = {
+        word: _window(index.positions(word), after, before, bound).astype(np.int64) for word in set(desired_words)
+    }
+    for word in desired_words:
+        if len(word_positions[word]) == 0:
+            raise ValueError(f"Could not find all words in subtitles. First missing word: {word}")
+    if not desired_words:
+        return []
+
+    # Scores are `jump_cost * weight + cuts`, so the number of cuts only breaks ties between equal jump costs.
+    weight = len(desired_words) + 1
+    candidates = word_positions[desired_words[0]]
+    if after is None:
+        scores = candidates * weight + 1
+    else:
+        candidates = candidates[candidates != after]
+        scores = np.abs(candidates - after) * weight + (candidates != after + 1)
+        if len(candidates) == 0:
+            raise ValueError(f"Could not find all words in subtitles. First missing word: {desired_words[0]}")
+    back_pointers = []
+
+    for word in desired_words[1:]:
+        previous, previous_scores = candidates, scores
+        candidates = word_positions[word]
+        pointers = np.full(len(candidates), -1, dtype=np.int32)
+        scores = np.zeros(len(candidates), dtype=np.int64)
+
+        # Jumps forward: min over q < p of score[q] - q * weight.
+        best, best_j = _running_min(previous_scores - previous * weight)
+        below = np.searchsorted(previous, candidates, "left")
+        forward = below > 0
+        scores[forward] = best[below[forward] - 1] + candidates[forward] * weight + 1
+        pointers[forward] = best_j[below[forward] - 1]
+
+        # Jumps backwards: min over q > p of score[q] + q * weight, ties going to the last q.
+        best, best_j = _running_min((previous_scores + previous * weight)[::-1])
+        above = len(previous) - np.searchsorted(previous, candidates, "right")
+        backward = above > 0
+        backward_scores = best[above[backward] - 1] - candidates[backward] * weight + 1
+        better = (pointers[backward] < 0) | (backward_scores < scores[backward])
+        backward[backward] = better
+        scores[backward] = backward_scores[better]
+        pointers[backward] = len(previous) - 1 - best_j[above[backward] - 1]
+
+        # Contiguous words don't add a cut.
+        j = np.minimum(np.searchsorted(previous, candidates - 1, "left"), len(previous) - 1)
+        contiguous = (previous[j] == candidates - 1) & (previous_scores[j] + weight <= scores)
+        scores[contiguous] = previous_scores[j[contiguous]] + weight
+        pointers[contiguous] = j[contiguous]
+
+        reachable = pointers >= 0
+        if not reachable.any():
+            raise ValueError(f"Could not find all words in subtitles. First missing word: {word}")
+        candidates, scores = candidates[reachable], scores[reachable]
+        back_pointers.append((pointers[reachable], previous))
+
+    if before is not None:
+        reachable = np.flatnonzero(candidates != before)
+        if len(reachable) == 0:
+            raise ValueError(f"Could not find all words in subtitles. First missing word: {desired_words[-1]}")
+        ends = candidates[reachable]
+        k = reachable[np.argmin(scores[reachable] + np.abs(before - ends) * weight + (before != ends + 1))]
+    else:
+        k = np.argmin(scores)
+    path = [int(candidates[k])]
+    for pointers, previous in reversed(back_pointers):
+        k = pointers[k]
+        path.append(int(previous[k]))
+    path.reverse()
+    return path
+
+
+def _anchored_jump_bound(
+    index: TranscriptIndex, desired_words: List[str], after: Optional[int], before: Optional[int]
+) -> Optional[int]:
+    """Total jump of the path that always moves to the nearest occurrence of the next word, from the `after`
+    anchor, or from the start of the transcription, to `before`. No word of the best path can be further than this
+    from the anchors, so it bounds the positions `pick_words_dynamic` has to consider. None if there is no anchor
+    or the path is not valid."""
+    if after is None and before is None:
+        return None
+    position = 0 if after is None else after
+    total = 0
+    for word in desired_words:
+        positions = index.positions(word)
+        i = int(np.searchsorted(positions, position))
+        options = [int(p) for p in positions[max(i - 1, 0) : i + 2] if p != position]  # noqa: E203
+        if not options:
+            return None
+        next_position = min(options, key=lambda p: abs(p - position))
+        total += abs(next_position - position)
+        position = next_position
+    if before is not None:
+        if before == position:
+            return None
+        total += abs(before - position)
+    return total
+
+
+def _window(positions: np.ndarray, after: Optional[int], before: Optional[int], bound: Optional[int]) -> np.ndarray:
+    """The sorted `positions` within `bound` of both anchors."""
+    if bound is None:
+        return positions
+    low, high = -np.inf, np.inf
+    for anchor in (0 if after is None else after, before):
+        if anchor is not None:
+            low, high = max(low, anchor - bound), min(high, anchor + bound)
+    return positions[np.searchsorted(positions, low, "left") : np.searchsorted(positions, high, "right")]  # noqa: E203
+
+
+def _running_min(values: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Minimum of each prefix of `values`, and the first index where it is reached."""
+    best = np.minimum.accumulate(values)
+    lower = np.ones(len(values), dtype=bool)
+    lower[1:] = values[1:] < best[:-1]
+    best_j = np.maximum.accumulate(np.where(lower, np.arange(len(values), dtype=np.int32), 0))
+    return best, best_j
+
+
+def _midpoint_us(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    """Midpoint of two arrays of microseconds, rounding half to even like `timedelta / 2.0`."""
+    total = a + b
+    half = total // 2
+    return half + (total & 1) * (half & 1)
+
+
+def compute_cut_bounds(
+    transcript: Transcript, chosen: np.ndarray, padding_us: int, snapper: Optional[BoundarySnapper] = None
+) -> Tuple[np.ndarray, np.ndarray]:
+    """Array version of `compute_cuts`: returns the start and end of each cut in microseconds."""
+    chosen = np.asarray(chosen, dtype=np.int64)
+    n_words = len(transcript)
+
+    start = transcript.start_us[chosen]
+    end = transcript.end_us[chosen]
+
+    # avoid overlap with previous and next words
+    previous_end = transcript.end_us[np.maximum(chosen - 1, 0)]
+    start = np.maximum(start - padding_us, np.where(chosen == 0, 0, _midpoint_us(start, previous_end)))
+    next_start = transcript.start_us[np.minimum(chosen + 1, n_words - 1)]
+    end = np.minimum(
+        end + padding_us, np.where(chosen + 1 == n_words, end + padding_us, _midpoint_us(end, next_start))
+    )
+    if len(chosen) == 0:
+        return start, end
+
+    # A word is merged into the previous cut if it starts before that cut ends, and after that cut starts.
+    # Cuts can only start at words that are not linked to the previous one, or at words that start no later
+    # than every word since the last unlinked one. The latter is a cumulative minimum per run of linked words,
+    # which we get from a single cumulative minimum by shifting each run below all the previous ones.
+    linked = end[:-1] >= start[1:]
+    run_ids = np.concatenate(([0], np.cumsum(~linked)))
+    shifted = start - run_ids * (int(start.max() - start.min()) + 1)
+    running_min = np.minimum.accumulate(shifted)
+    first = np.ones(len(chosen), dtype=bool)
+    first[1:] = ~linked | (shifted[1:] <= running_min[:-1])
+
+    starts = np.flatnonzero(first)
+    lasts = np.append(starts[1:] - 1, len(chosen) - 1)
+    if snapper is not None:
+        return snapper.snap(transcript, chosen[starts], chosen[lasts], start[starts], end[lasts])
+    return start[starts], end[lasts]
+
+
+def compute_cuts(
+    word_spans: List[WordAndSpan],
+    chosen: List[int],
+    padding: datetime.timedelta,
+    snapper: Optional[BoundarySnapper] = None,
+) -> List[Cut]:
     """Given a list of subtitles, the list of indices to select, list the timestamp ranges
-    that should be cut, while merging segments that are within margin of each other."""
-    output = []
-    for index in chosen:
-        word_span = word_spans[index]
-        start = word_span.start
-        end = word_span.end
-
-        # avoid overlap with previous and next words
-        start = max(
-            start - padding, datetime.timedelta(0) if index == 0 else (start + word_spans[index - 1].end) / 2.0
-        )
-        end = min(
-            end + padding, end + padding if index + 1 == len(word_spans) else (end + word_spans[index + 1].start) / 2.0
-        )
+    that should be cut, while merging segments that are within margin of each other.
+
+    With a `snapper`, the edges of the cuts are moved to the quietest point of the audio near them instead."""
+    start, end = compute_cut_bounds(Transcript.from_word_spans(word_spans), chosen, padding // MICROSECOND, snapper)
+    return [
+        Cut(datetime.timedelta(microseconds=a), datetime.timedelta(microseconds=b))
+        for a, b in zip(start.tolist(), end.tolist())
+    ]
+
+
+class SourceTimeline:
+    """Where each media file of a multi-source edit starts on the timeline of a transcript joined with
+    `Transcript.concatenate`. Cuts are computed on that timeline, and `cuts` maps them back to their media files.
+
+    The media files are far enough apart that no cut, with its padding, reaches from one into another."""
+
+    # Time between the last word of a media file and the next one on the timeline
+    GAP = datetime.timedelta(minutes=1)
+
+    def __init__(self, media_files: List[str], offsets_us: np.ndarray):
+        self.media_files = list(media_files)
+        self.offsets_us = np.asarray(offsets_us, dtype=np.int64)
+
+    @classmethod
+    def join(cls, media_files: List[str], transcripts: List[Transcript]) -> Tuple["SourceTimeline", Transcript]:
+        transcript, offsets_us = Transcript.concatenate(transcripts, cls.GAP // MICROSECOND)
+        return cls(media_files, offsets_us), transcript
+
+    def cuts(self, cuts: List[Cut]) -> List[Cut]:
+        """Cuts in the time of their own media file, tagged with it. A cut belongs to the media file its end is in,
+        since the padding before the first word of a media file can start in the gap before it."""
+        ends = np.array([cut.end // MICROSECOND for cut in cuts], dtype=np.int64)
+        sources = np.maximum(np.searchsorted(self.offsets_us, ends, "right") - 1, 0).tolist()
+        zero = datetime.timedelta(0)
+        result = []
+        for cut, source in zip(cuts, sources):
+            offset = datetime.timedelta(microseconds=int(self.offsets_us[source]))
+            result.append(Cut(max(cut.start - offset, zero), cut.end - offset, self.media_files[source]))
+        return result
+
+
+# Costs of the fuzzy aligner. Leaving a desired word unmatched costs more than matching a similar word, and
+# skipping source words is cheap, since edits mostly delete parts of the recording.
+SKIP_DESIRED_COST = 1.0
+SKIP_SOURCE_COST = 0.05
+TRANSPOSE_COST = 0.1
+# Orthographic similarity, as a `difflib` ratio, below which two different words never match
+MIN_SIMILARITY = 0.6
+# Cost of matching different words that sound the same
+HOMOPHONE_COST = 0.3
+# Length of the runs of desired words that are also used as anchors when they are unique
+FUZZY_ANCHOR_LENGTH = 3
+# Source words considered for desired words that are not between two consistent anchors, beyond twice their number
+FUZZY_WINDOW = 20
 
-        if output and output[-1].end >= start and output[-1].start < start:
-            output[-1] = Cut(output[-1].start, end)
+SOUNDEX_CODES = {
+    **dict.fromkeys("bfpv", "1"),
+    **dict.fromkeys("cgjkqsxz", "2"),
+    **dict.fromkeys("dt", "3"),
+    "l": "4",
+    **dict.fromkeys("mn", "5"),
+    "r": "6",
+}
+
+
+def soundex(word: str) -> str:
+    """American Soundex code of a word, such as "R163" for "robert" and "rupert"."""
+    letters = [c for c in word.lower() if c.isalpha()]
+    if not letters:
+        return word
+    code = letters[0].upper()
+    previous = SOUNDEX_CODES.get(letters[0], "")
+    for c in letters[1:]:
+        digit = SOUNDEX_CODES.get(c, "")
+        if digit and digit != previous:
+            code += digit
+        if c not in "hw":
+            previous = digit
+    return (code + "000")[:4]
+
+
+@lru_cache(maxsize=1 << 16)
+def word_cost(desired_word: str, source_word: str) -> float:
+    """Cost of matching a desired word to a source word: 0 for the same word, less than skipping it for words
+    that are spelled or sound alike, and infinite otherwise."""
+    if desired_word == source_word:
+        return 0.0
+    cost = 1.0 - SequenceMatcher(None, desired_word, source_word).ratio()
+    if cost > 1.0 - MIN_SIMILARITY:
+        cost = float("inf")
+    if soundex(desired_word) == soundex(source_word):
+        cost = min(cost, HOMOPHONE_COST)
+    return cost
+
+
+def _fuzzy_table(desired: List[str], source: List[str], free_start: bool) -> Tuple[list, list]:
+    """Weighted Damerau-Levenshtein table between desired and source words. `cost[a][b]` is the cost of aligning
+    the first `a` desired words with the first `b` source words, and `moves[a][b]` the last move: "m" match,
+    "d" skip a desired word, "s" skip a source word, "t" match two transposed words. With `free_start`, the
+    alignment can start anywhere in the source."""
+    inf = float("inf")
+    cost = [[inf] * (len(source) + 1) for _ in range(len(desired) + 1)]
+    moves = [[""] * (len(source) + 1) for _ in range(len(desired) + 1)]
+    for b in range(len(source) + 1):
+        cost[0][b] = 0.0 if free_start else b * SKIP_SOURCE_COST
+        moves[0][b] = "s"
+    for a in range(1, len(desired) + 1):
+        word = desired[a - 1]
+        row, previous_row = cost[a], cost[a - 1]
+        row[0], moves[a][0] = previous_row[0] + SKIP_DESIRED_COST, "d"
+        for b in range(1, len(source) + 1):
+            best, move = previous_row[b] + SKIP_DESIRED_COST, "d"
+            if row[b - 1] + SKIP_SOURCE_COST < best:
+                best, move = row[b - 1] + SKIP_SOURCE_COST, "s"
+            match = previous_row[b - 1] + word_cost(word, source[b - 1])
+            if match < best:
+                best, move = match, "m"
+            if a > 1 and b > 1:
+                transpose = (
+                    cost[a - 2][b - 2]
+                    + word_cost(word, source[b - 2])
+                    + word_cost(desired[a - 2], source[b - 1])
+                    + TRANSPOSE_COST
+                )
+                if transpose < best:
+                    best, move = transpose, "t"
+            row[b], moves[a][b] = best, move
+    return cost, moves
+
+
+def _fuzzy_traceback(moves: list, a: int, b: int) -> List[Optional[int]]:
+    """The source word matched to each of the first `a` desired words, or None, ending at `moves[a][b]`."""
+    matched = [None] * a
+    while a > 0:
+        move = moves[a][b]
+        if move == "m":
+            a, b = a - 1, b - 1
+            matched[a] = b
+        elif move == "t":
+            matched[a - 1], matched[a - 2] = b - 2, b - 1
+            a, b = a - 2, b - 2
+        elif move == "d":
+            a -= 1
         else:
-            output.append(Cut(start, end))
-    return output
+            b -= 1
+    return matched
+
+
+def _align_between(
+    desired: List[str],
+    words: Callable[[int, int], List[str]],
+    n_words: int,
+    after: Optional[int],
+    before: Optional[int],
+) -> List[Optional[int]]:
+    """Aligns desired words that come after the source word `after` and before the source word `before`.
+
+    If the anchors are close and in order, the words are aligned with the source between them. Otherwise the
+    desired words are split in two: the ones that continue after `after`, aligned with a window of source words
+    after it, and the ones that lead to `before`, aligned backwards with a window before it, at the split point
+    with the lowest total cost."""
+    window = 2 * len(desired) + FUZZY_WINDOW
+    if after is not None and before is not None and 0 < before - after <= window:
+        cost, moves = _fuzzy_table(desired, words(after + 1, before), free_start=False)
+        return [
+            None if b is None else after + 1 + b for b in _fuzzy_traceback(moves, len(desired), before - after - 1)
+        ]
+    if after is None and before is None:
+        cost, moves = _fuzzy_table(desired, words(0, n_words), free_start=True)
+        end = min(range(n_words + 1), key=lambda b: cost[len(desired)][b])
+        return _fuzzy_traceback(moves, len(desired), end)
+
+    forward_cost = [[0.0]]
+    if after is not None:
+        forward_start = after + 1
+        forward_cost, forward_moves = _fuzzy_table(
+            desired, words(forward_start, min(forward_start + window, n_words)), False
+        )
+    backward_cost = [[0.0]]
+    if before is not None:
+        backward_end = before
+        backward_source = words(max(backward_end - window, 0), backward_end)[::-1]
+        backward_cost, backward_moves = _fuzzy_table(desired[::-1], backward_source, False)
+    # Desired words before the split continue after `after`, the others lead to `before`.
+    splits = [len(desired)] if before is None else [0] if after is None else range(len(desired) + 1)
+    split = min(
+        splits,
+        key=lambda t: (min(forward_cost[t]) if after is not None else 0.0)
+        + (min(backward_cost[len(desired) - t]) if before is not None else 0.0),
+    )
+    matched = []
+    if after is not None:
+        end = min(range(len(forward_cost[split])), key=lambda b: forward_cost[split][b])
+        matched += [None if b is None else forward_start + b for b in _fuzzy_traceback(forward_moves, split, end)]
+    if before is not None:
+        rest = len(desired) - split
+        end = min(range(len(backward_cost[rest])), key=lambda b: backward_cost[rest][b])
+        matched += [None if b is None else backward_end - 1 - b for b in _fuzzy_traceback(backward_moves, rest, end)][
+            ::-1
+        ]
+    return matched
+
+
+def _ngram_keys(word_ids: np.ndarray, n: int, base: int) -> np.ndarray:
+    """One integer per run of `n` consecutive word ids, equal for equal runs."""
+    keys = np.zeros(max(len(word_ids) - n + 1, 0), dtype=np.int64)
+    for k in range(n):
+        keys = keys * base + word_ids[k : len(keys) + k]  # noqa: E203
+    return keys
+
+
+def unique_ngram_matches(index: TranscriptIndex, desired_words: List[str], n: int) -> List[Tuple[int, int]]:
+    """Pairs of (desired position, source position) of the runs of `n` words that appear exactly once in the
+    desired words and exactly once in the source. Runs are hashed with numpy, so this is fast on long inputs."""
+    base = len(index.vocabulary) + 1
+    if base**n >= 1 << 63:
+        return []
+    # Words that are not in the source get an id no source word has.
+    desired_ids = np.array([index._ids.get(word, base - 1) for word in desired_words], dtype=np.int64)
+    desired_keys = _ngram_keys(desired_ids, n, base)
+    source_keys, source_starts, source_counts = np.unique(
+        _ngram_keys(index.word_ids.astype(np.int64), n, base), return_index=True, return_counts=True
+    )
+    if len(source_keys) == 0:
+        return []
+    keys, starts, counts = np.unique(desired_keys, return_index=True, return_counts=True)
+    found = np.minimum(np.searchsorted(source_keys, keys), len(source_keys) - 1)
+    unique = (counts == 1) & (source_keys[found] == keys) & (source_counts[found] == 1)
+    return sorted(zip(starts[unique].tolist(), source_starts[found[unique]].tolist()))
+
+
+def align_fuzzy(
+    words: Union[List[str], TranscriptIndex], desired_transcription: str
+) -> Tuple[List[Optional[int]], List[str]]:
+    """Aligns a desired transcription that may have words the recognizer got wrong, or that are not in the
+    recording at all. Returns the position of the source word matched to each desired word, None for the ones
+    that were left unmatched, and the list of unmatched words.
+
+    Desired words, and runs of `FUZZY_ANCHOR_LENGTH` desired words, that appear exactly once in both
+    transcriptions are anchors. The other words that are in the
+    recording are aligned between the anchors around them with `pick_words_dynamic`. The remaining words are
+    aligned with a weighted Damerau-Levenshtein distance against the source words between their aligned
+    neighbours, where they can match words that are spelled or sound alike at a cost. Every step only looks near
+    its anchors, so the total time stays close to linear."""
+    index = _as_index(words)
+    desired_words = words_in_transcription(desired_transcription)
+    matched: List[Optional[int]] = [None] * len(desired_words)
+    for n in (1, FUZZY_ANCHOR_LENGTH):
+        for i, position in unique_ngram_matches(index, desired_words, n):
+            if all(p is None for p in matched[i : i + n]):  # noqa: E203
+                matched[i : i + n] = range(position, position + n)  # noqa: E203
+    anchors = [-1] + [i for i, position in enumerate(matched) if position is not None] + [len(desired_words)]
+
+    for previous, following in zip(anchors, anchors[1:]):
+        exact = [i for i in range(previous + 1, following) if len(index.positions(desired_words[i]))]
+        if not exact:
+            continue
+        try:
+            positions = pick_words_dynamic(
+                index,
+                " ".join(desired_words[i] for i in exact),
+                after=matched[previous] if previous >= 0 else None,
+                before=matched[following] if following < len(desired_words) else None,
+            )
+        except ValueError:
+            continue
+        for i, position in zip(exact, positions):
+            matched[i] = position
+
+    def source_words(start: int, end: int) -> List[str]:
+        return [index.vocabulary[word_id] for word_id in index.word_ids[start:end].tolist()]
+
+    i = 0
+    while i < len(desired_words):
+        if matched[i] is not None:
+            i += 1
+            continue
+        end = i
+        while end < len(desired_words) and matched[end] is None:
+            end += 1
+        after = matched[i - 1] if i > 0 else None
+        before = matched[end] if end < len(desired_words) else None
+        matched[i:end] = _align_between(desired_words[i:end], source_words, len(index), after, before)
+        i = end
+    skipped = [word for word, position in zip(desired_words, matched) if position is None]
+    return matched, skipped
+
+
+def pick_words_fuzzy(
+    words: Union[List[str], TranscriptIndex],
+    desired_transcription: str,
+) -> List[int]:
+    """Like the other pickers, but matches misrecognized words to similar ones with `align_fuzzy`, and leaves out
+    desired words that are not in the recording instead of failing."""
+    matched, skipped = align_fuzzy(words, desired_transcription)
+    if skipped:
+        print(f"Could not find {len(skipped)} words, they will be left out: {' '.join(skipped)}")
+    return [position for position in matched if position is not None]
+
+
+# Shortest run of words that `pick_words_phrases` locks as a phrase.
+PHRASE_MIN_LENGTH = 3
+# Occurrences of a run of `PHRASE_MIN_LENGTH` words that are extended into phrases. Common runs such as "and it
+# was" can occur thousands of times in a long recording.
+PHRASE_MAX_OCCURRENCES = 64
+
+
+def phrase_matches(
+    index: TranscriptIndex, desired_words: List[str], min_length: int = PHRASE_MIN_LENGTH
+) -> List[Tuple[int, int, int]]:
+    """Runs of at least `min_length` consecutive desired words that are also consecutive in the source, as
+    (desired position, source position, length), longest first.
+
+    Runs of `min_length` words are looked up by their hash in the sorted hashes of the source, and each match is
+    extended word by word. Only matches that cannot be extended backwards are extended, so every run is walked
+    once. Hashes may wrap around on very large vocabularies, but the extension compares the words themselves."""
+    base = len(index.vocabulary) + 1
+    desired_ids = np.array([index._ids.get(word, base - 1) for word in desired_words], dtype=np.int64)
+    desired_keys = _ngram_keys(desired_ids, min_length, base)
+    source_keys = _ngram_keys(index.word_ids.astype(np.int64), min_length, base)
+    if len(desired_keys) == 0 or len(source_keys) == 0:
+        return []
+    order = np.argsort(source_keys, kind="stable")
+    sorted_keys = source_keys[order]
+    starts = np.searchsorted(sorted_keys, desired_keys, "left").tolist()
+    ends = np.searchsorted(sorted_keys, desired_keys, "right").tolist()
+
+    desired = desired_ids.tolist()
+    source = index.word_ids
+    matches = []
+    for i, (start, end) in enumerate(zip(starts, ends)):
+        for p in order[start : min(end, start + PHRASE_MAX_OCCURRENCES)].tolist():  # noqa: E203
+            if i > 0 and p > 0 and desired[i - 1] == source[p - 1]:
+                continue
+            length = 0
+            while i + length < len(desired) and p + length < len(source) and desired[i + length] == source[p + length]:
+                length += 1
+            if length >= min_length:
+                matches.append((i, p, length))
+    matches.sort(key=lambda match: (-match[2], match[0], match[1]))
+    return matches
+
+
+def pick_words_phrases(
+    words: Union[List[str], TranscriptIndex],
+    desired_transcription: str,
+) -> List[int]:
+    """Aligns whole phrases before single words, so a paragraph that was moved is cut in one piece instead of
+    picking its common words one by one near the previous cut.
+
+    The longest runs of desired words that appear in the same order in the source are locked first, with
+    `phrase_matches`. A run that overlaps a longer one keeps the words that are still free. The remaining words
+    are aligned with `pick_words_dynamic` between the phrases around them."""
+    index = _as_index(words)
+    desired_words = words_in_transcription(desired_transcription)
+    chosen: List[Optional[int]] = [None] * len(desired_words)
+    for i, p, length in phrase_matches(index, desired_words):
+        run = 0
+        for k in range(length + 1):
+            if k < length and chosen[i + k] is None:
+                run += 1
+                continue
+            if run >= PHRASE_MIN_LENGTH:
+                chosen[i + k - run : i + k] = range(p + k - run, p + k)  # noqa: E203
+            run = 0
+
+    i = 0
+    while i < len(desired_words):
+        if chosen[i] is not None:
+            i += 1
+            continue
+        end = i
+        while end < len(desired_words) and chosen[end] is None:
+            end += 1
+        gap = " ".join(desired_words[i:end])
+        try:
+            chosen[i:end] = pick_words_dynamic(
+                index,
+                gap,
+                after=chosen[i - 1] if i > 0 else None,
+                before=chosen[end] if end < len(desired_words) else None,
+            )
+        except ValueError:
+            # The anchors can rule out the only occurrence of a word, which is then placed on its own.
+            chosen[i:end] = pick_words_dynamic(index, gap)
+        i = end
+    return chosen
+
+
+PICKERS = {
+    "greedy": pick_words_greedy,
+    "brute_force": pick_words_brute_force,
+    "dynamic": pick_words_dynamic,
+    "fuzzy": pick_words_fuzzy,
+    "phrases": pick_words_phrases,
+}
 
 
 def list_cuts(
-    transcription: List[WordAndSpan],
+    transcription: Union[Transcript, List[WordAndSpan]],
     desired_transcription: str,
     padding: datetime.timedelta,
     greedy: bool = False,
+    method: Optional[str] = None,
+    index: Optional[TranscriptIndex] = None,
+    snapper: Optional[BoundarySnapper] = None,
 ) -> List[Cut]:
     """Given a list of subtitles and a desired transcription, return a list of cuts
     (start, end) that correspond to segments of the media with the desired transcription. Also
-    includes a configurable margin of time before and after each cut."""
-    words = [word.word for word in transcription]
-    if greedy:
-        chosen_words = pick_words_greedy(words, desired_transcription)
-    else:
-        chosen_words = pick_words_brute_force(words, desired_transcription)
-    return compute_cuts(transcription, chosen_words, padding)
+    includes a configurable margin of time before and after each cut.
+
+    `method` is one of `PICKERS`; when it is not set, `greedy` chooses between "greedy" and "brute_force".
+    Pass the `TranscriptIndex` of the transcription as `index` to avoid rebuilding it on every call, and a
+    `BoundarySnapper` as `snapper` to place the edges of the cuts in silences."""
+    if method is None:
+        method = "greedy" if greedy else "brute_force"
+    if method not in PICKERS:
+        raise ValueError(f"Unknown alignment method: {method}")
+    transcription = Transcript.from_word_spans(transcription)
+    if index is None:
+        index = TranscriptIndex.from_transcript(transcription)
+    with profiler.stage("align"):
+        chosen_words = PICKERS[method](index, desired_transcription)
+    return _compute_profiled_cuts(transcription, chosen_words, padding, snapper)
+
+
+def _compute_profiled_cuts(
+    transcription: Transcript,
+    chosen_words: List[int],
+    padding: datetime.timedelta,
+    snapper: Optional[BoundarySnapper] = None,
+):
+    with profiler.stage("compute_cuts"):
+        cuts = compute_cuts(transcription, chosen_words, padding, snapper)
+    profiler.count("transcript_words", len(transcription))
+    profiler.count("desired_words", len(chosen_words))
+    profiler.count("cuts", len(cuts))
+    return cuts
+
+
+def realign_words(
+    words: Union[List[str], TranscriptIndex],
+    previous_words: List[str],
+    previous_chosen: List[int],
+    desired_words: List[str],
+) -> Tuple[List[int], int]:
+    """Updates the alignment `previous_chosen` of `previous_words` to `desired_words`, the words of an edited
+    transcription. Unchanged words keep their positions, and each changed region is aligned with
+    `pick_words_dynamic` between the fixed words around it. Returns the new alignment and the number of words
+    that were aligned again. If a changed region can't be aligned between the fixed words, the whole edited
+    transcription is aligned again.
+
+    The common prefix and suffix are skipped before diffing, so a small edit costs about the same whatever the
+    length of the transcriptions."""
+    index = _as_index(words)
+    prefix = 0
+    while prefix < min(len(previous_words), len(desired_words)) and previous_words[prefix] == desired_words[prefix]:
+        prefix += 1
+    suffix = 0
+    while (
+        suffix < min(len(previous_words), len(desired_words)) - prefix
+        and previous_words[-1 - suffix] == desired_words[-1 - suffix]
+    ):
+        suffix += 1
+    previous_end = len(previous_words) - suffix
+    desired_end = len(desired_words) - suffix
+
+    chosen = list(previous_chosen[:prefix])
+    realigned = 0
+    matcher = SequenceMatcher(
+        None, previous_words[prefix:previous_end], desired_words[prefix:desired_end], autojunk=False
+    )
+    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+        if tag == "equal":
+            chosen.extend(previous_chosen[prefix + i1 : prefix + i2])  # noqa: E203
+        elif j2 > j1:
+            region = desired_words[prefix + j1 : prefix + j2]  # noqa: E203
+            following = prefix + i2
+            try:
+                chosen.extend(
+                    pick_words_dynamic(
+                        index,
+                        " ".join(region),
+                        after=chosen[-1] if chosen else None,
+                        before=previous_chosen[following] if following < len(previous_chosen) else None,
+                    )
+                )
+            except ValueError:
+                # The fixed words around the region leave no valid position for it, e.g. when its only
+                # occurrence is the word before it. Other positions of the fixed words may still work.
+                return pick_words_dynamic(index, " ".join(desired_words)), len(desired_words)
+            realigned += len(region)
+    chosen.extend(previous_chosen[previous_end:])
+    return chosen, realigned
+
+
+def load_alignment(path: Union[str, Path], fingerprint: str) -> Optional[Tuple[List[str], List[int]]]:
+    """The desired words and chosen positions saved in `path`, if they were aligned to the same transcription."""
+    try:
+        with open(path, "r") as f:
+            data = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if data.get("fingerprint") != fingerprint:
+        return None
+    return data["words"], data["chosen"]
+
+
+def save_alignment(path: Union[str, Path], fingerprint: str, desired_words: List[str], chosen: List[int]):
+    with open(path, "w") as f:
+        json.dump({"fingerprint": fingerprint, "words": desired_words, "chosen": chosen}, f)
+
+
+def list_cuts_incremental(
+    transcription: Union[Transcript, List[WordAndSpan]],
+    desired_transcription: str,
+    padding: datetime.timedelta,
+    alignment_file: Union[str, Path],
+    index: Optional[TranscriptIndex] = None,
+    snapper: Optional[BoundarySnapper] = None,
+) -> List[Cut]:
+    """Like `list_cuts` with the "dynamic" method, but saves the alignment in `alignment_file`, and on the next
+    call only aligns the words of the desired transcription that changed since then, with `realign_words`."""
+    transcription = Transcript.from_word_spans(transcription)
+    if index is None:
+        index = TranscriptIndex.from_transcript(transcription)
+    with profiler.stage("align"):
+        fingerprint = transcription.fingerprint
+        desired_words = words_in_transcription(desired_transcription)
+        previous = load_alignment(alignment_file, fingerprint)
+        if previous is None:
+            chosen_words = pick_words_dynamic(index, desired_transcription)
+            realigned = len(desired_words)
+        else:
+            chosen_words, realigned = realign_words(index, previous[0], previous[1], desired_words)
+        print(f"Aligned {realigned} of {len(desired_words)} words")
+        save_alignment(alignment_file, fingerprint, desired_words, chosen_words)
+    profiler.count("realigned_words", realigned)
+    return _compute_profiled_cuts(transcription, chosen_words, padding, snapper)
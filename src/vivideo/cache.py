@@ -0,0 +1,166 @@
+import hashlib
+import json
+import os
+import tempfile
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from pathlib import Path
+from stat import S_ISREG
+from typing import List, Optional
+
+# Bytes read from each of the evenly spaced samples of a media file when hashing it.
+SAMPLE_SIZE = 1 << 16
+N_SAMPLES = 16
+DEFAULT_MAX_MB = 1024
+DEFAULT_SEGMENT_MAX_MB = 10240
+# Temporary files that haven't been written for this long were left by a process that was killed.
+STALE_TMP_SECONDS = 3600
+
+
+def default_cache_dir() -> Path:
+    if "VIVIDEO_CACHE_DIR" in os.environ:
+        return Path(os.environ["VIVIDEO_CACHE_DIR"])
+    return Path(os.environ.get("XDG_CACHE_HOME", Path.home() / ".cache")) / "vivideo"
+
+
+def media_hash(media_file: str) -> str:
+    """Fast content hash of a media file: its size and `N_SAMPLES` evenly spaced blocks of `SAMPLE_SIZE` bytes.
+
+    The path and modification time are not part of the hash, so identical files share transcripts."""
+    size = os.path.getsize(media_file)
+    digest = hashlib.blake2b(str(size).encode("utf-8"), digest_size=20)
+    with open(media_file, "rb") as f:
+        if size <= N_SAMPLES * SAMPLE_SIZE:
+            digest.update(f.read())
+        else:
+            step = (size - SAMPLE_SIZE) // (N_SAMPLES - 1)
+            for i in range(N_SAMPLES):
+                f.seek(i * step)
+                digest.update(f.read(SAMPLE_SIZE))
+    return digest.hexdigest()
+
+
+def model_identity(model_path: Optional[str] = None, model_name: Optional[str] = None) -> str:
+    if model_path is not None:
+        return f"path:{Path(model_path).resolve()}"
+    if model_name is not None:
+        return f"name:{model_name}"
+    return "lang:en-us"
+
+
+class TranscriptCache:
+    """Directory of transcripts keyed by the content of the media, the model and the grammar.
+
+    Writes are atomic, and the least recently used transcripts are removed when the cache grows over
+    `max_bytes`, which defaults to the `VIVIDEO_CACHE_MAX_MB` environment variable or 1GB."""
+
+    def __init__(self, directory: Optional[str] = None, max_bytes: Optional[int] = None):
+        self.directory = Path(directory) if directory is not None else default_cache_dir()
+        if max_bytes is None:
+            max_bytes = int(os.environ.get("VIVIDEO_CACHE_MAX_MB", DEFAULT_MAX_MB)) << 20
+        self.max_bytes = max_bytes
+
+    @staticmethod
+    def key(media_file: str, model: str, grammar: Optional[List[str]] = None) -> str:
+        description = {"media": media_hash(media_file), "model": model, "grammar": grammar}
+        return hashlib.sha256(json.dumps(description, sort_keys=True).encode("utf-8")).hexdigest()
+
+    def path(self, key: str, suffix: str = ".json") -> Path:
+        return self.directory / f"{key}{suffix}"
+
+    def get(self, key: str) -> Optional[List[dict]]:
+        path = self.path(key)
+        try:
+            with open(path, "r") as f:
+                data = json.load(f)
+        except (OSError, json.JSONDecodeError):
+            return None
+        self.touch(path)
+        return data
+
+    @staticmethod
+    def touch(path: Path):
+        """Records the use of an entry, for eviction."""
+        os.utime(path)
+
+    def put(self, key: str, data: List[dict]):
+        with self.atomic_write(self.path(key), "w") as f:
+            json.dump(data, f)
+        self.evict()
+
+    @contextmanager
+    def atomic_write(self, path: Path, mode: str = "wb"):
+        """Writes to a temporary file in the cache that replaces `path` when the block exits without errors."""
+        self.directory.mkdir(parents=True, exist_ok=True)
+        f = tempfile.NamedTemporaryFile(mode, dir=self.directory, suffix=".tmp", delete=False)
+        try:
+            with f:
+                yield f
+            os.replace(f.name, path)
+        except BaseException:
+            os.remove(f.name)
+            raise
+
+    def evict(self):
+        """Removes the least recently used entries, with all their files, until the cache fits in `max_bytes`.
+        Checkpoints of transcriptions, and anything that is not a regular file, like the socket of the transcription
+        server or the folders of other caches, are never removed. Files being written count towards the size of the cache,
+        and are removed once they haven't been written for `STALE_TMP_SECONDS`."""
+        if not self.directory.exists():
+            return
+        entries = defaultdict(lambda: [0.0, 0, []])
+        writing = 0
+        stale = time.time() - STALE_TMP_SECONDS
+        for path in self.directory.iterdir():
+            if path.suffix == ".jsonl":
+                continue
+            try:
+                stat = path.stat()
+            except OSError:
+                continue
+            if not S_ISREG(stat.st_mode):
+                continue
+            if ".tmp" in path.suffixes:
+                if stat.st_mtime >= stale:
+                    writing += stat.st_size
+                    continue
+                try:
+                    path.unlink()
+                except OSError:
+                    pass
+                continue
+            entry = entries[path.name.split(".")[0]]
+            entry[0] = max(entry[0], stat.st_mtime)
+            entry[1] += stat.st_size
+            entry[2].append(path)
+        total = writing + sum(size for _, size, _ in entries.values())
+        for _, size, paths in sorted(entries.values(), key=lambda entry: entry[0]):
+            if total <= self.max_bytes:
+                break
+            for path in paths:
+                try:
+                    path.unlink()
+                except OSError:
+                    pass
+            total -= size
+
+
+class SegmentCache(TranscriptCache):
+    """Directory of rendered segments keyed by the content of the source media and everything that changes how a
+    cut is encoded, so re-rendering an edit only encodes the cuts that changed.
+
+    Segments are kept in the `segments` folder of the cache, which is limited to `max_bytes`, the
+    `VIVIDEO_SEGMENT_CACHE_MAX_MB` environment variable or 10GB by default."""
+
+    def __init__(self, directory: Optional[str] = None, max_bytes: Optional[int] = None):
+        if directory is None:
+            directory = default_cache_dir() / "segments"
+        if max_bytes is None:
+            max_bytes = int(os.environ.get("VIVIDEO_SEGMENT_CACHE_MAX_MB", DEFAULT_SEGMENT_MAX_MB)) << 20
+        super().__init__(directory, max_bytes)
+
+    @staticmethod
+    def segment_key(source_hash: str, **parameters) -> str:
+        description = {"media": source_hash, **parameters}
+        return hashlib.sha256(json.dumps(description, sort_keys=True).encode("utf-8")).hexdigest()
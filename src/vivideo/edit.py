@@ -1,17 +1,64 @@
 import argparse
 import datetime
+import multiprocessing
 import os
+import re
+import signal
 import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import FIRST_EXCEPTION, ThreadPoolExecutor, wait
 from pathlib import Path
+from typing import Dict, List, NamedTuple, Optional, Tuple
 
+import imageio_ffmpeg
+import numpy as np
 from videogrep.videogrep import create_supercut_in_batches
 
-from vivideo.align import list_cuts
-from vivideo.transcribe import transcribe
+from vivideo.align import PICKERS, SourceTimeline, TranscriptIndex, list_cuts, list_cuts_incremental
+from vivideo.cache import SegmentCache, default_cache_dir, media_hash
+from vivideo.profiling import profiler
+from vivideo.silence import BoundarySnapper, EnergyEnvelope
+from vivideo.transcribe import transcribe, transcribe_many
+
+FFMPEG = imageio_ffmpeg.get_ffmpeg_exe()
+# Seconds between checks of the desired transcription in watch mode
+WATCH_INTERVAL = 0.2
+# Height of the proxy rendered by --preview proxy, and its keyframe interval, short for fast seeking
+PROXY_HEIGHT = 360
+PROXY_GOP = 12
+# Most inputs the 'filter' renderer opens, each with its own decoder, before it renders segments instead
+MAX_FILTER_INPUTS = 16
+# Fast encoder settings for the segments of previews
+PREVIEW_ENCODE_ARGS = {
+    "proxy": ["-c:v", "libx264", "-preset", "ultrafast", "-crf", "30", "-c:a", "aac", "-b:a", "96k"],
+    "audio": ["-vn", "-c:a", "aac", "-b:a", "96k"],
+}
+
+
+def parse_range(text: str) -> Tuple[Optional[float], Optional[float]]:
+    """Parses "START:END", where either bound may be left out, like a Python slice."""
+    start, separator, end = text.partition(":")
+    if not separator:
+        raise argparse.ArgumentTypeError(f"Expected START:END, got {text}")
+    try:
+        return (float(start) if start else None, float(end) if end else None)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"Expected numbers in START:END, got {text}")
+
 
 parser = argparse.ArgumentParser(description="Edit Media")
 
-parser.add_argument("-i", "--input_media_file", help="Input file", required=True)
+parser.add_argument(
+    "-i",
+    "--input_media_file",
+    help="Input file. With several files, the edited transcription can use the words of any of them",
+    dest="input_media_files",
+    nargs="+",
+    required=True,
+)
 parser.add_argument("-t", "--desired_transcription_file", help="Edited transcription TXT file", required=True)
 parser.add_argument("-p", "--padding", default=10, help="Buffer between utterences in milliseconds", type=int)
 parser.add_argument("-f", "--fade_ms", default=0, help="Fade In/Out Buffer between utterences", type=int)
@@ -21,6 +68,7 @@ parser.add_argument(
     "-v", "--loglevel", help="FFMpeg loglevel option. Refer to https://ffmpeg.org/ffmpeg.html", default="16"
 )
 parser.add_argument("-m", "--model_path", help="Path for vosk model", default=None)
+parser.add_argument("-c", "--cache_dir", help="Transcript cache folder", default=None)
 parser.add_argument(
     "-d",
     "--dry_run",
@@ -37,6 +85,131 @@ parser.add_argument(
     default=True,
     action=argparse.BooleanOptionalAction,
 )
+parser.add_argument(
+    "-a",
+    "--align_method",
+    help="Alignment method. Overrides --greedy. 'dynamic' finds the alignment with fewest jumps, "
+    "'phrases' keeps moved sentences in one piece",
+    choices=sorted(PICKERS),
+    default=None,
+)
+parser.add_argument(
+    "-I",
+    "--incremental",
+    help=(
+        "Save the alignment next to the edited transcription, and on the next run only align the words that "
+        "changed. Uses the 'dynamic' alignment method"
+    ),
+    dest="incremental",
+    default=False,
+    action=argparse.BooleanOptionalAction,
+)
+
+parser.add_argument(
+    "-w",
+    "--watch",
+    help=(
+        "Keep running, and cut the media again every time the edited transcription is saved. A render still running "
+        "when the transcription is saved again is cancelled"
+    ),
+    dest="watch",
+    default=False,
+    action=argparse.BooleanOptionalAction,
+)
+
+parser.add_argument(
+    "--preview",
+    help=(
+        "Quickly render a draft next to the output file instead of the final edit. 'proxy' cuts a low resolution "
+        "copy of the input, created once and cached, and 'audio' renders only the audio"
+    ),
+    choices=["proxy", "audio"],
+    default=None,
+)
+parser.add_argument(
+    "--preview_cuts",
+    help="Only preview the cuts with indices from START to END, like a Python slice, e.g. 10:20",
+    type=parse_range,
+    default=None,
+)
+parser.add_argument(
+    "--preview_window",
+    help="Only preview from START to END seconds of the edited media, e.g. 60:90",
+    type=parse_range,
+    default=None,
+)
+
+parser.add_argument(
+    "--profile",
+    help=(
+        "Print the time spent in each stage and counters of the run, and save them as JSON to this file, or next "
+        "to the output file as .profile.json"
+    ),
+    nargs="?",
+    const="",
+    default=None,
+)
+
+parser.add_argument(
+    "--snap_silence",
+    help=(
+        "Move the edges of each cut to the quietest point of the audio up to this many milliseconds before its first "
+        "word and after its last word, instead of using --padding. The audio energy is computed once and cached"
+    ),
+    default=None,
+    type=int,
+)
+parser.add_argument(
+    "--max_silence",
+    help="Shorten silences inside the cuts that are longer than this many milliseconds to this length",
+    default=None,
+    type=int,
+)
+
+parser.add_argument(
+    "--segment_cache",
+    help=(
+        "Keep the segments extracted by the 'segments' renderer in the cache, so rendering again after changing "
+        "the transcription only encodes the cuts that changed"
+    ),
+    dest="segment_cache",
+    default=True,
+    action=argparse.BooleanOptionalAction,
+)
+
+parser.add_argument(
+    "-j",
+    "--jobs",
+    help="Number of segments extracted in parallel by ffmpeg. Defaults to the number of cores",
+    default=os.cpu_count() or 1,
+    type=int,
+)
+
+parser.add_argument(
+    "-r",
+    "--render",
+    help=(
+        "How to render the cuts. 'segments' extracts each cut to its own file and concatenates them, 'filter' "
+        "renders everything with a single ffmpeg filter graph, without intermediate files. It opens the media "
+        "again for each cut that starts before the cuts that come before it, and renders segments if that takes "
+        f"more than {MAX_FILTER_INPUTS} inputs. 'auto' uses videogrep when there is no fade or speed change, and "
+        "'segments' otherwise"
+    ),
+    choices=["auto", "segments", "filter"],
+    default="auto",
+)
+
+parser.add_argument(
+    "-k",
+    "--smart_cut",
+    help=(
+        "Copy the video between keyframes instead of re-encoding it. Needs --fade_ms 0 and --speed 1. 'snap' moves "
+        "the start of each cut to the previous keyframe and copies everything. 'exact' only re-encodes from the "
+        "cut points to the nearest keyframes"
+    ),
+    choices=["snap", "exact"],
+    default=None,
+)
 
 
 def edit_main():
@@ -45,103 +218,339 @@ def edit_main():
     re-ordering trimmed segments of original media
     """
     args = parser.parse_args()
+    if args.smart_cut is not None and (args.speed != 1.0 or args.fade_ms != 0):
+        print("--smart_cut can't be used with --fade_ms or --speed")
+        exit(1)
+
+    if args.profile is not None:
+        profiler.enable()
+    args.input_media_file = args.input_media_files[0]
+
+    timeline = None
+    if len(args.input_media_files) == 1:
+        with profiler.stage("load_transcript"):
+            transcription = transcribe(args.input_media_file, model_path=args.model_path, cache_dir=args.cache_dir)
+        with profiler.stage("load_index"):
+            index = TranscriptIndex.from_transcript(transcription)
+    else:
+        with profiler.stage("load_transcript"):
+            transcripts = transcribe_many(
+                args.input_media_files, model_path=args.model_path, cache_dir=args.cache_dir, jobs=args.jobs
+            )
+        with profiler.stage("load_index"):
+            timeline, transcription = SourceTimeline.join(args.input_media_files, transcripts)
+            index = TranscriptIndex.from_transcript(transcription)
+    snapper = None
+    if args.snap_silence is not None or args.max_silence is not None:
+        with profiler.stage("load_envelope"):
+            snapper = BoundarySnapper(
+                load_envelope(args, timeline),
+                window=datetime.timedelta(milliseconds=args.snap_silence or 0),
+                max_silence=None if args.max_silence is None else datetime.timedelta(milliseconds=args.max_silence),
+            )
+    if args.watch:
+        watch(args, transcription, index, snapper=snapper, timeline=timeline)
+        return
 
     with open(args.desired_transcription_file, "r") as f:
         desired_transcription = f.read()
-    transcription = transcribe(args.input_media_file, model_path=args.model_path)
+    cuts = align(args, transcription, index, desired_transcription, snapper, timeline)
+    with profiler.stage("render"):
+        render_cuts(args, cuts)
+
+    if args.profile is not None:
+        if Path(args.output_file).exists() and not args.dry_run:
+            profiler.count("bytes_written", Path(args.output_file).stat().st_size)
+        print(profiler.summary())
+        profile_file = args.profile or str(Path(args.output_file).with_suffix(".profile.json"))
+        profiler.save(profile_file)
+        print("Saved profile to", profile_file)
+
+
+def load_envelope(args, timeline: Optional[SourceTimeline] = None) -> EnergyEnvelope:
+    """Energy envelope of the input media, or of all the input media files on the timeline of a multi-source edit,
+    computed at the same time."""
+    if timeline is None:
+        return EnergyEnvelope.load_or_compute(args.input_media_file, cache_dir=args.cache_dir)
+    with ThreadPoolExecutor(max_workers=max(1, args.jobs)) as executor:
+        envelopes = list(
+            executor.map(
+                lambda media_file: EnergyEnvelope.load_or_compute(media_file, cache_dir=args.cache_dir),
+                timeline.media_files,
+            )
+        )
+    return EnergyEnvelope.concatenate(envelopes, timeline.offsets_us)
 
+
+def align(
+    args,
+    transcription,
+    index: TranscriptIndex,
+    desired_transcription: str,
+    snapper: Optional[BoundarySnapper] = None,
+    timeline: Optional[SourceTimeline] = None,
+):
+    """Aligns the desired transcription and returns its cuts. In a multi-source edit, `transcription` is the joined
+    transcript of the `timeline`, and the cuts are tagged with their media file."""
     padding = datetime.timedelta(milliseconds=args.padding)
-    cuts = list_cuts(transcription, desired_transcription=desired_transcription, padding=padding, greedy=args.greedy)
+    if args.incremental:
+        cuts = list_cuts_incremental(
+            transcription,
+            desired_transcription=desired_transcription,
+            padding=padding,
+            alignment_file=Path(args.desired_transcription_file).with_suffix(".alignment.json"),
+            index=index,
+            snapper=snapper,
+        )
+    else:
+        cuts = list_cuts(
+            transcription,
+            desired_transcription=desired_transcription,
+            padding=padding,
+            greedy=args.greedy,
+            method=args.align_method,
+            index=index,
+            snapper=snapper,
+        )
+    if timeline is not None:
+        cuts = timeline.cuts(cuts)
     print(f"Found {len(cuts)} cuts")
     if args.dry_run:
         for i, cut in enumerate(cuts):
-            print(f"{i}: {cut.start} - {cut.end}")
+            print(f"{i}: {cut.start} - {cut.end}" + ("" if cut.source is None else f" {cut.source}"))
+    return cuts
+
 
-    if args.speed == 1.0 and args.fade_ms == 0 and (not args.input_media_file.endswith(".wav")):
+def render_cuts(args, cuts):
+    if args.preview is not None:
+        render_preview(args, cuts)
+    elif args.smart_cut is not None:
+        cut_with_smart_cut(args, cuts)
+    elif args.render == "filter":
+        cut_with_ffmpeg_filter(args, cuts)
+    elif (
+        args.render == "auto"
+        and args.speed == 1.0
+        and args.fade_ms == 0
+        and not any((cut.source or args.input_media_file).endswith(".wav") for cut in cuts)
+    ):
         cut_with_videogrep(args, cuts)
     else:
         cut_with_ffmpeg(args, cuts)
 
 
+def _render_in_process_group(args, cuts):
+    # A process group of its own, so cancelling the render also stops the ffmpeg processes it started.
+    os.setpgrp()
+    # Cancelling raises SystemExit, so the render removes its intermediate files before exiting.
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(128 + signum))
+    render_cuts(args, cuts)
+
+
+def cancel_render(process: multiprocessing.Process):
+    try:
+        os.killpg(process.pid, signal.SIGTERM)
+    except (ProcessLookupError, PermissionError):
+        # The render did not create its process group yet.
+        process.terminate()
+    process.join()
+
+
+def watch(
+    args,
+    transcription,
+    index: TranscriptIndex,
+    stop: Optional[threading.Event] = None,
+    snapper: Optional[BoundarySnapper] = None,
+    timeline: Optional[SourceTimeline] = None,
+):
+    """Aligns and renders the desired transcription every time it is saved, until interrupted or until `stop` is
+    set. The transcript and the index stay in memory between saves. Each render runs in a forked process, and is
+    cancelled when the desired transcription is saved again before it finishes."""
+    context = multiprocessing.get_context("fork")
+    path = Path(args.desired_transcription_file)
+    stop = stop or threading.Event()
+    last_modified = None
+    render = None
+    started = 0.0
+    print(f"Watching {path}. Press Ctrl+C to stop")
+    try:
+        while not stop.is_set():
+            try:
+                modified = path.stat().st_mtime_ns
+            except FileNotFoundError:
+                # Some editors replace the file on save.
+                modified = last_modified
+            if modified != last_modified:
+                last_modified = modified
+                if render is not None and render.is_alive():
+                    print("Cancelling the previous render")
+                    cancel_render(render)
+                render = None
+                started = time.perf_counter()
+                try:
+                    with open(path, "r") as f:
+                        cuts = align(args, transcription, index, f.read(), snapper, timeline)
+                except (OSError, ValueError) as e:
+                    print(e)
+                else:
+                    render = context.Process(target=_render_in_process_group, args=(args, cuts))
+                    render.start()
+            if render is not None and not render.is_alive():
+                if render.exitcode == 0:
+                    print(f"Rendered {args.output_file} in {time.perf_counter() - started:.2f}s")
+                else:
+                    print(f"Render failed with exit code {render.exitcode}")
+                render = None
+            stop.wait(WATCH_INTERVAL)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if render is not None and render.is_alive():
+            cancel_render(render)
+
+
 def cut_with_videogrep(args, cuts):
     if args.dry_run:
         return
     composition = [
-        {"start": cut.start.total_seconds(), "end": cut.end.total_seconds(), "file": args.input_media_file}
+        {
+            "start": cut.start.total_seconds(),
+            "end": cut.end.total_seconds(),
+            "file": cut.source or args.input_media_file,
+        }
         for cut in cuts
     ]
     create_supercut_in_batches(composition, args.output_file)
 
 
+def segment_command(args, cut, segment_path: Path) -> List[str]:
+    """Builds the ffmpeg command that extracts one cut, with optional fades.
+
+    Seeking happens on the input side, so ffmpeg jumps close to the cut instead of decoding everything before it,
+    and then decodes exactly `-t` seconds from the cut start. Timestamps restart at zero, so the fades are placed
+    relative to the segment."""
+    start = cut.start.total_seconds()
+    duration = cut.end.total_seconds() - start
+    fade_seconds = datetime.timedelta(milliseconds=args.fade_ms).total_seconds()
+    audio_video_filter = []
+    if args.fade_ms > 0 and args.preview != "audio":
+        audio_video_filter = [
+            # video Filter
+            "-vf",
+            ",".join(
+                [
+                    f"fade=t=in:st=0:d={fade_seconds}",
+                    f"fade=t=out:st={duration - fade_seconds:.6f}:d={fade_seconds}",
+                    "setpts=N/FRAME_RATE/TB",
+                ]
+            ),
+        ]
+    if args.fade_ms > 0:
+        audio_video_filter += [
+            # # Audio Filter
+            "-af",
+            ",".join(
+                [
+                    f"afade=t=in:st=0:d={fade_seconds}",
+                    f"afade=t=out:st={duration - fade_seconds:.6f}:d={fade_seconds}",
+                    "asetpts=N/SR/TB",
+                ]
+            ),
+        ]
+
+    return (
+        [
+            FFMPEG,
+            # Seek
+            "-ss",
+            f"{start:.6f}",
+            # Input media file
+            "-i",
+            cut.source or args.input_media_file,
+            # Trim
+            "-t",
+            f"{duration:.6f}",
+        ]
+        + audio_video_filter
+        + PREVIEW_ENCODE_ARGS.get(args.preview, [])
+        + [
+            # Overwrite output
+            "-y",
+            # Loglevel
+            "-v",
+            args.loglevel,
+            str(segment_path),
+        ]
+    )
+
+
 def cut_with_ffmpeg(args, cuts):
+    """Extracts each cut to its own segment and concatenates them. With `--segment_cache`, segments are kept in
+    the segment cache, and only cuts that are not there yet are encoded.
+
+    Segments are extracted grouped by media file and in the order of the cuts within it, so each file is read
+    from start to end, and concatenated in the order of the edit."""
     output_path = Path(args.output_file)
     segments = []
     cmds = []
+    # Media file and start of the cut of each command, the order in which they run.
+    reads = []
+    # Temporary paths of the segments being encoded, and their paths in the segment cache.
+    encoding = {}
 
-    fade_seconds = datetime.timedelta(milliseconds=args.fade_ms).total_seconds()
-    audio_video_filter = []
+    cache = None
+    source_hashes = {}
+    if args.segment_cache:
+        cache = SegmentCache(None if args.cache_dir is None else Path(args.cache_dir) / "segments")
 
     for c, cut in enumerate(cuts):
-        segment_path = output_path.with_stem(f"segment_{c}")
-
-        if args.fade_ms > 0:
-            audio_video_filter = [
-                # video Filter
-                "-vf",
-                ",".join(
-                    [
-                        f"fade=t=in:st={cut.start.total_seconds()}:d={fade_seconds}",
-                        f"fade=t=out:st={cut.end.total_seconds()-fade_seconds}:d={fade_seconds}",
-                        "setpts=N/FRAME_RATE/TB",
-                    ]
-                ),
-                # # Audio Filter
-                "-af",
-                ",".join(
-                    [
-                        f"afade=t=in:st={cut.start.total_seconds()}:d={fade_seconds}",
-                        f"afade=t=out:st={cut.end.total_seconds()-fade_seconds}:d={fade_seconds}",
-                        "asetpts=N/SR/TB",
-                    ]
-                ),
-            ]
-
+        source = cut.source or args.input_media_file
+        if cache is None:
+            segment_path = output_path.with_stem(f"segment_{c}")
+        else:
+            if source not in source_hashes:
+                source_hashes[source] = media_hash(source)
+            cached_path = cache.path(
+                segment_key(args, source_hashes[source], cut, output_path.suffix), output_path.suffix
+            )
+            segments.append(cached_path)
+            if cached_path.exists():
+                cache.touch(cached_path)
+                continue
+            segment_path = cached_path.with_suffix(".tmp" + output_path.suffix)
+            if segment_path in encoding:
+                continue
+            encoding[segment_path] = cached_path
         # Create List of Segment Trim w/ Fade Commands for FFMpeg
-        cmd = (
-            [
-                "ffmpeg",
-                # Input media file
-                "-i",
-                args.input_media_file,
-                # Trim
-                "-ss",
-                f"{int(1000 * cut.start.total_seconds())}ms",
-                "-to",
-                f"{int(1000 * cut.end.total_seconds())}ms",
-            ]
-            + audio_video_filter
-            + [
-                # Overwrite output
-                "-y",
-                # Loglevel
-                "-v",
-                args.loglevel,
-                str(segment_path),
-            ]
-        )
-        cmds.append(cmd)
-
-        # Create List of Segment Files Filter Options for FFMpeg Concat
-        segments.append(segment_path)
+        cmds.append(segment_command(args, cut, segment_path))
+        reads.append((source, cut.start))
+        if cache is None:
+            # Create List of Segment Files Filter Options for FFMpeg Concat
+            segments.append(segment_path)
 
-    for i, cmd in enumerate(cmds):
-        if args.dry_run:
-            print(" ".join(cmd))
-        else:
-            print("Running command: %i" % i, " ".join(cmd))
-            subprocess.run(cmd)
+    cmds = [cmd for _, cmd in sorted(zip(reads, cmds), key=lambda read_and_cmd: read_and_cmd[0])]
+    if cache is None:
+        run_segment_commands(args, cmds, segments)
+    else:
+        print(f"Encoding {len(cmds)} of {len(cuts)} segments, the others are cached")
+        if not args.dry_run:
+            cache.directory.mkdir(parents=True, exist_ok=True)
+        try:
+            run_segment_commands(args, cmds, list(encoding))
+            if not args.dry_run:
+                for segment_path, cached_path in encoding.items():
+                    os.replace(segment_path, cached_path)
+                    profiler.count("bytes_written", cached_path.stat().st_size)
+        finally:
+            # Segments of a render that failed or was interrupted are not left in the cache
+            remove_files([segment_path for segment_path in encoding if segment_path.exists()])
+        profiler.count("segments_reused", len(cuts) - len(cmds))
+    profiler.count("segments_encoded", len(cmds))
 
-    if args.speed != 1.0:
+    if args.speed != 1.0 and args.preview == "audio":
+        speed_args = ["-filter:a", f"atempo={args.speed}"] + PREVIEW_ENCODE_ARGS["audio"]
+    elif args.speed != 1.0:
         speed_args = [
             "-filter_complex",
             f"[0:v]setpts={1.0/args.speed}*PTS[v];[0:a]atempo={args.speed}[a]",
@@ -149,25 +558,364 @@ def cut_with_ffmpeg(args, cuts):
             "[v]",
             "-map",
             "[a]",
-        ]
+        ] + PREVIEW_ENCODE_ARGS.get(args.preview, [])
+    elif args.preview is not None:
+        # Preview segments share their codec, so they are joined without re-encoding
+        speed_args = ["-c", "copy"]
     else:
         speed_args = []
 
-    # Concat Segments
-    list_path = output_path.with_stem("video_segments").with_suffix(".txt")
-    cmd_concat = (
+    concat_segments(args, segments, speed_args, keep_segments=cache is not None)
+    if cache is not None and not args.dry_run:
+        # Only after the concat, so none of the segments of this edit is removed before it is used
+        cache.evict()
+
+
+def select_preview_cuts(cuts, cut_range=None, window=None):
+    """Keeps the cuts with indices in `cut_range`, then the part of them that plays within `window`, in seconds
+    from the start of the edited media."""
+    if cut_range is not None:
+        first, last = (None if bound is None else int(bound) for bound in cut_range)
+        cuts = cuts[first:last]
+    if window is None:
+        return cuts
+    window_start = datetime.timedelta(seconds=window[0] or 0)
+    window_end = None if window[1] is None else datetime.timedelta(seconds=window[1])
+    selected = []
+    position = datetime.timedelta(0)
+    for cut in cuts:
+        cut_start = cut.start + max(window_start - position, datetime.timedelta(0))
+        cut_end = cut.end if window_end is None else min(cut.end, cut.start + (window_end - position))
+        if cut_start < cut_end:
+            selected.append(cut._replace(start=cut_start, end=cut_end))
+        position += cut.end - cut.start
+    return selected
+
+
+def proxy_file(args, media_file: Optional[str] = None) -> Path:
+    """Low resolution copy of the input media, or of `media_file`, for previews. It is rendered once and kept in the
+    cache, keyed by the content of the media. Media without video is its own proxy."""
+    media_file = media_file or args.input_media_file
+    has_video, _ = probe_streams(media_file)
+    if not has_video:
+        return Path(media_file)
+    # Not in the folder of the segments, whose eviction would throw away proxies that take long to encode
+    cache = SegmentCache(Path(args.cache_dir or default_cache_dir()) / "proxies")
+    key = SegmentCache.segment_key(media_hash(media_file), height=PROXY_HEIGHT, gop=PROXY_GOP, ffmpeg=FFMPEG)
+    path = cache.path(key, ".mp4")
+    if path.exists():
+        cache.touch(path)
+        return path
+    cache.directory.mkdir(parents=True, exist_ok=True)
+    temporary_path = path.with_suffix(".tmp.mp4")
+    cmd = (
         [
-            "ffmpeg",
-            # Force Format
-            "-f",
-            "concat",
-            "-safe",
-            "0",
-            # File of input media
+            FFMPEG,
             "-i",
-            f"{str(list_path)}",
+            media_file,
+            "-vf",
+            f"scale=-2:{PROXY_HEIGHT}",
+            "-g",
+            str(PROXY_GOP),
         ]
-        + speed_args
+        + PREVIEW_ENCODE_ARGS["proxy"]
+        + ["-y", "-v", args.loglevel, str(temporary_path)]
+    )
+    print("Creating preview proxy:", " ".join(cmd))
+    try:
+        subprocess.run(cmd, check=True)
+    except BaseException:
+        remove_files([temporary_path])
+        raise
+    os.replace(temporary_path, path)
+    cache.evict()
+    return path
+
+
+def render_preview(args, cuts):
+    """Renders a quick draft of the edit next to the output file: from the low resolution proxy of the input, or
+    only the audio. Segments are encoded with fast settings, kept in the segment cache unless it is turned off, and
+    joined without re-encoding."""
+    cuts = select_preview_cuts(cuts, args.preview_cuts, args.preview_window)
+    if not cuts:
+        print("No cuts to preview")
+        return
+    output_path = Path(args.output_file)
+    suffix = ".m4a" if args.preview == "audio" else ".mp4"
+    preview_args = argparse.Namespace(**vars(args))
+    preview_args.output_file = str(output_path.with_name(f"{output_path.stem}.preview{suffix}"))
+    if args.preview == "proxy" and not args.dry_run:
+        # Only the sources of the selected cuts, which may not include the first input
+        proxies = {}
+        for cut in cuts:
+            if cut.source not in proxies:
+                proxies[cut.source] = str(proxy_file(args, cut.source))
+        if None in proxies:
+            preview_args.input_media_file = proxies[None]
+        cuts = [cut if cut.source is None else cut._replace(source=proxies[cut.source]) for cut in cuts]
+    print(f"Rendering a preview of {len(cuts)} cuts to {preview_args.output_file}")
+    cut_with_ffmpeg(preview_args, cuts)
+
+
+def segment_key(args, source_hash: str, cut, suffix: str) -> str:
+    """Key of a segment in the segment cache, from everything `segment_command` passes to ffmpeg."""
+    start = cut.start.total_seconds()
+    return SegmentCache.segment_key(
+        source_hash,
+        start=f"{start:.6f}",
+        duration=f"{cut.end.total_seconds() - start:.6f}",
+        fade_ms=args.fade_ms,
+        preview=args.preview,
+        format=suffix,
+        ffmpeg=FFMPEG,
+    )
+
+
+def probe_keyframes(media_file: str) -> np.ndarray:
+    """Returns the sorted timestamps, in seconds, of the keyframes of the first video stream. Only keyframes are
+    decoded."""
+    result = subprocess.run(
+        [FFMPEG, "-hide_banner", "-skip_frame", "nokey", "-i", media_file]
+        + ["-map", "0:v:0", "-vf", "showinfo", "-f", "null", "-"],
+        stderr=subprocess.PIPE,
+        text=True,
+    )
+    times = re.findall(r"\bpts_time:(-?[\d.]+)", result.stderr)
+    return np.unique(np.array(times, dtype=np.float64))
+
+
+class VideoStream(NamedTuple):
+    codec: str
+    pix_fmt: Optional[str] = None
+    profile: Optional[str] = None
+    level: Optional[str] = None
+    fps: Optional[float] = None
+    timescale: Optional[str] = None
+
+
+def _probe_number(text: str) -> str:
+    """Expands the "k" suffix of the frame rates and time bases printed by ffmpeg."""
+    return str(round(float(text[:-1]) * 1000)) if text.endswith("k") else text
+
+
+def probe_video_stream(media_file: str) -> Optional[VideoStream]:
+    """Returns the codec and the encoding parameters of the first video stream, or None if there is no video. The
+    level is read from the H.264 sequence parameter set."""
+    result = subprocess.run([FFMPEG, "-hide_banner", "-i", media_file], stderr=subprocess.PIPE, text=True)
+    match = re.search(r"^\s*Stream #\d+:\d+.*?: Video: (\w+)(?: \(([^)]*)\))?.*$", result.stderr, re.MULTILINE)
+    if not match:
+        return None
+    line = match.group(0)
+    # The pixel format, with its color range and space in parentheses, comes before the frame size
+    pix_fmt = re.search(r", (\w+)(?:\([^)]*\))?, \d+x\d+", line)
+    fps = re.search(r", ([\d.]+k?) fps", line)
+    timescale = re.search(r", ([\d.]+k?) tbn", line)
+    level = None
+    if match.group(1) == "h264":
+        headers = subprocess.run(
+            [FFMPEG, "-hide_banner", "-i", media_file, "-map", "0:v:0", "-c", "copy"]
+            + ["-bsf:v", "trace_headers", "-frames:v", "1", "-f", "null", "-"],
+            stderr=subprocess.PIPE,
+            text=True,
+        )
+        level_idc = re.search(r"\blevel_idc\s+\d+ = (\d+)", headers.stderr)
+        level = f"{int(level_idc.group(1)) / 10:g}" if level_idc else None
+    return VideoStream(
+        codec=match.group(1),
+        pix_fmt=pix_fmt.group(1) if pix_fmt else None,
+        profile=match.group(2),
+        level=level,
+        fps=float(_probe_number(fps.group(1))) if fps else None,
+        timescale=_probe_number(timescale.group(1)) if timescale else None,
+    )
+
+
+def probe_audio_codec(media_file: str) -> Optional[str]:
+    result = subprocess.run([FFMPEG, "-hide_banner", "-i", media_file], stderr=subprocess.PIPE, text=True)
+    match = re.search(r"^\s*Stream #\d+:\d+.*?: Audio: (\w+)", result.stderr, re.MULTILINE)
+    return match.group(1) if match else None
+
+
+ENCODERS = {"h264": "libx264", "hevc": "libx265", "vp9": "libvpx-vp9", "av1": "libaom-av1", "mpeg4": "mpeg4"}
+AUDIO_ENCODERS = {"aac": "aac", "mp3": "libmp3lame", "opus": "libopus", "vorbis": "libvorbis", "flac": "flac"}
+# Profiles as printed by ffmpeg, and as the encoders take them
+PROFILES = {
+    "Constrained Baseline": "baseline",
+    "Baseline": "baseline",
+    "Main": "main",
+    "High": "high",
+    "High 10": "high10",
+    "High 4:2:2": "high422",
+    "High 4:4:4 Predictive": "high444",
+    "Main 10": "main10",
+}
+# Containers whose video track time base can be set
+TIMESCALE_SUFFIXES = {".mp4", ".m4v", ".mov"}
+
+
+def smart_cut_encode_args(stream: VideoStream, suffix: str) -> List[str]:
+    """Encoder options for the re-encoded parts of a smart cut. They must match the stream copied parts, because the
+    concat demuxer keeps the codec parameters and the time base of the first part."""
+    if stream.codec not in ENCODERS:
+        return []
+    encode_args = ["-c:v", ENCODERS[stream.codec]]
+    if stream.pix_fmt:
+        encode_args += ["-pix_fmt", stream.pix_fmt]
+    if stream.profile in PROFILES:
+        encode_args += ["-profile:v", PROFILES[stream.profile]]
+    if stream.level:
+        encode_args += ["-level", stream.level]
+    if stream.timescale and suffix in TIMESCALE_SUFFIXES:
+        encode_args += ["-video_track_timescale", stream.timescale]
+    return encode_args
+
+
+def smart_cut_parts(start: float, end: float, keyframes: Optional[np.ndarray], mode: str) -> List[Tuple]:
+    """Splits a cut into (start, end, copy) parts. Parts with `copy` set start at a keyframe and can be stream
+    copied, the others have to be re-encoded."""
+    if keyframes is None or len(keyframes) == 0:
+        # Every audio frame can be decoded on its own.
+        return [(start, end, True)]
+    if mode == "snap":
+        i = np.searchsorted(keyframes, start, side="right") - 1
+        return [(float(keyframes[i]) if i >= 0 else start, end, True)]
+
+    first = np.searchsorted(keyframes, start, side="left")
+    last = np.searchsorted(keyframes, end, side="right") - 1
+    if first >= len(keyframes) or last < first or keyframes[first] >= keyframes[last]:
+        return [(start, end, False)]
+    middle_start, middle_end = float(keyframes[first]), float(keyframes[last])
+    parts = [(start, middle_start, False)] if start < middle_start else []
+    parts.append((middle_start, middle_end, True))
+    if middle_end < end:
+        parts.append((middle_end, end, False))
+    return parts
+
+
+def cut_with_smart_cut(args, cuts):
+    """Stream copies the GOP-aligned part of each cut and re-encodes only its head and tail. Keyframes are probed
+    once for each media file. The audio of each cut is re-encoded once, separately from the parts of its video, and
+    joined with them when the segments are concatenated."""
+    output_path = Path(args.output_file)
+    # Video stream, keyframes and audio codec of each media file
+    probes = {}
+    segments = []
+    audio_segments = []
+    # Exact length of the segments. Copied parts that start with B-frames have timestamps that start later.
+    durations = {}
+    cmds = []
+
+    for c, cut in enumerate(cuts):
+        source = cut.source or args.input_media_file
+        if source not in probes:
+            stream = probe_video_stream(source)
+            probes[source] = stream, probe_keyframes(source) if stream else None, probe_audio_codec(source)
+        stream, keyframes, audio_codec = probes[source]
+        start, end = cut.start.total_seconds(), cut.end.total_seconds()
+        if stream is not None and stream.fps:
+            # Cut on frames, so the parts of the video and the audio of the cut have the same length
+            start, end = round(start * stream.fps) / stream.fps, round(end * stream.fps) / stream.fps
+        parts = smart_cut_parts(start, end, keyframes, args.smart_cut)
+        for p, (start, end, copy) in enumerate(parts):
+            segment_path = output_path.with_stem(f"segment_{c}_{p}")
+            if stream is None:
+                # Audio only, every frame can be copied
+                part_args = ["-t", f"{end - start:.6f}", "-c", "copy"]
+            else:
+                part_args = ["-map", "0:v:0"]
+                if stream.fps:
+                    # With B-frames, a duration would also keep the packets of the next GOP that are decoded before
+                    # the last frames of the part, so the part is limited to its number of frames instead.
+                    part_args += ["-frames:v", str(round((end - start) * stream.fps))]
+                else:
+                    part_args += ["-t", f"{end - start:.6f}"]
+                if copy:
+                    part_args += ["-c", "copy", "-avoid_negative_ts", "make_zero"]
+                else:
+                    part_args += smart_cut_encode_args(stream, output_path.suffix)
+            cmds.append(
+                [
+                    FFMPEG,
+                    # Seek on the input side, which is exact when starting at a keyframe
+                    "-ss",
+                    f"{start:.6f}",
+                    "-i",
+                    source,
+                ]
+                + part_args
+                + [
+                    # Overwrite output
+                    "-y",
+                    # Loglevel
+                    "-v",
+                    args.loglevel,
+                    str(segment_path),
+                ]
+            )
+            segments.append(segment_path)
+            durations[segment_path] = end - start
+
+        if stream is not None and audio_codec is not None:
+            # Audio frames don't line up with the parts, so the whole cut is encoded at once
+            start, end = parts[0][0], parts[-1][1]
+            segment_path = output_path.with_stem(f"segment_{c}_audio")
+            encode_args = ["-c:a", AUDIO_ENCODERS[audio_codec]] if audio_codec in AUDIO_ENCODERS else []
+            cmds.append(
+                [FFMPEG, "-ss", f"{start:.6f}", "-i", source, "-map", "0:a:0", "-t", f"{end - start:.6f}"]
+                + encode_args
+                + ["-y", "-v", args.loglevel, str(segment_path)]
+            )
+            audio_segments.append(segment_path)
+            durations[segment_path] = end - start
+
+    run_segment_commands(args, cmds, segments + audio_segments)
+    concat_segments(args, segments, ["-c", "copy"], audio_segments=audio_segments, durations=durations)
+
+
+def run_segment_commands(args, cmds: List[List[str]], segments: List[Path]):
+    """Runs the commands that extract the segments, or prints them in a dry run. Exits if one fails. The segments
+    are removed if a command fails or the render is interrupted or cancelled."""
+    if args.dry_run:
+        for cmd in cmds:
+            print(" ".join(cmd))
+    else:
+        try:
+            run_commands(cmds, jobs=args.jobs)
+        except subprocess.CalledProcessError as e:
+            print(f"Command failed with exit code {e.returncode}:", " ".join(e.cmd))
+            remove_files(segments)
+            sys.exit(1)
+        except BaseException:
+            remove_files(segments)
+            raise
+
+
+def concat_segments(
+    args,
+    segments: List[Path],
+    extra_args: List[str],
+    keep_segments: bool = False,
+    audio_segments: Optional[List[Path]] = None,
+    durations: Optional[Dict[Path, float]] = None,
+):
+    """Concatenates the segments into the output file with the concat demuxer, then removes them unless
+    `keep_segments` is set. With `audio_segments`, the video of `segments` is joined with the concatenated audio of
+    `audio_segments`. The concat demuxer starts each segment where the previous one ends, which is taken from
+    `durations` when given instead of from the timestamps of the segment."""
+    output_path = Path(args.output_file)
+    lists = [(output_path.with_stem("video_segments").with_suffix(".txt"), segments)]
+    if audio_segments:
+        lists.append((output_path.with_stem("audio_segments").with_suffix(".txt"), audio_segments))
+    inputs = []
+    for list_path, _ in lists:
+        # Force Format, then the file of input media
+        inputs += ["-f", "concat", "-safe", "0", "-i", f"{str(list_path)}"]
+    if audio_segments:
+        inputs += ["-map", "0:v", "-map", "1:a"]
+    cmd_concat = (
+        [FFMPEG]
+        + inputs
+        + extra_args
         + [
             # Overwrite output
             "-y",
@@ -181,27 +929,219 @@ def cut_with_ffmpeg(args, cuts):
     if args.dry_run:
         print(" ".join(cmd_concat))
     else:
-        with open(str(list_path), "w") as f:
-            for seg in segments:
-                f.write(f"file {str(seg.name)}\n")
+        for list_path, list_segments in lists:
+            with open(str(list_path), "w") as f:
+                for seg in list_segments:
+                    if seg.parent == list_path.parent:
+                        f.write(f"file {str(seg.name)}\n")
+                    else:
+                        f.write("file '{}'\n".format(str(seg.resolve()).replace("'", "'\\''")))
+                    if durations and seg in durations:
+                        f.write(f"duration {durations[seg]:.6f}\n")
+
+        print("Running command:", " ".join(cmd_concat))
+        started = time.perf_counter()
+        try:
+            subprocess.run(cmd_concat)
+            profiler.sample("ffmpeg_concat_seconds", time.perf_counter() - started)
+        finally:
+            # Clean up, also when the render is interrupted or cancelled
+            print("Cleaning up intermediate files:")
+            list_paths = [list_path for list_path, _ in lists]
+            remove_files(list_paths + ([] if keep_segments else segments + (audio_segments or [])))
+
+
+def probe_streams(media_file: str) -> Tuple[bool, bool]:
+    """Returns whether the media file has video and audio streams. Cover art doesn't count as video."""
+    result = subprocess.run([FFMPEG, "-hide_banner", "-i", media_file], stderr=subprocess.PIPE, text=True)
+    streams = re.findall(r"^\s*Stream #\d+:\d+.*?: (Video|Audio): (.*)$", result.stderr, re.MULTILINE)
+    has_video = any(kind == "Video" and "(attached pic)" not in details for kind, details in streams)
+    has_audio = any(kind == "Audio" for kind, _ in streams)
+    return has_video, has_audio
+
+
+def build_filter_graph(
+    cuts,
+    has_video: bool,
+    has_audio: bool,
+    fade_seconds: float,
+    speed: float,
+    inputs: Optional[List[int]] = None,
+) -> str:
+    """Builds a filter graph that trims every cut from its input, given by `inputs` or input 0 for all of them,
+    fades it in and out, concatenates them and changes the speed. The outputs are labeled `[v]` and `[a]`."""
+    if inputs is None:
+        inputs = [0] * len(cuts)
+    streams = [kind for kind, present in [("v", has_video), ("a", has_audio)] if present]
+    chains = []
+    for kind in streams:
+        prefix = "" if kind == "v" else "a"
+        for i in sorted(set(inputs)):
+            labels = [f"[{kind}in{c}]" for c in range(len(cuts)) if inputs[c] == i]
+            chains.append(f"[{i}:{kind}]{prefix}split={len(labels)}" + "".join(labels))
+        for c, cut in enumerate(cuts):
+            start, end = cut.start.total_seconds(), cut.end.total_seconds()
+            filters = [f"{prefix}trim=start={start}:end={end}", f"{prefix}setpts=PTS-STARTPTS"]
+            if fade_seconds > 0:
+                filters += [
+                    f"{prefix}fade=t=in:st=0:d={fade_seconds}",
+                    f"{prefix}fade=t=out:st={end - start - fade_seconds}:d={fade_seconds}",
+                ]
+            chains.append(f"[{kind}in{c}]" + ",".join(filters) + f"[{kind}{c}]")
 
-        print("Running command: %i" % i, " ".join(cmd_concat))
-        subprocess.run(cmd_concat)
+    concat_inputs = "".join(f"[{kind}{c}]" for c in range(len(cuts)) for kind in streams)
+    concat_outputs = "".join(f"[{kind}cat]" for kind in streams)
+    chains.append(f"{concat_inputs}concat=n={len(cuts)}:v={int(has_video)}:a={int(has_audio)}{concat_outputs}")
+    if has_video:
+        chains.append(f"[vcat]setpts={1.0 / speed}*PTS[v]" if speed != 1.0 else "[vcat]null[v]")
+    if has_audio:
+        chains.append(f"[acat]atempo={speed}[a]" if speed != 1.0 else "[acat]anull[a]")
+    return ";\n".join(chains)
 
-        # Clean up
-        print("Cleaning up intermediate files:")
+
+def plan_filter_inputs(cuts, default_source: str) -> Tuple[List[Tuple[str, float, float]], List[int]]:
+    """Opens the media files of the cuts as inputs of one ffmpeg process, so that the cuts of each input are in
+    order. A cut that starts before the end of the previous cut of every input of its media file gets an input of
+    its own, seeking to it, because an input shared with an earlier cut would have to keep all the frames in
+    between in memory until the concat reaches it. Returns the media file, start and duration of each input, in
+    seconds, and the input of each cut."""
+    # Media file, start and end of each input
+    reads = []
+    inputs = []
+    for cut in cuts:
+        source = cut.source or default_source
+        start, end = cut.start.total_seconds(), cut.end.total_seconds()
+        # The input that was read the furthest without passing the cut
+        candidates = [i for i, (s, _, e) in enumerate(reads) if s == source and e <= start]
+        if candidates:
+            i = max(candidates, key=lambda i: reads[i][2])
+            reads[i][2] = max(reads[i][2], end)
+        else:
+            i = len(reads)
+            reads.append([source, start, end])
+        inputs.append(i)
+    return [(source, start, end - start) for source, start, end in reads], inputs
+
+
+def cut_with_ffmpeg_filter(args, cuts):
+    """Renders all cuts with a single ffmpeg process, without intermediate files. The filter graph is passed in a
+    script file, since it can be too long for a command line.
+
+    Each media file is an input, and cuts that jump backwards get inputs of their own, given by
+    `plan_filter_inputs`. Edits that need more than `MAX_FILTER_INPUTS` inputs are rendered as segments instead.
+    The streams are only used if every media file has them."""
+    reads, inputs = plan_filter_inputs(cuts, args.input_media_file)
+    if len(reads) > MAX_FILTER_INPUTS:
+        print("The cuts jump backwards too often to render them with one filter graph, rendering segments instead")
+        cut_with_ffmpeg(args, cuts)
+        return
+    # Cut times from the start of their input
+    cuts = [
+        cut._replace(
+            start=cut.start - datetime.timedelta(seconds=reads[i][1]),
+            end=cut.end - datetime.timedelta(seconds=reads[i][1]),
+        )
+        for cut, i in zip(cuts, inputs)
+    ]
+    sources = list(dict.fromkeys(source for source, _, _ in reads)) or [args.input_media_file]
+    probes = [probe_streams(source) for source in sources]
+    has_video, has_audio = all(video for video, _ in probes), all(audio for _, audio in probes)
+    fade_seconds = datetime.timedelta(milliseconds=args.fade_ms).total_seconds()
+    filter_graph = build_filter_graph(cuts, has_video, has_audio, fade_seconds, args.speed, inputs)
+
+    with tempfile.NamedTemporaryFile("w", suffix=".txt", delete=False) as f:
+        f.write(filter_graph)
+    maps = [arg for label, present in [("[v]", has_video), ("[a]", has_audio)] if present for arg in ["-map", label]]
+    cmd = (
+        [FFMPEG]
+        # Input media files, each read from its first cut to its last one
+        + [
+            arg
+            for source, start, duration in reads
+            for arg in ["-ss", f"{start:.6f}", "-t", f"{duration:.6f}", "-i", source]
+        ]
+        + ["-filter_complex_script", f.name]
+        + maps
+        + [
+            # Overwrite output
+            "-y",
+            # Loglevel
+            "-v",
+            args.loglevel,
+            args.output_file,
+        ]
+    )
+    try:
+        if args.dry_run:
+            print(filter_graph)
+            print(" ".join(cmd))
+        else:
+            print("Running command:", " ".join(cmd))
+            subprocess.run(cmd, check=True)
+    finally:
+        os.remove(f.name)
+
+
+def run_commands(cmds: List[List[str]], jobs: int):
+    """Runs commands with at most `jobs` of them at the same time, printing progress as they finish.
+
+    If a command fails, the ones that did not start yet are skipped, the running ones are terminated and
+    `subprocess.CalledProcessError` is raised for the first failure. The same happens when waiting for them is
+    interrupted, and the interruption is raised.
+    """
+    lock = threading.Lock()
+    running = {}
+    finished = 0
+    failed = threading.Event()
+
+    def run(i: int, cmd: List[str]):
+        nonlocal finished
+        with lock:
+            if failed.is_set():
+                return
+            print(f"Running command: {i}", " ".join(cmd))
+            started = time.perf_counter()
+            process = running[i] = subprocess.Popen(cmd)
+        returncode = process.wait()
+        profiler.sample("ffmpeg_segment_seconds", time.perf_counter() - started)
+        with lock:
+            del running[i]
+            if returncode != 0 and not failed.is_set():
+                failed.set()
+                for other in running.values():
+                    other.terminate()
+                raise subprocess.CalledProcessError(returncode, cmd)
+            if returncode == 0:
+                finished += 1
+                print(f"Finished command: {i} ({finished}/{len(cmds)})")
+
+    with ThreadPoolExecutor(max_workers=max(1, jobs)) as executor:
+        futures = [executor.submit(run, i, cmd) for i, cmd in enumerate(cmds)]
+        pending = set(futures)
         try:
-            os.remove(str(list_path))
+            while pending:
+                done, pending = wait(pending, return_when=FIRST_EXCEPTION)
+                for future in done:
+                    if future.exception() is not None:
+                        for other in pending:
+                            other.cancel()
+                        raise future.exception()
+        except BaseException:
+            with lock:
+                failed.set()
+                for process in running.values():
+                    process.terminate()
+            raise
+
+
+def remove_files(paths: List[Path]):
+    for path in paths:
+        try:
+            print(f" - {str(path)}")
+            os.remove(str(path.absolute()))
         except OSError:
             pass
 
-        for seg in segments:
-            try:
-                print(f" - {str(seg)}")
-                os.remove(str(seg.absolute()))
-            except OSError:
-                pass
-
 
 if __name__ == "__main__":
     edit_main()
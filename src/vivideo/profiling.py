@@ -0,0 +1,92 @@
+import json
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Union
+
+
+class Profiler:
+    """Collects the wall time of the stages of a run, counters and timed samples such as the duration of each
+    ffmpeg process. Does nothing until it is enabled, so the pipeline can always report to it."""
+
+    def __init__(self):
+        self.enabled = False
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.stages = defaultdict(float)
+        self.counters = defaultdict(int)
+        self.samples = defaultdict(list)
+
+    def enable(self):
+        self.enabled = True
+
+    @contextmanager
+    def stage(self, name: str):
+        if not self.enabled:
+            yield
+            return
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - started
+            with self.lock:
+                self.stages[name] += elapsed
+
+    def count(self, name: str, value: int = 1):
+        if self.enabled:
+            with self.lock:
+                self.counters[name] += value
+
+    def sample(self, name: str, value: float):
+        if self.enabled:
+            with self.lock:
+                self.samples[name].append(value)
+
+    def report(self) -> dict:
+        return {
+            "stages": dict(self.stages),
+            "total_seconds": sum(self.stages.values()),
+            "counters": dict(self.counters),
+            "samples": {
+                name: {
+                    "count": len(values),
+                    "total": sum(values),
+                    "mean": sum(values) / len(values),
+                    "max": max(values),
+                    "values": values,
+                }
+                for name, values in self.samples.items()
+                if values
+            },
+        }
+
+    def summary(self) -> str:
+        report = self.report()
+        lines = [f"{'stage':<24} {'seconds':>10} {'%':>6}"]
+        total = report["total_seconds"] or 1.0
+        for name, seconds in report["stages"].items():
+            lines.append(f"{name:<24} {seconds:>10.3f} {100 * seconds / total:>5.1f}%")
+        lines.append(f"{'total':<24} {report['total_seconds']:>10.3f}")
+        if report["counters"]:
+            lines += ["", f"{'counter':<24} {'value':>10}"]
+            lines += [f"{name:<24} {value:>10}" for name, value in report["counters"].items()]
+        if report["samples"]:
+            lines += ["", f"{'sample':<24} {'count':>6} {'total':>10} {'mean':>10} {'max':>10}"]
+            for name, stats in report["samples"].items():
+                lines.append(
+                    f"{name:<24} {stats['count']:>6} {stats['total']:>10.3f} {stats['mean']:>10.3f} {stats['max']:>10.3f}"
+                )
+        return "\n".join(lines)
+
+    def save(self, path: Union[str, Path]):
+        with open(path, "w") as f:
+            json.dump(self.report(), f, indent=2)
+
+
+# Shared by the whole pipeline, and enabled by `vivideo-edit --profile`.
+profiler = Profiler()
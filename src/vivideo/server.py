@@ -0,0 +1,145 @@
+import argparse
+import json
+import os
+import socket
+import socketserver
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+from pathlib import Path
+from typing import Dict, Optional, Tuple
+
+from vosk import Model, SetLogLevel
+
+from vivideo.transcribe import BLOCK_SIZE, default_socket_path, load_model, recognize
+
+
+class ModelCache:
+    """Keeps up to `max_models` loaded Vosk models, evicting the least recently used one.
+
+    Models are loaded without holding the lock, so jobs for models that are already loaded don't wait for a new
+    one. Jobs that need a model while it is loading wait for that load instead of starting another."""
+
+    def __init__(self, max_models: int = 1):
+        self.max_models = max_models
+        self.models = OrderedDict()
+        # Models being loaded, by key
+        self.loading: Dict[Tuple, Future] = {}
+        self.lock = threading.Lock()
+
+    def get(self, model_path: Optional[str], model_name: Optional[str]) -> Model:
+        key = (model_path, model_name)
+        with self.lock:
+            if key in self.models:
+                self.models.move_to_end(key)
+                return self.models[key]
+            if key in self.loading:
+                loading = self.loading[key]
+            else:
+                if model_path is not None and not Path(model_path).exists():
+                    raise FileNotFoundError(f"Could not find model folder {model_path}")
+                loading = None
+                future = self.loading[key] = Future()
+        if loading is not None:
+            return loading.result()
+
+        try:
+            print("Loading model", model_path or model_name or "en-us")
+            model = load_model(model_path=model_path, model_name=model_name)
+        except BaseException as e:
+            with self.lock:
+                del self.loading[key]
+            future.set_exception(e)
+            raise
+        with self.lock:
+            del self.loading[key]
+            self.models[key] = model
+            while len(self.models) > self.max_models:
+                evicted, _ = self.models.popitem(last=False)
+                print("Unloading model", evicted[0] or evicted[1] or "en-us")
+        future.set_result(model)
+        return model
+
+
+class TranscriptionHandler(socketserver.StreamRequestHandler):
+    """Reads one JSON job per connection and streams back one JSON line per result, then `{"done": true}`, or
+    `{"error": message}` if the job fails."""
+
+    def handle(self):
+        def send(message: dict):
+            self.wfile.write((json.dumps(message) + "\n").encode("utf-8"))
+            self.wfile.flush()
+
+        try:
+            job = json.loads(self.rfile.readline())
+            model = self.server.models.get(job.get("model_path"), job.get("model_name"))
+            print("Transcribing", job["media"])
+            recognize(
+                model,
+                job["media"],
+                job.get("grammar"),
+                Path(job["checkpoint"]),
+                block_size=job.get("block_size", BLOCK_SIZE),
+                on_result=lambda result: send({"result": result}),
+            )
+            send({"done": True})
+        except (BrokenPipeError, ConnectionResetError):
+            print("Client disconnected")
+        except Exception as e:
+            send({"error": str(e)})
+
+
+class TranscriptionServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, socket_path: str, max_models: int = 1):
+        self.models = ModelCache(max_models)
+        remove_stale_socket(socket_path)
+        super().__init__(str(socket_path), TranscriptionHandler)
+
+
+def remove_stale_socket(socket_path: str):
+    """Removes the socket file left by a server that is no longer running. Fails if one is still running."""
+    if not os.path.exists(socket_path):
+        Path(socket_path).parent.mkdir(parents=True, exist_ok=True)
+        return
+    connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        connection.connect(str(socket_path))
+    except OSError:
+        os.remove(socket_path)
+        return
+    finally:
+        connection.close()
+    raise RuntimeError(f"A server is already listening on {socket_path}")
+
+
+def server_main():
+    """
+    Keeps Vosk models loaded between transcriptions. vivideo-transcribe and vivideo-edit send
+    their jobs to it when it is running
+    """
+    parser = argparse.ArgumentParser(description="Transcription server")
+    parser.add_argument("-s", "--socket", help="Unix socket path", default=str(default_socket_path()))
+    parser.add_argument("--max_models", help="Number of models kept in memory", default=1, type=int)
+    parser.add_argument("-m", "--model_path", help="Path for vosk model to load on start", default=None)
+    parser.add_argument("-n", "--model_name", help="Name for vosk model to load on start", default=None)
+    args = parser.parse_args()
+
+    SetLogLevel(-1)
+    server = TranscriptionServer(args.socket, max_models=args.max_models)
+    if args.model_path is not None or args.model_name is not None:
+        model_path = None if args.model_path is None else str(Path(args.model_path).resolve())
+        server.models.get(model_path, args.model_name)
+    print("Listening on", args.socket)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        Path(args.socket).unlink(missing_ok=True)
+
+
+if __name__ == "__main__":
+    server_main()
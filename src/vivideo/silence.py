@@ -0,0 +1,182 @@
+import datetime
+import hashlib
+import json
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from vivideo.cache import TranscriptCache, media_hash
+from vivideo.transcribe import MICROSECOND, SAMPLE_RATE, Transcript, audio_energy
+
+# Samples in each frame of the energy envelope, 10ms
+FRAME_SAMPLES = SAMPLE_RATE // 100
+ENVELOPE_SUFFIX = ".envelope.npy"
+# Frames quieter than the loudest frames by this much are silence. The loudest level is a high percentile, so a
+# few clicks don't raise it.
+SILENCE_DB = -35
+LOUD_PERCENTILE = 99
+
+
+class EnergyEnvelope:
+    """RMS amplitude of each frame of `FRAME_SAMPLES` samples of the audio of a media file.
+
+    The envelope is stored as uint16, 200 bytes per second of audio, and cached next to the transcripts. The
+    quietest frame of any range of frames is found in constant time with sparse tables of range minima, built
+    once for the longest range that is queried."""
+
+    def __init__(self, rms: np.ndarray, frame_samples: int = FRAME_SAMPLES, silence_threshold: Optional[float] = None):
+        self.rms = np.asarray(rms, dtype=np.uint16)
+        self.frame_us = frame_samples * 1_000_000 // SAMPLE_RATE
+        if silence_threshold is None and len(self.rms):
+            silence_threshold = np.percentile(self.rms, LOUD_PERCENTILE) * 10 ** (SILENCE_DB / 20)
+        self.silence_threshold = silence_threshold
+        # Sparse tables by tie-breaking rule. Level k has the position of the quietest frame of each 2**k frames.
+        self._tables: Dict[bool, list] = {False: [], True: []}
+        self._silences: Dict[int, Tuple[np.ndarray, np.ndarray]] = {}
+
+    def __len__(self) -> int:
+        return len(self.rms)
+
+    @classmethod
+    def from_media(cls, media_file: str) -> "EnergyEnvelope":
+        rms = np.sqrt(audio_energy(media_file, FRAME_SAMPLES))
+        return cls(np.minimum(np.round(rms), np.iinfo(np.uint16).max))
+
+    @classmethod
+    def load_or_compute(cls, media_file: str, cache_dir: Optional[str] = None) -> "EnergyEnvelope":
+        """Loads the envelope of the media from the cache, or decodes the audio to compute it and caches it."""
+        cache = TranscriptCache(cache_dir)
+        description = {"media": media_hash(media_file), "envelope_frame_samples": FRAME_SAMPLES}
+        key = hashlib.sha256(json.dumps(description, sort_keys=True).encode("utf-8")).hexdigest()
+        path = cache.path(key, ENVELOPE_SUFFIX)
+        if path.exists():
+            cache.touch(path)
+            return cls(np.load(path))
+        envelope = cls.from_media(media_file)
+        with cache.atomic_write(path) as f:
+            np.save(f, envelope.rms)
+        cache.evict()
+        return envelope
+
+    @classmethod
+    def concatenate(cls, envelopes: List["EnergyEnvelope"], offsets_us: np.ndarray) -> "EnergyEnvelope":
+        """Joins the envelopes of several media files on the timeline of `Transcript.concatenate`, which starts each
+        media file on a whole second. The gaps between them are as loud as possible, so cuts never snap to them,
+        and silence is relative to the loudness of all the media files."""
+        frame_us = envelopes[0].frame_us
+        starts = [int(offset) // frame_us for offset in offsets_us] + [None]
+        length = starts[-2] + len(envelopes[-1])
+        rms = np.full(length, np.iinfo(np.uint16).max, dtype=np.uint16)
+        for envelope, start, end in zip(envelopes, starts, starts[1:]):
+            frames = envelope.rms[: None if end is None else end - start]
+            rms[start : start + len(frames)] = frames  # noqa: E203
+        loud = np.concatenate([envelope.rms for envelope in envelopes])
+        threshold = np.percentile(loud, LOUD_PERCENTILE) * 10 ** (SILENCE_DB / 20) if len(loud) else None
+        return cls(rms, silence_threshold=threshold)
+
+    def _table(self, levels: int, prefer_last: bool) -> list:
+        table = self._tables[prefer_last]
+        if not table:
+            table.append(np.arange(len(self.rms), dtype=np.int32))
+        while len(table) < levels:
+            half = 1 << (len(table) - 1)
+            previous = table[-1]
+            a, b = previous[: len(previous) - half], previous[half:]
+            rms_a, rms_b = self.rms[a], self.rms[b]
+            table.append(np.where(rms_b <= rms_a if prefer_last else rms_b < rms_a, b, a))
+        return table
+
+    def quietest(self, low_us: np.ndarray, high_us: np.ndarray, prefer_last: bool = False) -> np.ndarray:
+        """Middle of the quietest frame whose middle is between `low_us` and `high_us`, in microseconds, for arrays
+        of ranges. Ties go to the first frame, or to the last one with `prefer_last`. -1 where the range has no
+        frame."""
+        half_frame = self.frame_us // 2
+        first = np.maximum(-((half_frame - np.asarray(low_us)) // self.frame_us), 0)
+        last = np.minimum((np.asarray(high_us) - half_frame) // self.frame_us, len(self.rms) - 1)
+        valid = first <= last
+        first, last = np.where(valid, first, 0), np.where(valid, last, 0)
+        level = np.zeros(len(first), dtype=np.int64)
+        if len(first):
+            level = np.floor(np.log2(last - first + 1)).astype(np.int64)
+        table = self._table(int(level.max(initial=0)) + 1, prefer_last)
+        frames = np.zeros(len(first), dtype=np.int64)
+        for k in np.unique(level).tolist():
+            rows = level == k
+            a = table[k][first[rows]]
+            b = table[k][last[rows] - (1 << k) + 1]
+            rms_a, rms_b = self.rms[a], self.rms[b]
+            frames[rows] = np.where(rms_b <= rms_a if prefer_last else rms_b < rms_a, b, a)
+        return np.where(valid, frames * self.frame_us + half_frame, -1)
+
+    def silences(self, min_us: int) -> Tuple[np.ndarray, np.ndarray]:
+        """Start and end, in microseconds, of the runs of silent frames longer than `min_us`, in order."""
+        if min_us not in self._silences:
+            self._silences[min_us] = self._find_silences(min_us)
+        return self._silences[min_us]
+
+    def _find_silences(self, min_us: int) -> Tuple[np.ndarray, np.ndarray]:
+        if len(self.rms) == 0:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+        silent = np.concatenate(([False], self.rms <= self.silence_threshold, [False]))
+        changes = np.flatnonzero(silent[1:] != silent[:-1])
+        starts, ends = changes[::2] * self.frame_us, changes[1::2] * self.frame_us
+        long = ends - starts > min_us
+        return starts[long], ends[long]
+
+
+class BoundarySnapper:
+    """Moves the edges of cuts to the quietest frame of the audio at most `window` before the first word of the cut
+    or after its last word, without entering the words around it. With `max_silence`, silences inside a cut that
+    are longer than that are shortened to `max_silence` by splitting the cut."""
+
+    def __init__(
+        self,
+        envelope: EnergyEnvelope,
+        window: datetime.timedelta,
+        max_silence: Optional[datetime.timedelta] = None,
+    ):
+        self.envelope = envelope
+        self.window_us = window // MICROSECOND
+        self.max_silence_us = None if max_silence is None else max_silence // MICROSECOND
+
+    def snap(
+        self, transcript: Transcript, first: np.ndarray, last: np.ndarray, start: np.ndarray, end: np.ndarray
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """Start and end of cuts, given the first and last word of each cut and its padded `start` and `end`."""
+        if self.window_us > 0 and len(first):
+            n_words = len(transcript)
+            word_start = transcript.start_us[first]
+            previous_end = np.where(first == 0, 0, transcript.end_us[np.maximum(first - 1, 0)])
+            snapped = self.envelope.quietest(
+                np.maximum(word_start - self.window_us, previous_end), word_start, prefer_last=True
+            )
+            start = np.where(snapped >= 0, snapped, start)
+
+            word_end = transcript.end_us[last]
+            next_start = np.where(
+                last + 1 == n_words, word_end + self.window_us, transcript.start_us[np.minimum(last + 1, n_words - 1)]
+            )
+            snapped = self.envelope.quietest(word_end, np.minimum(word_end + self.window_us, next_start))
+            end = np.where(snapped >= 0, snapped, end)
+        if self.max_silence_us is not None:
+            start, end = self.shorten_silences(start, end)
+        return start, end
+
+    def shorten_silences(self, start: np.ndarray, end: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """Splits cuts around the part of each silence inside them that is longer than `max_silence`, keeping half
+        of `max_silence` on each side."""
+        silence_start, silence_end = self.envelope.silences(self.max_silence_us)
+        if len(silence_start) == 0:
+            return start, end
+        half = self.max_silence_us // 2
+        starts, ends = [], []
+        silence_start_list, silence_end_list = silence_start.tolist(), silence_end.tolist()
+        for a, b, i in zip(start.tolist(), end.tolist(), np.searchsorted(silence_start, start, "right").tolist()):
+            while i < len(silence_start_list) and silence_end_list[i] < b:
+                starts.append(a)
+                ends.append(silence_start_list[i] + half)
+                a = silence_end_list[i] - half
+                i += 1
+            starts.append(a)
+            ends.append(b)
+        return np.array(starts, dtype=np.int64), np.array(ends, dtype=np.int64)
@@ -1,18 +1,238 @@
 import argparse
+import glob
+import hashlib
 import re
 import json
+import mmap
+import os
+import socket
+import struct
 from collections import namedtuple
+from collections.abc import Sequence
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
 from datetime import timedelta
-from typing import List, Optional
+from typing import BinaryIO, Callable, Dict, Iterator, List, Optional, Tuple, Union
 from pathlib import Path
 import subprocess
+import time
 
+import numpy as np
 from vosk import Model, KaldiRecognizer, SetLogLevel
-from videogrep.transcribe import transcribe as videogrep_transcribe
 import imageio_ffmpeg
 
+from vivideo.cache import TranscriptCache, default_cache_dir, model_identity
+
 MAX_CHARS = 36
+SAMPLE_RATE = 16000
+BYTES_PER_SAMPLE = 2
+# 2 seconds of audio per read.
+BLOCK_SIZE = 64000
+# Bytes of PCM buffered from ffmpeg, so blocks are read from the pipe in few system calls.
+PCM_BUFFER_SIZE = 1 << 20
 WordAndSpan = namedtuple("WordSpan", ["confidence", "start", "end", "word"])
+MICROSECOND = timedelta(microseconds=1)
+
+BINARY_MAGIC = b"VIVT"
+BINARY_VERSION = 1
+BINARY_SUFFIX = ".transcript"
+MEDIA_EXTENSIONS = {".wav", ".mp3", ".m4a", ".aac", ".flac", ".ogg", ".opus", ".mp4", ".mov", ".mkv", ".avi", ".webm"}
+MANIFEST_EXTENSIONS = {".txt", ".lst"}
+# Used when the size of the model is unknown, for example before it is downloaded.
+DEFAULT_MODEL_MEMORY = 1 << 30
+
+# Magic, version, number of words, vocabulary size and string table size.
+BINARY_HEADER = struct.Struct("<4sIQQQ")
+# Start, end, word id and confidence.
+BINARY_COLUMNS = ["<i8", "<i8", "<i4", "<f4"]
+
+
+class StringTable(Sequence):
+    """Strings stored as one UTF-8 blob and their offsets. Strings are decoded when first accessed."""
+
+    def __init__(self, offsets: np.ndarray, blob: np.ndarray):
+        self.offsets = offsets
+        self.blob = blob
+        self._decoded: List[Optional[str]] = [None] * (len(offsets) - 1)
+
+    @staticmethod
+    def encode(strings: List[str]) -> Tuple[np.ndarray, bytes]:
+        encoded = [string.encode("utf-8") for string in strings]
+        offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        np.cumsum([len(e) for e in encoded], out=offsets[1:])
+        return offsets, b"".join(encoded)
+
+    def __len__(self) -> int:
+        return len(self._decoded)
+
+    def __getitem__(self, i: int) -> str:
+        string = self._decoded[i]
+        if string is None:
+            start, end = self.offsets[i], self.offsets[i + 1]
+            string = self._decoded[i] = self.blob[start:end].tobytes().decode("utf-8")
+        return string
+
+
+class Transcript:
+    """Columnar transcription: parallel NumPy arrays with start and end times in integer microseconds, the
+    confidence and the id of each word in `vocabulary`.
+
+    It behaves like a read-only list of `WordAndSpan`: indexing with an int builds a `WordAndSpan`, and slicing
+    returns a `Transcript` that shares the underlying arrays.
+    """
+
+    def __init__(
+        self,
+        start_us: np.ndarray,
+        end_us: np.ndarray,
+        confidence: np.ndarray,
+        word_ids: np.ndarray,
+        vocabulary: List[str],
+        fingerprint: Optional[str] = None,
+    ):
+        self.start_us = np.asarray(start_us, dtype=np.int64)
+        self.end_us = np.asarray(end_us, dtype=np.int64)
+        self.confidence = np.asarray(confidence, dtype=np.float32)
+        self.word_ids = np.asarray(word_ids, dtype=np.int32)
+        self.vocabulary = vocabulary
+        self._fingerprint = fingerprint
+
+    @classmethod
+    def from_words(cls, words: List[str], start_s, end_s, confidence) -> "Transcript":
+        """Builds a transcript from words and their start and end times in seconds."""
+        ids: Dict[str, int] = {}
+        word_ids = np.fromiter((ids.setdefault(word, len(ids)) for word in words), np.int32, len(words))
+        return cls(
+            np.rint(np.asarray(start_s, dtype=np.float64) * 1e6),
+            np.rint(np.asarray(end_s, dtype=np.float64) * 1e6),
+            confidence,
+            word_ids,
+            list(ids),
+        )
+
+    @classmethod
+    def from_word_spans(cls, word_spans: List[WordAndSpan]) -> "Transcript":
+        if isinstance(word_spans, Transcript):
+            return word_spans
+        ids: Dict[str, int] = {}
+        return cls(
+            np.fromiter((w.start // MICROSECOND for w in word_spans), np.int64, len(word_spans)),
+            np.fromiter((w.end // MICROSECOND for w in word_spans), np.int64, len(word_spans)),
+            np.fromiter((w.confidence for w in word_spans), np.float32, len(word_spans)),
+            np.fromiter((ids.setdefault(w.word, len(ids)) for w in word_spans), np.int32, len(word_spans)),
+            list(ids),
+        )
+
+    @classmethod
+    def from_transcription_dict(cls, transcription_dict: List[dict]) -> "Transcript":
+        words = [word for piece in transcription_dict for word in piece["words"]]
+        return cls.from_words(
+            [word["word"] for word in words],
+            [word["start"] for word in words],
+            [word["end"] for word in words],
+            [word["conf"] for word in words],
+        )
+
+    @classmethod
+    def concatenate(cls, transcripts: List["Transcript"], gap_us: int) -> Tuple["Transcript", np.ndarray]:
+        """Joins the transcripts of several media files on one timeline, where each transcript starts on the first
+        whole second at least `gap_us` after the last word of the previous one. Returns the joined transcript and
+        the offset of each transcript on the timeline, in microseconds."""
+        ids: Dict[str, int] = {}
+        offsets = []
+        starts, ends, confidences, word_ids = [], [], [], []
+        offset = 0
+        for transcript in transcripts:
+            vocabulary = transcript.vocabulary
+            new_ids = np.array([ids.setdefault(vocabulary[i], len(ids)) for i in range(len(vocabulary))], np.int32)
+            offsets.append(offset)
+            starts.append(transcript.start_us + offset)
+            ends.append(transcript.end_us + offset)
+            confidences.append(transcript.confidence)
+            word_ids.append(new_ids[transcript.word_ids] if len(new_ids) else transcript.word_ids)
+            offset += int(transcript.end_us.max(initial=0)) + gap_us
+            offset = -(-offset // 1_000_000) * 1_000_000
+        return (
+            cls(
+                np.concatenate(starts),
+                np.concatenate(ends),
+                np.concatenate(confidences),
+                np.concatenate(word_ids),
+                list(ids),
+            ),
+            np.array(offsets, dtype=np.int64),
+        )
+
+    def __len__(self) -> int:
+        return len(self.word_ids)
+
+    def __getitem__(self, key: Union[int, slice]) -> Union[WordAndSpan, "Transcript"]:
+        if isinstance(key, slice):
+            return Transcript(
+                self.start_us[key], self.end_us[key], self.confidence[key], self.word_ids[key], self.vocabulary
+            )
+        return WordAndSpan(
+            confidence=float(self.confidence[key]),
+            start=timedelta(microseconds=int(self.start_us[key])),
+            end=timedelta(microseconds=int(self.end_us[key])),
+            word=self.vocabulary[self.word_ids[key]],
+        )
+
+    def __iter__(self) -> Iterator[WordAndSpan]:
+        for i in range(len(self)):
+            yield self[i]
+
+    @property
+    def words(self) -> List[str]:
+        vocabulary = self.vocabulary
+        return [vocabulary[i] for i in self.word_ids.tolist()]
+
+    @property
+    def fingerprint(self) -> str:
+        """Identifies the words of the transcript, to tell whether data derived from them is stale. Transcripts from
+        the cache are identified by their cache key, others by a hash of their word ids and vocabulary, computed
+        once."""
+        if self._fingerprint is None:
+            digest = hashlib.sha1(np.ascontiguousarray(self.word_ids, dtype="<i4").tobytes())
+            digest.update("\n".join(self.vocabulary[i] for i in range(len(self.vocabulary))).encode("utf-8"))
+            self._fingerprint = digest.hexdigest()
+        return self._fingerprint
+
+    @fingerprint.setter
+    def fingerprint(self, fingerprint: str):
+        self._fingerprint = fingerprint
+
+    def save(self, f: BinaryIO):
+        """Writes the transcript in the binary format read by `load`: a header with the magic bytes, the format
+        version, the number of words, the size of the vocabulary and the size of the string table, followed by
+        the start, end, word id and confidence columns, the string offsets and the UTF-8 string table. Every
+        column starts at a multiple of its item size, so it can be memory-mapped."""
+        offsets, blob = StringTable.encode(list(self.vocabulary))
+        f.write(BINARY_HEADER.pack(BINARY_MAGIC, BINARY_VERSION, len(self), len(self.vocabulary), len(blob)))
+        for column, dtype in zip([self.start_us, self.end_us, self.word_ids, self.confidence], BINARY_COLUMNS):
+            f.write(np.ascontiguousarray(column, dtype=dtype).tobytes())
+        f.write(offsets.astype("<i8").tobytes())
+        f.write(blob)
+
+    @classmethod
+    def load(cls, path: Union[str, Path], fingerprint: Optional[str] = None) -> "Transcript":
+        """Memory-maps a transcript written by `save`. Columns are read from disk when they are used and words are
+        decoded when they are first accessed."""
+        with open(path, "rb") as f:
+            buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, n_words, n_vocabulary, blob_size = BINARY_HEADER.unpack_from(buffer)
+        if magic != BINARY_MAGIC or version != BINARY_VERSION:
+            raise ValueError(f"{path} is not a transcript in binary format version {BINARY_VERSION}")
+        offset = BINARY_HEADER.size
+        columns = []
+        for dtype in BINARY_COLUMNS:
+            columns.append(np.frombuffer(buffer, dtype=dtype, count=n_words, offset=offset))
+            offset += n_words * np.dtype(dtype).itemsize
+        string_offsets = np.frombuffer(buffer, dtype="<i8", count=n_vocabulary + 1, offset=offset)
+        offset += (n_vocabulary + 1) * 8
+        blob = np.frombuffer(buffer, dtype=np.uint8, count=blob_size, offset=offset)
+        start_us, end_us, word_ids, confidence = columns
+        return cls(start_us, end_us, confidence, word_ids, StringTable(string_offsets, blob), fingerprint)
 
 
 def get_transcription_dict_grammar(
@@ -20,6 +240,10 @@ def get_transcription_dict_grammar(
     grammar: List[str] = None,
     model_path: Optional[str] = None,
     model_name: Optional[str] = None,
+    block_size: int = BLOCK_SIZE,
+    jobs: int = 1,
+    cache_dir: Optional[str] = None,
+    model: Optional[Model] = None,
 ) -> List[dict]:
     """
     Transcribes a video file using Vosk models
@@ -28,76 +252,396 @@ def get_transcription_dict_grammar(
         vosk-model-en-us-0.22-lgraph
         vosk-model-en-us-0.42-gigaspeech
 
+    Transcripts are cached by the content of the media, the model and the grammar. Transcripts of the default model
+    without a grammar are also saved next to the media as `.json`, which is read back as a legacy transcript when
+    the cache doesn't have them. Finalized results are appended to a `.partial.jsonl` checkpoint in the cache as they are
+    produced, so an interrupted transcription resumes where it stopped.
+
     :param videofile str: Video file path
     :param grammar list[str]: Optional list of vocablary
     :param model_path str: Optional vosk model folder
     :param model_name str: Optional vosk model name
+    :param block_size int: Bytes of PCM audio read and passed to the recognizer at a time
+    :param jobs int: Number of processes that recognize chunks of the media split at silences
+    :param cache_dir str: Optional transcript cache folder
+    :param model Model: Optional loaded model to use instead of loading one or using the server
     :rtype List[dict]: A list of timestamps and content
     """
 
     transcript_file = Path(videofile).with_suffix(".json")
 
-    if Path(transcript_file).exists():
-        with open(transcript_file, "r") as infile:
-            data = json.load(infile)
+    if not Path(videofile).exists():
+        print("Could not find file", videofile)
+        return []
+
+    cache = TranscriptCache(cache_dir)
+    key, data = get_cached_transcription_dict(videofile, grammar, model_path, model_name, cache)
+    if data is not None:
         return data
 
-    if Path(transcript_file).exists():
-        print("Could not find file", videofile)
+    print("Transcribing", videofile)
+    checkpoint_file = cache.path(key).with_suffix(".partial.jsonl")
+    cache.directory.mkdir(parents=True, exist_ok=True)
+    if jobs > 1:
+        result = recognize_parallel(
+            videofile,
+            grammar,
+            cache.path(key),
+            jobs,
+            model_path=model_path,
+            model_name=model_name,
+            block_size=block_size,
+        )
+    else:
+        result = None
+        if model is None:
+            result = recognize_with_server(
+                videofile,
+                grammar,
+                checkpoint_file,
+                model_path=model_path,
+                model_name=model_name,
+                block_size=block_size,
+            )
+        if result is None:
+            if model is None:
+                model = load_model(model_path=model_path, model_name=model_name)
+                SetLogLevel(0)
+            result = recognize(model, videofile, grammar, checkpoint_file, block_size=block_size)
+        checkpoint_file.unlink(missing_ok=True)
+    out = group_words(result)
+
+    if len(out) == 0:
+        print("No words found in", videofile)
         return []
 
+    cache.put(key, out)
+    if grammar is None and model_path is None and model_name is None:
+        with open(transcript_file, "w", encoding="utf-8") as outfile:
+            json.dump(out, outfile)
+
+    return out
+
+
+def get_cached_transcription_dict(
+    videofile: str,
+    grammar: Optional[List[str]],
+    model_path: Optional[str],
+    model_name: Optional[str],
+    cache: TranscriptCache,
+) -> Tuple[str, Optional[List[dict]]]:
+    """Returns the cache key of the transcription and the cached transcription, if there is one."""
+    key = cache.key(videofile, model_identity(model_path, model_name), grammar)
+    data = cache.get(key)
+    if data is None and grammar is None and model_path is None and model_name is None:
+        data = read_legacy_transcript(videofile)
+        if data is not None:
+            cache.put(key, data)
+    return key, data
+
+
+def read_legacy_transcript(videofile: str) -> Optional[List[dict]]:
+    """Reads a `.json` transcript saved next to the media before transcripts were cached, unless the media
+    changed after it was written."""
+    transcript_file = Path(videofile).with_suffix(".json")
+    if not transcript_file.exists() or transcript_file.stat().st_mtime < Path(videofile).stat().st_mtime:
+        return None
+    with open(transcript_file, "r") as infile:
+        return json.load(infile)
+
+
+def load_model(model_path: Optional[str] = None, model_name: Optional[str] = None) -> Model:
+    """Loads a Vosk model from a folder, by name, or the default English one. Raises `FileNotFoundError` if the
+    folder does not exist."""
     if model_path is None:
         if model_name is None:
             print("No model is identified. Using default US English model")
-            model = Model(lang="en-us")
-        else:
-            model = Model(model_name=model_name)
-    elif Path(model_path).exists():
-        model = Model(model_path)
-    else:
-        print("Could not find model folder")
-        exit(1)
+            return Model(lang="en-us")
+        return Model(model_name=model_name)
+    if not Path(model_path).exists():
+        raise FileNotFoundError(f"Could not find model folder {model_path}")
+    return Model(model_path)
 
-    print("Transcribing", videofile)
-    SetLogLevel(0)
-    sample_rate = 16000
-    rec = KaldiRecognizer(model, sample_rate, str(grammar))
-    rec.SetWords(True)
 
-    process = subprocess.Popen(
-        [
-            imageio_ffmpeg.get_ffmpeg_exe(),
-            "-nostdin",
-            "-loglevel",
-            "quiet",
-            "-i",
-            videofile,
-            "-ar",
-            str(sample_rate),
-            "-ac",
-            "1",
-            "-f",
-            "s16le",
-            "-",
-        ],
+def read_pcm(videofile: str, offset: int = 0, length: Optional[int] = None) -> subprocess.Popen:
+    """Starts ffmpeg decoding the media to mono 16 bit PCM at `SAMPLE_RATE`, from `offset` samples and for at
+    most `length` samples."""
+    seek = ["-ss", f"{offset / SAMPLE_RATE:.6f}"] if offset else []
+    duration = ["-t", f"{length / SAMPLE_RATE:.6f}"] if length is not None else []
+    return subprocess.Popen(
+        [imageio_ffmpeg.get_ffmpeg_exe(), "-nostdin", "-loglevel", "quiet"]
+        + seek
+        + ["-i", videofile]
+        + duration
+        + ["-ar", str(SAMPLE_RATE), "-ac", "1", "-f", "s16le", "-"],
         stdout=subprocess.PIPE,
+        bufsize=PCM_BUFFER_SIZE,
     )
 
-    tot_samples = 0
-    result = []
+
+def audio_energy(videofile: str, frame_samples: int = SAMPLE_RATE // 100) -> np.ndarray:
+    """Mean square amplitude of each frame of `frame_samples` samples of the media, computed while decoding so the
+    audio is never held in memory. A last, incomplete frame is dropped."""
+    process = read_pcm(videofile)
+    energies = []
+    rest = np.zeros(0, dtype=np.float32)
+    block_samples = frame_samples * 6000
     while True:
-        data = process.stdout.read(4000)
+        data = process.stdout.read(block_samples * BYTES_PER_SAMPLE)
         if len(data) == 0:
             break
-        if rec.AcceptWaveform(data):
-            tot_samples += len(data)
-            rec.SetGrammar(grammar)
-            result.append(json.loads(rec.Result()))
-        # else:
-        #     result.append(json.loads(rec.PartialResult()))
+        samples = np.concatenate((rest, np.frombuffer(data, dtype=np.int16).astype(np.float32)))
+        used = len(samples) - len(samples) % frame_samples
+        frames = samples[:used].reshape(-1, frame_samples)
+        energies.append(np.mean(frames * frames, axis=1))
+        rest = samples[used:]
+    process.wait()
+    return np.concatenate(energies) if energies else np.zeros(0, dtype=np.float32)
+
+
+def find_split_points(
+    energy: np.ndarray, n_chunks: int, frame_samples: int = SAMPLE_RATE // 100, search_frames: int = 3000
+) -> List[int]:
+    """Sample offsets that split the audio into `n_chunks` chunks of about the same length. Each split is moved
+    to the quietest 300ms within `search_frames` frames of the even split, or within a quarter of a chunk for
+    short media."""
+    window = 30
+    smoothed = np.convolve(energy, np.ones(window) / window, mode="same") if len(energy) >= window else energy
+    search_frames = min(search_frames, len(energy) // (4 * n_chunks))
+    splits = []
+    for k in range(1, n_chunks):
+        target = k * len(energy) // n_chunks
+        low = max(target - search_frames, splits[-1] // frame_samples + 1 if splits else 1)
+        high = min(target + search_frames + 1, len(energy) - 1)
+        if low >= high:
+            continue
+        splits.append(int(low + np.argmin(smoothed[low:high])) * frame_samples)
+    return splits
+
+
+def shift_result(result: dict, seconds: float) -> dict:
+    """Moves the word timestamps of a Vosk result by `seconds`."""
+    for word in result.get("result", []):
+        word["start"] = round(word["start"] + seconds, 6)
+        word["end"] = round(word["end"] + seconds, 6)
+    return result
 
-    result.append(json.loads(rec.FinalResult()))
 
+def read_checkpoint(checkpoint_file: Path) -> Tuple[List[dict], int]:
+    """Returns the results saved in a checkpoint and the sample offset to resume from. A line that was only
+    partially written when the process stopped is truncated from the file."""
+    results = []
+    offset = 0
+    if not checkpoint_file.exists():
+        return results, offset
+    valid_bytes = 0
+    with open(checkpoint_file, "rb") as f:
+        for line in f:
+            try:
+                entry = json.loads(line)
+            except json.JSONDecodeError:
+                break
+            results.append(entry["result"])
+            offset = entry["offset"]
+            valid_bytes += len(line)
+    os.truncate(checkpoint_file, valid_bytes)
+    return results, offset
+
+
+def recognize(
+    model: Model,
+    videofile: str,
+    grammar: Optional[List[str]],
+    checkpoint_file: Path,
+    block_size: int = BLOCK_SIZE,
+    start: int = 0,
+    end: Optional[int] = None,
+    on_result: Optional[Callable[[dict], None]] = None,
+) -> List[dict]:
+    """Runs the recognizer over the media, from sample `start` to sample `end`, and returns the Vosk results, with
+    timestamps from the start of the media. `on_result` is called with each result, in order, as soon as it is
+    available.
+
+    Each finalized result is appended to `checkpoint_file` with the sample offset that recognition can safely
+    restart from: the end of its last word, since the audio after it may already hold the start of the next
+    utterance, or the previous offset if it has no words. If the checkpoint exists, recognition resumes from its last offset.
+    """
+    results, offset = read_checkpoint(checkpoint_file)
+    if on_result is None:
+        on_result = ignore_result
+    for result in results:
+        on_result(result)
+    if offset:
+        print(f"Resuming from {offset / SAMPLE_RATE:.2f}s")
+    offset = max(offset, start)
+    if end is not None and offset >= end:
+        return results
+    start_seconds = offset / SAMPLE_RATE
+
+    if grammar is None:
+        rec = KaldiRecognizer(model, SAMPLE_RATE)
+    else:
+        # The grammar is compiled into the decoding graph once and kept for every utterance.
+        rec = KaldiRecognizer(model, SAMPLE_RATE, compile_grammar(grammar))
+    rec.SetWords(True)
+
+    # Whole samples only, so a block never ends in the middle of one.
+    block_size = max(block_size - block_size % BYTES_PER_SAMPLE, BYTES_PER_SAMPLE)
+    process = read_pcm(videofile, offset, None if end is None else end - offset)
+    safe_offset = offset
+    with open(checkpoint_file, "a") as checkpoint:
+        while True:
+            data = process.stdout.read(block_size)
+            if len(data) == 0:
+                break
+            if rec.AcceptWaveform(data):
+                result = shift_result(json.loads(rec.Result()), start_seconds)
+                results.append(result)
+                words = result.get("result", [])
+                if words:
+                    safe_offset = round(words[-1]["end"] * SAMPLE_RATE)
+                checkpoint.write(json.dumps({"offset": safe_offset, "result": result}) + "\n")
+                checkpoint.flush()
+                on_result(result)
+    process.wait()
+
+    results.append(shift_result(json.loads(rec.FinalResult()), start_seconds))
+    on_result(results[-1])
+    return results
+
+
+def compile_grammar(grammar: List[str]) -> str:
+    """The grammar as the JSON list of phrases Vosk expects, without blank lines or repeated phrases."""
+    return json.dumps(list(dict.fromkeys(phrase.strip() for phrase in grammar if phrase.strip())))
+
+
+def ignore_result(result: dict):
+    pass
+
+
+def recognize_with_server(
+    videofile: str,
+    grammar: Optional[List[str]],
+    checkpoint_file: Path,
+    model_path: Optional[str] = None,
+    model_name: Optional[str] = None,
+    block_size: int = BLOCK_SIZE,
+    socket_path: Optional[str] = None,
+) -> Optional[List[dict]]:
+    """Sends the transcription job to a running `vivideo-server` and returns the results it streams back, or None
+    if no server is listening on `socket_path`."""
+    socket_path = socket_path or default_socket_path()
+    connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        connection.connect(str(socket_path))
+    except OSError:
+        connection.close()
+        return None
+
+    print("Transcribing with server", socket_path)
+    job = {
+        "media": str(Path(videofile).resolve()),
+        "grammar": grammar,
+        "model_path": None if model_path is None else str(Path(model_path).resolve()),
+        "model_name": model_name,
+        "block_size": block_size,
+        "checkpoint": str(Path(checkpoint_file).resolve()),
+    }
+    results = []
+    with connection, connection.makefile("rw", encoding="utf-8") as stream:
+        stream.write(json.dumps(job) + "\n")
+        stream.flush()
+        for line in stream:
+            message = json.loads(line)
+            if "error" in message:
+                raise RuntimeError(f"Transcription server failed: {message['error']}")
+            if message.get("done"):
+                return results
+            results.append(message["result"])
+    raise RuntimeError("Transcription server closed the connection")
+
+
+def default_socket_path() -> Path:
+    return Path(os.environ.get("VIVIDEO_SOCKET", default_cache_dir() / "server.sock"))
+
+
+_worker_model = None
+
+
+def _init_worker(model_path: Optional[str], model_name: Optional[str]):
+    global _worker_model
+    SetLogLevel(-1)
+    _worker_model = load_model(model_path=model_path, model_name=model_name)
+
+
+def model_workers(workers: int, model_path: Optional[str], model_name: Optional[str]) -> ProcessPoolExecutor:
+    """Pool of `workers` processes that load the model once each. The model folder is checked before starting
+    them, and a worker that can't load the model breaks the pool, so waiting for a task raises `BrokenProcessPool`
+    instead of workers being started again forever."""
+    if model_path is not None and not Path(model_path).exists():
+        raise FileNotFoundError(f"Could not find model folder {model_path}")
+    return ProcessPoolExecutor(workers, initializer=_init_worker, initargs=(model_path, model_name))
+
+
+def _recognize_chunk(task: Tuple) -> List[dict]:
+    videofile, grammar, checkpoint_file, block_size, start, end = task
+    return recognize(_worker_model, videofile, grammar, checkpoint_file, block_size, start, end)
+
+
+def recognize_parallel(
+    videofile: str,
+    grammar: Optional[List[str]],
+    transcript_file: Path,
+    jobs: int,
+    model_path: Optional[str] = None,
+    model_name: Optional[str] = None,
+    block_size: int = BLOCK_SIZE,
+    margin: int = SAMPLE_RATE,
+) -> List[dict]:
+    """Splits the media at quiet points into `jobs` chunks and recognizes them in `jobs` processes that load the
+    model once. Each chunk is decoded with `margin` extra samples on both sides, so that words at its edges are
+    recognized whole, and keeps only the words whose midpoint falls in the chunk. Every chunk has its own
+    checkpoint, so an interrupted run resumes each chunk where it stopped."""
+    energy = audio_energy(videofile)
+    frame_samples = SAMPLE_RATE // 100
+    bounds = [0] + find_split_points(energy, jobs, frame_samples) + [len(energy) * frame_samples + frame_samples]
+    tasks = [
+        (
+            videofile,
+            grammar,
+            transcript_file.with_suffix(f".partial.{k}.jsonl"),
+            block_size,
+            max(0, chunk_start - margin),
+            chunk_end + margin,
+        )
+        for k, (chunk_start, chunk_end) in enumerate(zip(bounds, bounds[1:]))
+    ]
+    with model_workers(len(tasks), model_path, model_name) as executor:
+        chunk_results = list(executor.map(_recognize_chunk, tasks))
+    for task in tasks:
+        task[2].unlink()
+    return merge_chunk_results(chunk_results, bounds)
+
+
+def merge_chunk_results(chunk_results: List[List[dict]], bounds: List[int]) -> List[dict]:
+    """Concatenates the results of each chunk, keeping only the words whose midpoint is inside the chunk."""
+    merged = []
+    for results, chunk_start, chunk_end in zip(chunk_results, bounds, bounds[1:]):
+        for result in results:
+            if "result" not in result:
+                continue
+            words = [
+                word
+                for word in result["result"]
+                if chunk_start <= (word["start"] + word["end"]) / 2 * SAMPLE_RATE < chunk_end
+            ]
+            if words:
+                merged.append({"result": words, "text": " ".join(word["word"] for word in words)})
+    return merged
+
+
+def group_words(result: List[dict]) -> List[dict]:
+    """Groups the words of Vosk results into pieces of about `MAX_CHARS` characters."""
     out = []
     for r in result:
         if "result" not in r:
@@ -113,32 +657,72 @@ def get_transcription_dict_grammar(
                 item["end"] = item["words"][-1]["end"]
                 out.append(item)
                 item = {"content": "", "start": None, "end": None, "words": []}
+    return out
 
-    if len(out) == 0:
-        print("No words found in", videofile)
-        return []
 
-    with open(transcript_file, "w", encoding="utf-8") as outfile:
-        json.dump(out, outfile)
+def transcribe(
+    media_file: str,
+    model_path: Optional[str] = None,
+    model_name: Optional[str] = None,
+    cache_dir: Optional[str] = None,
+) -> Transcript:
+    """Returns the transcript of the media. Transcripts are kept in the cache in binary format too, so later calls
+    memory-map them instead of parsing the JSON. Cached JSON transcripts are converted on first use."""
+    cache = TranscriptCache(cache_dir)
+    binary_file = None
+    if Path(media_file).exists():
+        key = cache.key(media_file, model_identity(model_path, model_name))
+        binary_file = cache.path(key, BINARY_SUFFIX)
+        if binary_file.exists():
+            cache.touch(binary_file)
+            return Transcript.load(binary_file, fingerprint=key)
 
-    return out
+    transciption_dict = get_transcription_dict(
+        media_file, model_path=model_path, model_name=model_name, cache_dir=cache_dir
+    )
+    transcript = Transcript.from_transcription_dict(transciption_dict)
+    if binary_file is not None and transciption_dict:
+        with cache.atomic_write(binary_file) as f:
+            transcript.save(f)
+        cache.evict()
+        transcript.fingerprint = key
+    return transcript
 
 
-def transcribe(
-    media_file: str, model_path: Optional[str] = None, model_name: Optional[str] = None
-) -> List[WordAndSpan]:
-    transciption_dict = get_transcription_dict(media_file, model_path=model_path, model_name=model_name)
-    words_with_spans = [
-        WordAndSpan(
-            confidence=word["conf"],
-            start=timedelta(seconds=word["start"]),
-            end=timedelta(seconds=word["end"]),
-            word=word["word"],
-        )
-        for piece in transciption_dict
-        for word in piece["words"]
+def transcribe_many(
+    media_files: List[str],
+    model_path: Optional[str] = None,
+    model_name: Optional[str] = None,
+    cache_dir: Optional[str] = None,
+    jobs: int = 1,
+) -> List[Transcript]:
+    """Transcribes several media files at the same time, or loads them from the cache, with at most `jobs` threads
+    and no more models than fit in the available memory."""
+    # Files with the same content share a cache key, and so a checkpoint, so each is transcribed once
+    model = model_identity(model_path, model_name)
+    keys = [
+        TranscriptCache.key(media_file, model) if Path(media_file).exists() else media_file
+        for media_file in media_files
     ]
-    return words_with_spans
+    unique = {}
+    for key, media_file in zip(keys, media_files):
+        unique.setdefault(key, media_file)
+    available = available_memory_bytes()
+    max_models = len(unique) if available is None else available // max(model_memory_bytes(model_path), 1)
+    workers = max(1, min(jobs, max_models, len(unique)))
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        transcripts = dict(
+            zip(
+                unique,
+                executor.map(
+                    lambda media_file: transcribe(
+                        media_file, model_path=model_path, model_name=model_name, cache_dir=cache_dir
+                    ),
+                    unique.values(),
+                ),
+            )
+        )
+    return [transcripts[key] for key in keys]
 
 
 def get_transcription_dict(
@@ -146,44 +730,239 @@ def get_transcription_dict(
     grammar_file: Optional[str] = None,
     model_path: Optional[str] = None,
     model_name: Optional[str] = None,
+    block_size: int = BLOCK_SIZE,
+    jobs: int = 1,
+    cache_dir: Optional[str] = None,
 ) -> dict:
+    return get_transcription_dict_grammar(
+        media_file,
+        grammar=read_grammar(grammar_file),
+        model_path=model_path,
+        model_name=model_name,
+        block_size=block_size,
+        jobs=jobs,
+        cache_dir=cache_dir,
+    )
+
+
+def read_grammar(grammar_file: Optional[str]) -> Optional[List[str]]:
     if grammar_file is None:
-        return videogrep_transcribe(media_file, model_path=model_path)
-    else:
-        # Read Grammar [1 Word per Line] and set Grammar as List of Strings
-        try:
-            with open(grammar_file, "r") as gfile:
-                grammar = gfile.readlines()
-                grammar = [re.sub("\n", "", w).lower() for w in grammar]
-        except IOError:
-            print("grammar file not found ", grammar_file)
-            exit(1)
+        return None
+    # Read Grammar [1 Word per Line] and set Grammar as List of Strings
+    try:
+        with open(grammar_file, "r") as gfile:
+            grammar = gfile.readlines()
+            return [re.sub("\n", "", w).lower() for w in grammar]
+    except IOError:
+        print("grammar file not found ", grammar_file)
+        exit(1)
+
+
+def expand_media_files(spec: str) -> List[str]:
+    """Lists the media files of a batch: every media file in a directory and its subdirectories, the files listed
+    in a manifest (`.txt` or `.lst`, one path per line, relative to the manifest), or the files matching a glob."""
+    path = Path(spec)
+    if path.is_dir():
+        return sorted(str(p) for p in path.rglob("*") if p.suffix.lower() in MEDIA_EXTENSIONS and p.is_file())
+    if path.is_file() and path.suffix.lower() in MANIFEST_EXTENSIONS:
+        with open(path, "r") as f:
+            lines = [line.strip() for line in f]
+        return [str(path.parent / line) for line in lines if line and not line.startswith("#")]
+    return sorted(glob.glob(spec, recursive=True))
+
+
+def media_duration(media_file: str) -> float:
+    """Duration of the media in seconds, as reported by ffmpeg, or 0 if it is unknown."""
+    result = subprocess.run(
+        [imageio_ffmpeg.get_ffmpeg_exe(), "-hide_banner", "-i", media_file], stderr=subprocess.PIPE, text=True
+    )
+    match = re.search(r"Duration: (\d+):(\d+):(\d+(?:\.\d+)?)", result.stderr)
+    if match is None:
+        return 0.0
+    hours, minutes, seconds = match.groups()
+    return int(hours) * 3600 + int(minutes) * 60 + float(seconds)
+
+
+def model_memory_bytes(model_path: Optional[str]) -> int:
+    """Estimates the memory used by a loaded model as the size of its folder, which is close for Vosk models."""
+    if model_path is None or not Path(model_path).is_dir():
+        return DEFAULT_MODEL_MEMORY
+    return sum(p.stat().st_size for p in Path(model_path).rglob("*") if p.is_file())
+
+
+def available_memory_bytes() -> Optional[int]:
+    try:
+        return os.sysconf("SC_AVPHYS_PAGES") * os.sysconf("SC_PAGE_SIZE")
+    except (ValueError, OSError, AttributeError):
+        return None
 
-        return get_transcription_dict_grammar(
-            media_file, grammar=grammar, model_path=model_path, model_name=model_name
+
+def _transcribe_batch_file(task: Tuple) -> Tuple[str, float, Optional[str]]:
+    media_file, grammar, model_path, model_name, block_size, cache_dir, output_file = task
+    try:
+        transcription = get_transcription_dict_grammar(
+            media_file,
+            grammar=grammar,
+            model_path=model_path,
+            model_name=model_name,
+            block_size=block_size,
+            cache_dir=cache_dir,
+            model=_worker_model,
         )
+        write_text(transcription, output_file)
+        return media_file, media_duration(media_file), None
+    except Exception as e:
+        return media_file, 0.0, str(e)
+
+
+def transcribe_batch(
+    media_files: List[str],
+    grammar: Optional[List[str]] = None,
+    model_path: Optional[str] = None,
+    model_name: Optional[str] = None,
+    block_size: int = BLOCK_SIZE,
+    cache_dir: Optional[str] = None,
+    jobs: int = 1,
+    model_memory: Optional[int] = None,
+    output_dir: Optional[str] = None,
+) -> List[str]:
+    """Transcribes many files with a pool of worker processes that load the model once each, and writes a `.txt`
+    transcription next to each file or in `output_dir`. Files already in the cache are not scheduled. There are at
+    most `jobs` workers, and no more than the available memory fits `model_memory` bytes per model.
+
+    Returns the files that failed. Raises `FileNotFoundError` if the model folder does not exist, and
+    `BrokenProcessPool` if the workers can't load the model."""
+    started = time.perf_counter()
+    cache = TranscriptCache(cache_dir)
+    tasks = []
+    skipped = 0
+    for media_file in media_files:
+        output_file = Path(media_file).with_suffix(".txt")
+        if output_dir is not None:
+            output_file = Path(output_dir) / output_file.name
+        _, data = get_cached_transcription_dict(media_file, grammar, model_path, model_name, cache)
+        if data is not None:
+            write_text(data, output_file)
+            skipped += 1
+        else:
+            tasks.append((media_file, grammar, model_path, model_name, block_size, cache_dir, output_file))
+    print(f"{skipped} of {len(media_files)} files are already transcribed")
+    if not tasks:
+        return []
+
+    if model_memory is None:
+        model_memory = model_memory_bytes(model_path)
+    available = available_memory_bytes()
+    max_models = len(tasks) if available is None else max(1, available // max(model_memory, 1))
+    workers = max(1, min(jobs, max_models, len(tasks)))
+    print(f"Transcribing {len(tasks)} files with {workers} workers")
+
+    failed = []
+    media_seconds = 0.0
+    with model_workers(workers, model_path, model_name) as executor:
+        futures = [executor.submit(_transcribe_batch_file, task) for task in tasks]
+        for i, future in enumerate(as_completed(futures)):
+            media_file, duration, error = future.result()
+            if error is not None:
+                print(f"[{i + 1}/{len(tasks)}] Failed {media_file}: {error}")
+                failed.append(media_file)
+            else:
+                print(f"[{i + 1}/{len(tasks)}] Transcribed {media_file}")
+                media_seconds += duration
+
+    wall_seconds = time.perf_counter() - started
+    print(
+        f"Transcribed {media_seconds:.1f}s of media in {wall_seconds:.1f}s"
+        f" ({media_seconds / wall_seconds:.2f} media-seconds per second)"
+    )
+    return failed
 
 
 def generate_text(transcription: dict):
     return "\n".join([piece["content"] for piece in transcription])
 
 
+def write_text(transcription: dict, output_txt_file: str):
+    if transcription:
+        text = generate_text(transcription)
+        with open(output_txt_file, "w") as f:
+            f.write(text)
+
+
 def transcribe_main():
     parser = argparse.ArgumentParser(description="Generate transcription text")
-    parser.add_argument("-i", "--input_media", help="Input file", required=True)
-    parser.add_argument("-t", "--output_txt_file", help="Output transcription TXT file", required=True)
+    parser.add_argument("-i", "--input_media", help="Input file", default=None)
+    parser.add_argument("-t", "--output_txt_file", help="Output transcription TXT file", default=None)
+    parser.add_argument(
+        "--batch",
+        help=(
+            "Transcribe many files: a directory, a glob pattern or a manifest file with one path per line. "
+            "Transcriptions are saved as TXT files next to the media, or in --output_dir"
+        ),
+        default=None,
+    )
+    parser.add_argument("-o", "--output_dir", help="Output folder for TXT files in batch mode", default=None)
     parser.add_argument("-m", "--model_path", help="Path for vosk model", default=None)
     parser.add_argument("-n", "--model_name", help="Name for vosk model", default=None)
     parser.add_argument("-g", "--grammar_file", help="Updating recognizer vocabulary in runtime", default=None)
+    parser.add_argument(
+        "-b", "--block_size", help="Bytes of audio passed to the recognizer at a time", default=BLOCK_SIZE, type=int
+    )
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        help=(
+            "Number of processes transcribing chunks of the media in parallel. In batch mode, the number of files "
+            "transcribed in parallel"
+        ),
+        default=1,
+        type=int,
+    )
+    parser.add_argument(
+        "--model_memory_mb",
+        help="Memory used by one loaded model, to limit parallel workers in batch mode. Defaults to the model size",
+        default=None,
+        type=int,
+    )
+    parser.add_argument("-c", "--cache_dir", help="Transcript cache folder", default=None)
 
     args = parser.parse_args()
-    transcription = get_transcription_dict(
-        args.input_media, grammar_file=args.grammar_file, model_path=args.model_path, model_name=args.model_name
-    )
-    if transcription:
-        text = generate_text(transcription)
-        with open(args.output_txt_file, "w") as f:
-            f.write(text)
+    if args.batch is not None:
+        try:
+            failed = transcribe_batch(
+                expand_media_files(args.batch),
+                grammar=read_grammar(args.grammar_file),
+                model_path=args.model_path,
+                model_name=args.model_name,
+                block_size=args.block_size,
+                cache_dir=args.cache_dir,
+                jobs=args.jobs,
+                model_memory=None if args.model_memory_mb is None else args.model_memory_mb << 20,
+                output_dir=args.output_dir,
+            )
+        except (FileNotFoundError, BrokenProcessPool) as e:
+            print("Could not load the model:", e)
+            exit(1)
+        if failed:
+            exit(1)
+        return
+    if args.input_media is None or args.output_txt_file is None:
+        parser.error("--input_media and --output_txt_file are required without --batch")
+
+    try:
+        transcription = get_transcription_dict(
+            args.input_media,
+            grammar_file=args.grammar_file,
+            model_path=args.model_path,
+            model_name=args.model_name,
+            block_size=args.block_size,
+            jobs=args.jobs,
+            cache_dir=args.cache_dir,
+        )
+    except (FileNotFoundError, BrokenProcessPool) as e:
+        print("Could not load the model:", e)
+        exit(1)
+    write_text(transcription, args.output_txt_file)
 
 
 if __name__ == "__main__":
@@ -1,8 +1,61 @@
+import json
+
 import pytest
 
+from vivideo.cache import TranscriptCache, model_identity
+import vivideo.transcribe as transcribe_module
 from vivideo.transcribe import transcribe
 
 
+class FakeRecognizer:
+    """Finalizes an utterance with one word at the end of every second of audio."""
+
+    fail_after = None
+    # Grammars passed to every recognizer of a test. The `fake_recognizer` fixture gives each test its own list.
+    grammars = None
+
+    def __init__(self, model, sample_rate, *args):
+        if args:
+            self.grammars.append(args[0])
+        self.samples = 0
+        self.results = 0
+
+    def SetWords(self, words):
+        pass
+
+    def AcceptWaveform(self, data):
+        self.samples += len(data) // 2
+        return self.samples % 16000 == 0
+
+    def Result(self):
+        if self.results == self.fail_after:
+            raise KeyboardInterrupt
+        self.results += 1
+        end = self.samples / 16000
+        return json.dumps({"result": [{"word": "word", "start": end - 0.5, "end": end, "conf": 1.0}]})
+
+    def FinalResult(self):
+        return json.dumps({"text": ""})
+
+
+@pytest.fixture(autouse=True)
+def transcript_cache(tmp_path_factory, monkeypatch):
+    """A transcript cache that already has samples/jfk.json, since the tests can't download a model."""
+    cache = TranscriptCache(tmp_path_factory.mktemp("cache"))
+    monkeypatch.setenv("VIVIDEO_CACHE_DIR", str(cache.directory))
+    with open("samples/jfk.json") as f:
+        cache.put(cache.key("samples/jfk.wav", model_identity()), json.load(f))
+    return cache
+
+
 @pytest.fixture
 def transcription():
     return transcribe("samples/jfk.wav")
+
+
+@pytest.fixture
+def fake_recognizer(monkeypatch):
+    monkeypatch.setattr(transcribe_module, "KaldiRecognizer", FakeRecognizer)
+    monkeypatch.setattr(FakeRecognizer, "grammars", [])
+    monkeypatch.setattr(FakeRecognizer, "fail_after", None)
+    return FakeRecognizer
@@ -1,6 +1,25 @@
+import random
 from datetime import timedelta
 
-from vivideo.align import Cut, list_cuts
+import numpy as np
+import pytest
+
+from vivideo.align import (
+    Cut,
+    SourceTimeline,
+    TranscriptIndex,
+    align_fuzzy,
+    compute_cuts,
+    list_cuts,
+    list_cuts_incremental,
+    phrase_matches,
+    pick_words_brute_force,
+    pick_words_dynamic,
+    pick_words_phrases,
+    realign_words,
+    soundex,
+    word_cost,
+)
 from vivideo.transcribe import WordAndSpan
 
 
@@ -154,3 +173,173 @@ def test_padding_does_not_overlap_with_other_words():
         ),
     ]
     assert cuts == expected
+
+
+def test_dynamic_minimize_cuts():
+    transcription = [
+        WordAndSpan(word="I", confidence=1, start=timedelta(seconds=0), end=timedelta(seconds=1)),
+        WordAndSpan(word="I", confidence=1, start=timedelta(seconds=1), end=timedelta(seconds=2)),
+        WordAndSpan(word="like", confidence=1, start=timedelta(seconds=2), end=timedelta(seconds=3)),
+        WordAndSpan(word="this", confidence=1, start=timedelta(seconds=3), end=timedelta(seconds=4)),
+    ]
+
+    cuts = list_cuts(
+        transcription,
+        "I like this",
+        padding=timedelta(milliseconds=0),
+        method="dynamic",
+    )
+    assert cuts == [Cut(start=timedelta(seconds=1), end=timedelta(seconds=4))]
+
+
+def test_dynamic_allows_transposition():
+    words = ["first", "second", "third"]
+    assert pick_words_dynamic(words, "first third second") == [0, 2, 1]
+
+
+def test_dynamic_is_never_worse_than_brute_force():
+    def cost(path):
+        return sum(abs(b - a) for a, b in zip([0] + path, path))
+
+    rng = random.Random(0)
+    for _ in range(200):
+        words = [rng.choice("abcd") for _ in range(rng.randint(1, 12))]
+        desired = " ".join(rng.choice(words) for _ in range(rng.randint(1, 5)))
+        try:
+            brute_force = pick_words_brute_force(words, desired)
+        except ValueError:
+            continue
+        assert cost(pick_words_dynamic(words, desired)) <= cost(brute_force)
+
+
+def test_dynamic_missing_word():
+    with pytest.raises(ValueError):
+        pick_words_dynamic(["a", "b"], "a c")
+
+
+def test_transcript_index():
+    index = TranscriptIndex.from_words(["The", "cat", "and", "the", "hat"])
+    assert index.positions("the").tolist() == [0, 3]
+    assert index.positions("dog").tolist() == []
+    assert index.next_occurrence("the", 1) == 3
+    assert index.next_occurrence("the", 4) is None
+
+
+def test_compute_cuts_only_merges_words_that_move_forward():
+    transcription = [
+        WordAndSpan(word="a", confidence=1, start=timedelta(seconds=0), end=timedelta(seconds=1)),
+        WordAndSpan(word="b", confidence=1, start=timedelta(seconds=1), end=timedelta(seconds=2)),
+        WordAndSpan(word="c", confidence=1, start=timedelta(seconds=2), end=timedelta(seconds=3)),
+    ]
+
+    cuts = compute_cuts(transcription, np.array([1, 2, 0, 1, 0]), padding=timedelta(0))
+    expected = [
+        Cut(start=timedelta(seconds=1), end=timedelta(seconds=3)),
+        Cut(start=timedelta(seconds=0), end=timedelta(seconds=2)),
+        Cut(start=timedelta(seconds=0), end=timedelta(seconds=1)),
+    ]
+    assert cuts == expected
+
+
+def test_realign_only_changed_words():
+    words = ["a", "b", "c", "b", "d"]
+    assert realign_words(words, ["a", "c", "d"], [0, 2, 4], ["a", "b", "c", "d"]) == ([0, 1, 2, 4], 1)
+    assert realign_words(words, ["a", "c", "d"], [0, 2, 4], ["a", "c", "d"]) == ([0, 2, 4], 0)
+    assert realign_words(words, ["a", "c", "d"], [0, 2, 4], ["a", "d"]) == ([0, 4], 0)
+    # "b" is taken next to the fixed "d" rather than near the start of the transcription
+    assert realign_words(words, ["c", "d", "a"], [2, 4, 0], ["c", "b", "d", "a"]) == ([2, 3, 4, 0], 1)
+
+
+def test_realign_falls_back_to_full_alignment():
+    # Both occurrences of the new "b" are taken by the fixed words around it, so those have to move too.
+    words = ["b", "a", "b"]
+    assert realign_words(words, ["b", "a", "b"], [0, 1, 2], ["b", "b", "b"]) == ([0, 2, 0], 3)
+
+
+def test_realign_matches_desired_words():
+    rng = random.Random(0)
+    words = [rng.choice("abcdef") for _ in range(50)]
+    desired = [rng.choice(words) for _ in range(20)]
+    chosen = pick_words_dynamic(words, " ".join(desired))
+    for _ in range(50):
+        edited = desired[:]
+        start = rng.randrange(len(edited) + 1)
+        end = start + rng.randint(0, 3)
+        edited[start:end] = [rng.choice(words) for _ in range(rng.randint(0, 3))]
+        realigned, count = realign_words(words, desired, chosen, edited)
+        assert [words[i] for i in realigned] == edited
+        assert count <= 3
+        desired, chosen = edited, realigned
+
+
+def test_list_cuts_incremental(tmp_path, transcription):
+    alignment_file = tmp_path / "jfk.edited.alignment.json"
+    desired = "ask not what your country can do for you"
+    padding = timedelta(milliseconds=10)
+    expected = list_cuts(transcription, desired, padding, method="dynamic")
+    assert list_cuts_incremental(transcription, desired, padding, alignment_file) == expected
+
+    edited = "and so my fellow americans ask not what your country can do for you"
+    expected = list_cuts(transcription, edited, padding, method="dynamic")
+    assert list_cuts_incremental(transcription, edited, padding, alignment_file) == expected
+
+
+def test_word_cost():
+    assert word_cost("country", "country") == 0
+    assert 0 < word_cost("countri", "country") < 0.5
+    assert 0 < word_cost("knot", "not") < 0.5
+    assert word_cost("cat", "dog") == float("inf")
+    assert soundex("robert") == soundex("rupert") == "R163"
+    assert word_cost("robert", "rupert") <= 0.3
+
+
+def test_fuzzy_matches_misrecognized_words(transcription):
+    desired = "my fellow american ask knot what yuor countri can do for you vivideo"
+    matched, skipped = align_fuzzy(transcription.words, desired)
+    assert matched == [2, 3, 4, 5, 6, 7, 8, 9, 10, 11, 12, 13, None]
+    assert skipped == ["vivideo"]
+
+
+def test_fuzzy_transposition():
+    words = ["we", "choose", "to", "go", "to", "the", "moon"]
+    matched, skipped = align_fuzzy(words, "we choose go to the mooon")
+    assert matched == [0, 1, 3, 4, 5, 6]
+    matched, _ = align_fuzzy(["the", "quick", "brown", "fox"], "the brwon quikc fox")
+    assert matched == [0, 2, 1, 3]
+
+
+def test_list_cuts_fuzzy_leaves_out_missing_words(transcription):
+    cuts = list_cuts(transcription, "ask not what your countryy can do for you unknown", timedelta(0), method="fuzzy")
+    assert cuts == list_cuts(transcription, "ask not what your country can do for you", timedelta(0), method="dynamic")
+
+
+def test_phrase_matches_longest_first():
+    index = TranscriptIndex.from_words("a b c d x a b c d e f".split())
+    assert phrase_matches(index, "a b c d e f".split()) == [(0, 5, 6), (0, 0, 4)]
+
+
+def test_phrases_keep_moved_paragraph_in_one_cut():
+    # The words of the phrase also appear one by one near the start, which is closer for the other pickers.
+    words = "fox the jumps quick brown".split() + ["filler"] * 20 + "the quick brown fox jumps".split()
+    assert pick_words_dynamic(words, "the quick brown fox jumps") == [1, 3, 4, 0, 2]
+    assert pick_words_phrases(words, "the quick brown fox jumps") == [25, 26, 27, 28, 29]
+
+
+def test_phrases_fill_gaps_between_phrases():
+    words = "one two three four five six seven eight nine ten".split()
+    assert pick_words_phrases(words, "six seven eight two four five") == [5, 6, 7, 1, 3, 4]
+    assert pick_words_phrases(words, "seven eight nine one two three") == [6, 7, 8, 0, 1, 2]
+    with pytest.raises(ValueError):
+        pick_words_phrases(words, "one two three eleven")
+
+
+def test_source_timeline_tags_cuts(transcription):
+    timeline, joined = SourceTimeline.join(["a.wav", "b.wav"], [transcription, transcription])
+    n = len(transcription)
+    padding = timedelta(milliseconds=500)
+    cuts = timeline.cuts(compute_cuts(joined, [n, n + 1, n + 5, 2, 3], padding))
+    expected_b = compute_cuts(transcription, [0, 1, 5], padding)
+    expected_a = compute_cuts(transcription, [2, 3], padding)
+    assert cuts == [cut._replace(source="b.wav") for cut in expected_b] + [
+        cut._replace(source="a.wav") for cut in expected_a
+    ]
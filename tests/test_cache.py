@@ -0,0 +1,67 @@
+import os
+import shutil
+import socket
+
+from vivideo.cache import TranscriptCache, media_hash, model_identity
+
+
+def test_media_hash_depends_on_content_not_path(tmp_path):
+    copy = tmp_path / "copy.wav"
+    shutil.copy("samples/jfk.wav", copy)
+    assert media_hash(str(copy)) == media_hash("samples/jfk.wav")
+
+    with open(copy, "r+b") as f:
+        f.seek(1000)
+        f.write(b"changed")
+    assert media_hash(str(copy)) != media_hash("samples/jfk.wav")
+
+
+def test_key_depends_on_model_and_grammar():
+    keys = {
+        TranscriptCache.key("samples/jfk.wav", model_identity()),
+        TranscriptCache.key("samples/jfk.wav", model_identity(model_name="vosk-model-en-us-0.22")),
+        TranscriptCache.key("samples/jfk.wav", model_identity(), grammar=["country"]),
+    }
+    assert len(keys) == 3
+
+
+def test_get_and_put(tmp_path):
+    cache = TranscriptCache(tmp_path / "cache")
+    assert cache.get("key") is None
+    cache.put("key", [{"content": "hi"}])
+    assert cache.get("key") == [{"content": "hi"}]
+    assert [p.name for p in cache.directory.iterdir()] == ["key.json"]
+
+
+def test_evicts_least_recently_used(tmp_path):
+    cache = TranscriptCache(tmp_path, max_bytes=100)
+    data = [{"content": "x" * 30}]
+    for i, key in enumerate(["a", "b"]):
+        cache.put(key, data)
+        os.utime(cache.path(key), (i, i))
+    cache.get("a")
+    cache.put("c", data)
+    assert sorted(p.name for p in tmp_path.iterdir()) == ["a.json", "c.json"]
+
+
+def test_evicts_stale_temporary_files(tmp_path):
+    cache = TranscriptCache(tmp_path, max_bytes=100)
+    (tmp_path / "killed.tmp.mp4").write_bytes(b"x" * 1000)
+    os.utime(tmp_path / "killed.tmp.mp4", (0, 0))
+    cache.put("a", [{"content": "x" * 30}])
+    assert sorted(p.name for p in tmp_path.iterdir()) == ["a.json"]
+
+    # A file being written is kept, but the cache makes room for it
+    (tmp_path / "writing.tmp.mp4").write_bytes(b"x" * 60)
+    cache.evict()
+    assert sorted(p.name for p in tmp_path.iterdir()) == ["writing.tmp.mp4"]
+
+
+def test_evict_keeps_sockets_and_folders(tmp_path):
+    cache = TranscriptCache(tmp_path, max_bytes=10)
+    (tmp_path / "segments").mkdir()
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as server:
+        server.bind(str(tmp_path / "server.sock"))
+        os.utime(tmp_path / "server.sock", (0, 0))
+        cache.put("a", [{"content": "x" * 30}])
+        assert sorted(p.name for p in tmp_path.iterdir()) == ["segments", "server.sock"]
@@ -0,0 +1,452 @@
+import argparse
+import multiprocessing
+import os
+import re
+import shutil
+import subprocess
+import sys
+import threading
+import time
+import wave
+from datetime import timedelta
+from pathlib import Path
+
+import numpy as np
+import pytest
+
+import vivideo.edit as edit_module
+from vivideo.align import Cut, TranscriptIndex
+from vivideo.edit import (
+    FFMPEG,
+    _render_in_process_group,
+    build_filter_graph,
+    cancel_render,
+    cut_with_ffmpeg,
+    edit_main,
+    parse_range,
+    plan_filter_inputs,
+    probe_streams,
+    render_preview,
+    select_preview_cuts,
+    cut_with_ffmpeg_filter,
+    cut_with_smart_cut,
+    probe_video_stream,
+    proxy_file,
+    render_cuts,
+    run_commands,
+    segment_command,
+    smart_cut_parts,
+    watch,
+)
+
+
+def python_command(code):
+    return [sys.executable, "-c", code]
+
+
+def test_run_commands_runs_all_commands(tmp_path):
+    cmds = [python_command(f"open(r'{tmp_path / str(i)}', 'w')") for i in range(5)]
+    run_commands(cmds, jobs=3)
+    assert sorted(p.name for p in tmp_path.iterdir()) == ["0", "1", "2", "3", "4"]
+
+
+def test_run_commands_stops_on_first_failure(tmp_path):
+    cmds = [python_command("import sys; sys.exit(3)")] + [
+        python_command(f"open(r'{tmp_path / str(i)}', 'w')") for i in range(5)
+    ]
+    with pytest.raises(subprocess.CalledProcessError) as e:
+        run_commands(cmds, jobs=1)
+    assert e.value.returncode == 3
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_build_filter_graph():
+    cuts = [Cut(timedelta(seconds=1), timedelta(seconds=2)), Cut(timedelta(seconds=0), timedelta(seconds=0.5))]
+    graph = build_filter_graph(cuts, has_video=False, has_audio=True, fade_seconds=0.1, speed=2.0)
+    assert graph.split(";\n") == [
+        "[0:a]asplit=2[ain0][ain1]",
+        "[ain0]atrim=start=1.0:end=2.0,asetpts=PTS-STARTPTS,afade=t=in:st=0:d=0.1,afade=t=out:st=0.9:d=0.1[a0]",
+        "[ain1]atrim=start=0.0:end=0.5,asetpts=PTS-STARTPTS,afade=t=in:st=0:d=0.1,afade=t=out:st=0.4:d=0.1[a1]",
+        "[a0][a1]concat=n=2:v=0:a=1[acat]",
+        "[acat]atempo=2.0[a]",
+    ]
+
+
+def test_build_filter_graph_with_several_inputs():
+    cuts = [Cut(timedelta(seconds=1), timedelta(seconds=2)), Cut(timedelta(seconds=0), timedelta(seconds=0.5))]
+    graph = build_filter_graph(cuts, has_video=False, has_audio=True, fade_seconds=0, speed=1.0, inputs=[1, 0])
+    assert graph.split(";\n")[:4] == [
+        "[0:a]asplit=1[ain1]",
+        "[1:a]asplit=1[ain0]",
+        "[ain0]atrim=start=1.0:end=2.0,asetpts=PTS-STARTPTS[a0]",
+        "[ain1]atrim=start=0.0:end=0.5,asetpts=PTS-STARTPTS[a1]",
+    ]
+
+
+def test_cut_with_ffmpeg_filter(tmp_path):
+    output_file = tmp_path / "output.wav"
+    args = argparse.Namespace(
+        input_media_file="samples/jfk.wav",
+        output_file=str(output_file),
+        fade_ms=0,
+        speed=1.0,
+        loglevel="16",
+        dry_run=False,
+    )
+    cuts = [Cut(timedelta(seconds=5.61), timedelta(seconds=6.45)), Cut(timedelta(seconds=1), timedelta(seconds=2))]
+    cut_with_ffmpeg_filter(args, cuts)
+    with wave.open(str(output_file)) as f:
+        assert f.getnframes() == round(1.84 * f.getframerate())
+
+
+def test_plan_filter_inputs():
+    cuts = [Cut(timedelta(seconds=s), timedelta(seconds=s + 1)) for s in [10, 20, 0, 12, 30]]
+    cuts[3] = cuts[3]._replace(source="other.wav")
+    reads, inputs = plan_filter_inputs(cuts, "main.wav")
+    # The cut at 0 comes after the cut at 20, so it doesn't share an input with it
+    assert reads == [("main.wav", 10.0, 21.0), ("main.wav", 0.0, 1.0), ("other.wav", 12.0, 1.0)]
+    assert inputs == [0, 0, 1, 2, 0]
+
+
+def test_cut_with_ffmpeg_filter_falls_back_to_segments(monkeypatch):
+    renders = []
+    monkeypatch.setattr(edit_module, "MAX_FILTER_INPUTS", 1)
+    monkeypatch.setattr(edit_module, "cut_with_ffmpeg", lambda args, cuts: renders.append(cuts))
+    cuts = [Cut(timedelta(seconds=5), timedelta(seconds=6)), Cut(timedelta(seconds=1), timedelta(seconds=2))]
+    cut_with_ffmpeg_filter(segment_args(dry_run=True), cuts)
+    assert renders == [cuts]
+
+
+def test_smart_cut_parts():
+    keyframes = np.array([0.0, 2.0, 4.0, 6.0, 8.0])
+    assert smart_cut_parts(5.5, 8.5, keyframes, "snap") == [(4.0, 8.5, True)]
+    assert smart_cut_parts(1.5, 8.5, keyframes, "exact") == [(1.5, 2.0, False), (2.0, 8.0, True), (8.0, 8.5, False)]
+    assert smart_cut_parts(4.0, 6.0, keyframes, "exact") == [(4.0, 6.0, True)]
+    assert smart_cut_parts(4.5, 5.5, keyframes, "exact") == [(4.5, 5.5, False)]
+    assert smart_cut_parts(4.5, 5.5, None, "exact") == [(4.5, 5.5, True)]
+
+
+def decoded_length(media_file, stream):
+    """Number of frames and duration in seconds of a stream of the media file, after decoding it."""
+    result = subprocess.run(
+        [FFMPEG, "-i", media_file, "-map", f"0:{stream}", "-f", "null", "-"], stderr=subprocess.PIPE, text=True
+    )
+    frames = re.findall(r"frame=\s*(\d+)", result.stderr)
+    hours, minutes, seconds = re.findall(r"time=(\d+):(\d+):([\d.]+)", result.stderr)[-1]
+    return int(frames[-1]) if frames else None, int(hours) * 3600 + int(minutes) * 60 + float(seconds)
+
+
+@pytest.mark.parametrize("suffix", [".mp4", ".mkv"])
+def test_smart_cut_exact_with_b_frames(tmp_path, suffix):
+    input_file = tmp_path / "input.mp4"
+    subprocess.run(
+        [FFMPEG, "-f", "lavfi", "-i", "testsrc=duration=10:size=320x240:rate=25", "-f", "lavfi", "-i", "sine"]
+        + ["-shortest", "-c:v", "libx264", "-bf", "3", "-g", "25", "-c:a", "aac", "-v", "16", str(input_file)],
+        check=True,
+    )
+    assert probe_video_stream(str(input_file)) == ("h264", "yuv444p", "High 4:4:4 Predictive", "1.3", 25.0, "12800")
+    output_file = tmp_path / f"output{suffix}"
+    args = segment_args(
+        input_media_file=str(input_file), output_file=str(output_file), smart_cut="exact", dry_run=False, jobs=2
+    )
+    seconds = [(0.32, 2.52), (3.72, 6.08), (7.04, 9.52)]
+    cut_with_smart_cut(args, [Cut(timedelta(seconds=start), timedelta(seconds=end)) for start, end in seconds])
+
+    frames, video_seconds = decoded_length(str(output_file), "v")
+    _, audio_seconds = decoded_length(str(output_file), "a")
+    assert frames == sum(round((end - start) * 25) for start, end in seconds)
+    assert video_seconds == pytest.approx(frames / 25, abs=0.05)
+    assert audio_seconds == pytest.approx(video_seconds, abs=0.05)
+    assert sorted(p.name for p in tmp_path.iterdir()) == ["input.mp4", output_file.name]
+
+
+def segment_args(**kwargs):
+    defaults = dict(input_media_file="samples/jfk.wav", fade_ms=0, loglevel="16", preview=None)
+    return argparse.Namespace(**{**defaults, **kwargs})
+
+
+def test_segment_command_seeks_on_input():
+    cut = Cut(timedelta(seconds=9, microseconds=195000), timedelta(seconds=10, microseconds=550000))
+    cmd = segment_command(segment_args(fade_ms=100), cut, Path("segment_0.wav"))
+    assert cmd[1:] == [
+        "-ss",
+        "9.195000",
+        "-i",
+        "samples/jfk.wav",
+        "-t",
+        "1.355000",
+        "-vf",
+        "fade=t=in:st=0:d=0.1,fade=t=out:st=1.255000:d=0.1,setpts=N/FRAME_RATE/TB",
+        "-af",
+        "afade=t=in:st=0:d=0.1,afade=t=out:st=1.255000:d=0.1,asetpts=N/SR/TB",
+        "-y",
+        "-v",
+        "16",
+        "segment_0.wav",
+    ]
+
+
+def test_segment_command_is_sample_accurate(tmp_path):
+    with wave.open("samples/jfk.wav") as f:
+        rate, width = f.getframerate(), f.getsampwidth()
+        source = f.readframes(f.getnframes())
+
+    for start, end in [(0.3, 0.6), (5.61, 6.45), (9.195, 10.55)]:
+        cut = Cut(timedelta(seconds=start), timedelta(seconds=end))
+        segment_path = tmp_path / "segment.wav"
+        subprocess.run(segment_command(segment_args(), cut, segment_path), check=True)
+        with wave.open(str(segment_path)) as f:
+            assert f.getframerate() == rate
+            frames = f.readframes(f.getnframes())
+        first, last = round(start * rate) * width, round(end * rate) * width
+        assert frames == source[first:last]
+
+
+def test_cut_with_ffmpeg_reuses_cached_segments(tmp_path, monkeypatch):
+    encoded = []
+
+    def run_commands(cmds, jobs):
+        encoded.extend(cmds)
+        return edit_module_run_commands(cmds, jobs)
+
+    edit_module_run_commands = edit_module.run_commands
+    monkeypatch.setattr(edit_module, "run_commands", run_commands)
+    output_file = tmp_path / "output.wav"
+    args = segment_args(
+        output_file=str(output_file),
+        speed=1.0,
+        dry_run=False,
+        jobs=2,
+        segment_cache=True,
+        cache_dir=str(tmp_path / "cache"),
+    )
+    cuts = [Cut(timedelta(seconds=5.61), timedelta(seconds=6.45)), Cut(timedelta(seconds=1), timedelta(seconds=2))]
+    cut_with_ffmpeg(args, cuts)
+    assert len(encoded) == 2
+
+    cuts[1] = Cut(timedelta(seconds=1), timedelta(seconds=2.5))
+    cut_with_ffmpeg(args, cuts)
+    assert len(encoded) == 3
+    with wave.open(str(output_file)) as f:
+        assert f.getnframes() == pytest.approx(2.34 * f.getframerate(), abs=2)
+    assert sorted(p.name for p in tmp_path.iterdir()) == ["cache", "output.wav"]
+    assert len(list((tmp_path / "cache" / "segments").iterdir())) == 3
+
+
+def test_cut_with_ffmpeg_removes_interrupted_segments(tmp_path, monkeypatch):
+    def run_commands(cmds, jobs):
+        Path(cmds[0][-1]).write_bytes(b"partial")
+        raise KeyboardInterrupt
+
+    monkeypatch.setattr(edit_module, "run_commands", run_commands)
+    args = segment_args(
+        output_file=str(tmp_path / "output.wav"),
+        speed=1.0,
+        dry_run=False,
+        jobs=2,
+        segment_cache=True,
+        cache_dir=str(tmp_path / "cache"),
+    )
+    with pytest.raises(KeyboardInterrupt):
+        cut_with_ffmpeg(args, [Cut(timedelta(seconds=1), timedelta(seconds=2))])
+    assert list((tmp_path / "cache" / "segments").iterdir()) == []
+
+
+def test_cancel_render_removes_partial_segments(tmp_path, monkeypatch):
+    def segment_command(args, cut, segment_path):
+        return python_command(f"import time; open(r'{segment_path}', 'w').write('partial'); time.sleep(60)")
+
+    monkeypatch.setattr(edit_module, "segment_command", segment_command)
+    args = segment_args(
+        output_file=str(tmp_path / "output.wav"),
+        speed=1.0,
+        dry_run=False,
+        jobs=2,
+        segment_cache=True,
+        cache_dir=str(tmp_path / "cache"),
+        smart_cut=None,
+        render="segments",
+    )
+    cuts = [Cut(timedelta(seconds=s), timedelta(seconds=s + 1)) for s in range(3)]
+    render = multiprocessing.get_context("fork").Process(target=_render_in_process_group, args=(args, cuts))
+    render.start()
+    segments = tmp_path / "cache" / "segments"
+    deadline = time.monotonic() + 20
+    while len(list(segments.glob("*.tmp.wav"))) < 2:
+        assert time.monotonic() < deadline
+        time.sleep(0.05)
+
+    started = time.monotonic()
+    cancel_render(render)
+    assert time.monotonic() - started < 10
+    assert list(segments.iterdir()) == []
+    assert [p.name for p in tmp_path.iterdir()] == ["cache"]
+
+
+def test_watch_renders_on_save(tmp_path, transcription):
+    desired_file = tmp_path / "jfk.edited.txt"
+    output_file = tmp_path / "output.wav"
+    desired_file.write_text("ask not")
+    args = segment_args(
+        desired_transcription_file=str(desired_file),
+        output_file=str(output_file),
+        padding=0,
+        speed=1.0,
+        dry_run=False,
+        incremental=False,
+        greedy=True,
+        align_method=None,
+        smart_cut=None,
+        render="filter",
+    )
+    stop = threading.Event()
+    thread = threading.Thread(
+        target=watch, args=(args, transcription, TranscriptIndex.from_transcript(transcription), stop)
+    )
+    thread.start()
+
+    def wait_for_output(previous_mtime):
+        deadline = time.monotonic() + 20
+        while time.monotonic() < deadline:
+            if output_file.exists() and output_file.stat().st_mtime_ns != previous_mtime:
+                time.sleep(0.5)
+                with wave.open(str(output_file)) as f:
+                    return f.getnframes() / f.getframerate()
+            time.sleep(0.05)
+        raise TimeoutError
+
+    try:
+        short = wait_for_output(None)
+        mtime = output_file.stat().st_mtime_ns
+        desired_file.write_text("ask not what your country can do for you")
+        os.utime(desired_file, ns=(time.time_ns(), time.time_ns() + 1))
+        assert wait_for_output(mtime) > short
+    finally:
+        stop.set()
+        thread.join()
+
+
+def test_select_preview_cuts():
+    cuts = [Cut(timedelta(seconds=s), timedelta(seconds=s + 2)) for s in [10, 0, 20]]
+    assert parse_range("1:") == (1.0, None)
+    assert select_preview_cuts(cuts, cut_range=parse_range("1:")) == cuts[1:]
+    assert select_preview_cuts(cuts, window=parse_range("1:5")) == [
+        Cut(timedelta(seconds=11), timedelta(seconds=12)),
+        Cut(timedelta(seconds=0), timedelta(seconds=2)),
+        Cut(timedelta(seconds=20), timedelta(seconds=21)),
+    ]
+    assert select_preview_cuts(cuts, window=parse_range("3:")) == [
+        Cut(timedelta(seconds=1), timedelta(seconds=2)),
+        Cut(timedelta(seconds=20), timedelta(seconds=22)),
+    ]
+    assert select_preview_cuts(cuts, cut_range=(None, 1), window=(None, 1)) == [
+        Cut(timedelta(seconds=10), timedelta(seconds=11))
+    ]
+
+
+@pytest.mark.parametrize(
+    "preview, suffix, has_video, segment_cache", [("proxy", ".mp4", True, True), ("audio", ".m4a", False, False)]
+)
+def test_render_preview(tmp_path, preview, suffix, has_video, segment_cache):
+    input_file = tmp_path / "input.mp4"
+    subprocess.run(
+        [FFMPEG, "-f", "lavfi", "-i", "testsrc=duration=4:size=1280x720:rate=25", "-f", "lavfi"]
+        + ["-i", "sine=duration=4", "-shortest", "-v", "16", str(input_file)],
+        check=True,
+    )
+    args = segment_args(
+        input_media_file=str(input_file),
+        output_file=str(tmp_path / "output.mp4"),
+        preview=preview,
+        preview_cuts=None,
+        preview_window=(None, 1.5),
+        speed=1.0,
+        dry_run=False,
+        jobs=2,
+        segment_cache=segment_cache,
+        cache_dir=str(tmp_path / "cache"),
+    )
+    cuts = [Cut(timedelta(seconds=2), timedelta(seconds=3)), Cut(timedelta(seconds=0), timedelta(seconds=1))]
+    render_preview(args, cuts)
+    assert (tmp_path / "cache" / "segments").exists() == segment_cache
+    assert not list(tmp_path.glob("segment_*"))
+    output_file = tmp_path / f"output.preview{suffix}"
+    assert probe_streams(str(output_file)) == (has_video, True)
+    result = subprocess.run([FFMPEG, "-i", str(output_file)], stderr=subprocess.PIPE, text=True)
+    assert "Duration: 00:00:01.5" in result.stderr
+    if has_video:
+        assert ", 640x360" in result.stderr
+
+
+def test_edit_several_sources(tmp_path, monkeypatch, capsys):
+    # A copy has the same content, so its transcript is in the cache too.
+    copy = tmp_path / "copy.wav"
+    shutil.copy("samples/jfk.wav", copy)
+    desired_file = tmp_path / "jfk.edited.txt"
+    desired_file.write_text("ask not what your country can do ask not what your country can do")
+    encoded = []
+
+    def run_commands(cmds, jobs):
+        encoded.extend(cmds)
+        return edit_module_run_commands(cmds, jobs)
+
+    edit_module_run_commands = edit_module.run_commands
+    monkeypatch.setattr(edit_module, "run_commands", run_commands)
+    output_file = tmp_path / "out.wav"
+    argv = ["vivideo-edit", "-i", "samples/jfk.wav", str(copy), "-t", str(desired_file), "-o", str(output_file)]
+    monkeypatch.setattr(sys, "argv", argv + ["-a", "greedy", "-p", "300", "-r", "segments", "--no-segment_cache"])
+    edit_main()
+
+    assert "Found 5 cuts" in capsys.readouterr().out
+    # Grouped by file, and in order within each file
+    assert [(cmd[cmd.index("-i") + 1], cmd[cmd.index("-ss") + 1]) for cmd in encoded] == [
+        (str(copy), "3.900000"),
+        (str(copy), "5.070000"),
+        ("samples/jfk.wav", "2.970000"),
+        ("samples/jfk.wav", "5.070000"),
+        ("samples/jfk.wav", "7.875000"),
+    ]
+    with wave.open(str(output_file)) as f:
+        assert f.getnframes() == pytest.approx(6.975 * f.getframerate(), abs=0.1 * f.getframerate())
+
+
+def test_auto_render_checks_every_source(monkeypatch):
+    renderers = []
+    monkeypatch.setattr(edit_module, "cut_with_videogrep", lambda args, cuts: renderers.append("videogrep"))
+    monkeypatch.setattr(edit_module, "cut_with_ffmpeg", lambda args, cuts: renderers.append("segments"))
+    args = segment_args(input_media_file="camera.mp4", preview=None, smart_cut=None, render="auto", speed=1.0)
+    cut = Cut(timedelta(seconds=0), timedelta(seconds=1))
+    render_cuts(args, [cut, cut._replace(source="camera2.mp4")])
+    render_cuts(args, [cut, cut._replace(source="microphone.wav")])
+    assert renderers == ["videogrep", "segments"]
+
+
+def test_render_preview_proxies_only_selected_sources(tmp_path, monkeypatch):
+    proxied = []
+    rendered = []
+    monkeypatch.setattr(edit_module, "proxy_file", lambda args, media_file=None: proxied.append(media_file) or "proxy")
+    monkeypatch.setattr(edit_module, "cut_with_ffmpeg", lambda args, cuts: rendered.append((args, cuts)))
+    args = segment_args(
+        input_media_file="camera.mp4",
+        output_file=str(tmp_path / "output.mp4"),
+        preview="proxy",
+        preview_cuts=(1, None),
+        preview_window=None,
+        dry_run=False,
+    )
+    cut = Cut(timedelta(seconds=0), timedelta(seconds=1))
+    render_preview(args, [cut._replace(source="camera.mp4"), cut._replace(source="camera2.mp4")])
+    assert proxied == ["camera2.mp4"]
+    preview_args, cuts = rendered[0]
+    assert preview_args.input_media_file == "camera.mp4"
+    assert [cut.source for cut in cuts] == ["proxy"]
+
+
+def test_proxies_are_not_kept_with_segments(tmp_path, transcript_cache):
+    input_file = tmp_path / "input.mp4"
+    subprocess.run(
+        [FFMPEG, "-f", "lavfi", "-i", "testsrc=duration=1:size=640x480:rate=25", "-v", "16", str(input_file)],
+        check=True,
+    )
+    path = proxy_file(segment_args(input_media_file=str(input_file), cache_dir=None))
+    assert path.parent == transcript_cache.directory / "proxies"
@@ -0,0 +1,68 @@
+import json
+import sys
+
+import pytest
+
+import vivideo.align as align_module
+import vivideo.edit as edit_module
+from vivideo.align import pick_words_brute_force
+from vivideo.edit import edit_main
+from vivideo.profiling import Profiler
+
+
+@pytest.fixture
+def profiler(monkeypatch):
+    profiler = Profiler()
+    profiler.enable()
+    monkeypatch.setattr(align_module, "profiler", profiler)
+    monkeypatch.setattr(edit_module, "profiler", profiler)
+    return profiler
+
+
+def test_disabled_profiler_records_nothing():
+    profiler = Profiler()
+    with profiler.stage("align"):
+        profiler.count("cuts", 3)
+        profiler.sample("ffmpeg_segment_seconds", 0.5)
+    assert profiler.report() == {"stages": {}, "total_seconds": 0, "counters": {}, "samples": {}}
+
+
+def test_profiler_report(profiler):
+    with profiler.stage("align"):
+        profiler.count("cuts", 3)
+    profiler.count("cuts")
+    profiler.sample("ffmpeg_segment_seconds", 0.5)
+    profiler.sample("ffmpeg_segment_seconds", 1.5)
+    report = profiler.report()
+    assert list(report["stages"]) == ["align"]
+    assert report["counters"] == {"cuts": 4}
+    assert report["samples"]["ffmpeg_segment_seconds"] == {
+        "count": 2,
+        "total": 2.0,
+        "mean": 1.0,
+        "max": 1.5,
+        "values": [0.5, 1.5],
+    }
+    assert "ffmpeg_segment_seconds" in profiler.summary()
+
+
+def test_counts_brute_force_nodes(profiler):
+    pick_words_brute_force(["a", "b", "a", "b"], "a b a")
+    assert profiler.counters["brute_force_nodes"] > 3
+
+
+def test_edit_main_profile(tmp_path, monkeypatch, profiler):
+    desired_file = tmp_path / "jfk.edited.txt"
+    desired_file.write_text("ask not what your country can do for you")
+    profile_file = tmp_path / "profile.json"
+    argv = ["vivideo-edit", "-i", "samples/jfk.wav", "-t", str(desired_file), "-o", str(tmp_path / "out.wav")]
+    monkeypatch.setattr(sys, "argv", argv + ["-r", "filter", "--profile", str(profile_file)])
+    edit_main()
+
+    with open(profile_file) as f:
+        report = json.load(f)
+    assert list(report["stages"]) == ["load_transcript", "load_index", "align", "compute_cuts", "render"]
+    assert report["counters"]["transcript_words"] == 22
+    assert report["counters"]["desired_words"] == 9
+    assert report["counters"]["cuts"] > 0
+    assert report["counters"]["bytes_written"] > 0
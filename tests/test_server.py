@@ -0,0 +1,78 @@
+import threading
+import time
+
+import pytest
+
+import vivideo.server as server_module
+from vivideo.server import ModelCache, TranscriptionServer
+from vivideo.transcribe import recognize, recognize_with_server
+
+
+@pytest.fixture
+def server(tmp_path, monkeypatch, fake_recognizer):
+    monkeypatch.setattr(server_module, "load_model", lambda model_path, model_name: object())
+    server = TranscriptionServer(str(tmp_path / "server.sock"), max_models=1)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+    thread.join()
+
+
+def test_recognize_with_server(server, tmp_path):
+    expected = recognize(None, "samples/jfk.wav", None, tmp_path / "local.partial.jsonl", block_size=8000)
+    results = recognize_with_server(
+        "samples/jfk.wav", None, tmp_path / "remote.partial.jsonl", block_size=8000, socket_path=server.server_address
+    )
+    assert results == expected
+
+
+def test_recognize_with_server_reports_errors(server, tmp_path):
+    with pytest.raises(RuntimeError):
+        recognize_with_server(
+            "samples/jfk.wav",
+            None,
+            tmp_path / "c.partial.jsonl",
+            model_path="missing",
+            socket_path=server.server_address,
+        )
+
+
+def test_recognize_without_server(tmp_path):
+    assert recognize_with_server("samples/jfk.wav", None, tmp_path / "c", socket_path=str(tmp_path / "none")) is None
+
+
+def test_model_cache_evicts_least_recently_used(monkeypatch):
+    loads = []
+    monkeypatch.setattr(server_module, "load_model", lambda model_path, model_name: loads.append(model_name))
+    models = ModelCache(max_models=2)
+    for name in ["a", "b", "a", "c", "a", "b"]:
+        models.get(None, name)
+    assert loads == ["a", "b", "c", "b"]
+
+
+def test_model_cache_loads_without_blocking_loaded_models(monkeypatch):
+    loads = []
+    release = threading.Event()
+
+    def load_model(model_path, model_name):
+        loads.append(model_name)
+        if model_name == "slow":
+            assert release.wait(10)
+        return model_name
+
+    monkeypatch.setattr(server_module, "load_model", load_model)
+    models = ModelCache(max_models=2)
+    models.get(None, "fast")
+    threads = [threading.Thread(target=models.get, args=(None, "slow")) for _ in range(2)]
+    for thread in threads:
+        thread.start()
+    while "slow" not in loads:
+        time.sleep(0.01)
+    assert models.get(None, "fast") == "fast"
+    release.set()
+    for thread in threads:
+        thread.join()
+    assert models.get(None, "slow") == "slow"
+    assert loads == ["fast", "slow"]
@@ -0,0 +1,67 @@
+from datetime import timedelta
+
+import numpy as np
+
+from vivideo.align import Cut, compute_cuts, list_cuts
+from vivideo.silence import ENVELOPE_SUFFIX, BoundarySnapper, EnergyEnvelope
+from vivideo.transcribe import Transcript
+
+
+def test_quietest_matches_argmin():
+    rng = np.random.default_rng(0)
+    envelope = EnergyEnvelope(rng.integers(0, 5, 500))
+    frames = np.sort(rng.integers(0, 500, (2, 1000)), axis=0)
+    low, high = frames * envelope.frame_us + envelope.frame_us // 2
+    first = envelope.quietest(low, high)
+    last = envelope.quietest(low, high, prefer_last=True)
+    for a, b, i, j in zip(frames[0], frames[1], first, last):
+        window = envelope.rms[a : b + 1]  # noqa: E203
+        assert i == (a + np.argmin(window)) * envelope.frame_us + envelope.frame_us // 2
+        assert j == (b - np.argmin(window[::-1])) * envelope.frame_us + envelope.frame_us // 2
+    assert envelope.quietest(np.array([6000]), np.array([9000])).tolist() == [-1]
+
+
+def test_envelope_is_cached(transcript_cache):
+    envelope = EnergyEnvelope.load_or_compute("samples/jfk.wav")
+    assert len(envelope) == 1100
+    assert len(list(transcript_cache.directory.glob(f"*{ENVELOPE_SUFFIX}"))) == 1
+    assert np.array_equal(EnergyEnvelope.load_or_compute("samples/jfk.wav").rms, envelope.rms)
+
+
+def test_snap_to_silence():
+    # Two words with a quiet frame before, between and after them.
+    rms = np.full(100, 1000)
+    rms[[10, 45, 47, 80]] = 0
+    transcript = Transcript.from_words(["a", "b"], [0.2, 0.6], [0.4, 0.7], [1.0, 1.0])
+    snapper = BoundarySnapper(EnergyEnvelope(rms), window=timedelta(milliseconds=150))
+    cuts = compute_cuts(transcript, [0, 1], timedelta(milliseconds=150), snapper)
+    assert cuts == [Cut(timedelta(seconds=0.105), timedelta(seconds=0.805))]
+    cuts = compute_cuts(transcript, [1, 0], timedelta(milliseconds=150), snapper)
+    assert cuts == [
+        Cut(timedelta(seconds=0.475), timedelta(seconds=0.805)),
+        Cut(timedelta(seconds=0.105), timedelta(seconds=0.455)),
+    ]
+
+
+def test_shorten_silences():
+    rms = np.full(300, 1000)
+    rms[100:200] = 0
+    transcript = Transcript.from_words(["a", "b"], [0.5, 2.1], [0.9, 2.5], [1.0, 1.0])
+    snapper = BoundarySnapper(EnergyEnvelope(rms), window=timedelta(0), max_silence=timedelta(milliseconds=200))
+    cuts = compute_cuts(transcript, [0, 1], timedelta(seconds=1), snapper)
+    assert cuts == [
+        Cut(timedelta(seconds=0), timedelta(seconds=1.1)),
+        Cut(timedelta(seconds=1.9), timedelta(seconds=3.5)),
+    ]
+
+
+def test_list_cuts_snaps_inside_window(transcription):
+    window = timedelta(milliseconds=200)
+    snapper = BoundarySnapper(EnergyEnvelope.load_or_compute("samples/jfk.wav"), window=window)
+    desired = "ask not what your country can do for you"
+    cuts = list_cuts(transcription, desired, timedelta(0), method="dynamic")
+    snapped = list_cuts(transcription, desired, timedelta(0), method="dynamic", snapper=snapper)
+    assert len(snapped) == len(cuts)
+    for cut, snapped_cut in zip(cuts, snapped):
+        assert cut.start - window <= snapped_cut.start <= cut.start
+        assert cut.end <= snapped_cut.end <= cut.end + window
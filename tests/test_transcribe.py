@@ -1,6 +1,32 @@
+import json
+import shutil
+import wave
+from concurrent.futures.process import BrokenProcessPool
+from datetime import timedelta
+
 import pytest
 
-from vivideo.transcribe import get_transcription_dict, generate_text
+import vivideo.transcribe as transcribe_module
+from vivideo.cache import model_identity
+from vivideo.transcribe import (
+    Transcript,
+    WordAndSpan,
+    audio_energy,
+    expand_media_files,
+    find_split_points,
+    get_transcription_dict,
+    get_transcription_dict_grammar,
+    load_model,
+    generate_text,
+    media_duration,
+    merge_chunk_results,
+    read_checkpoint,
+    recognize,
+    recognize_parallel,
+    transcribe,
+    transcribe_batch,
+    transcribe_many,
+)
 
 
 @pytest.fixture
@@ -13,3 +39,207 @@ def test_generate_text(transcription_dict):
 you can do for your country"""
     text = generate_text(transcription_dict)
     assert text == expected
+
+
+def test_transcript_behaves_like_list_of_word_spans(transcription_dict):
+    transcript = Transcript.from_transcription_dict(transcription_dict)
+    words = [word for piece in transcription_dict for word in piece["words"]]
+    assert len(transcript) == len(words)
+    assert transcript.words == [word["word"] for word in words]
+    assert transcript[1] == WordAndSpan(
+        confidence=1.0, start=timedelta(seconds=0.6), end=timedelta(seconds=0.99), word="so"
+    )
+    assert list(transcript[1:3]) == [transcript[1], transcript[2]]
+    assert Transcript.from_word_spans(list(transcript)).words == transcript.words
+
+
+def test_recognize_resumes_from_checkpoint(tmp_path, monkeypatch, fake_recognizer):
+    checkpoint_file = tmp_path / "jfk.partial.jsonl"
+
+    expected = recognize(None, "samples/jfk.wav", None, tmp_path / "full.partial.jsonl", block_size=8000)
+    assert [r["result"][0]["end"] for r in expected[:-1]] == list(range(1, 12))
+
+    monkeypatch.setattr(fake_recognizer, "fail_after", 4)
+    with pytest.raises(KeyboardInterrupt):
+        recognize(None, "samples/jfk.wav", None, checkpoint_file, block_size=8000)
+    with open(checkpoint_file, "a") as f:
+        f.write('{"offset": 80000, "res')
+    assert read_checkpoint(checkpoint_file) == (expected[:4], 4 * 16000)
+
+    monkeypatch.setattr(fake_recognizer, "fail_after", None)
+    assert recognize(None, "samples/jfk.wav", None, checkpoint_file, block_size=8000) == expected
+
+
+def test_checkpoint_keeps_offset_after_result_without_words(tmp_path, monkeypatch, fake_recognizer):
+    result_with_words = fake_recognizer.Result
+
+    def result(self):
+        text = result_with_words(self)
+        return '{"text": ""}' if self.results == 2 else text
+
+    monkeypatch.setattr(fake_recognizer, "Result", result)
+    checkpoint_file = tmp_path / "jfk.partial.jsonl"
+    recognize(None, "samples/jfk.wav", None, checkpoint_file, block_size=8000)
+    with open(checkpoint_file) as f:
+        offsets = [json.loads(line)["offset"] for line in f]
+    # A result without words does not move the offset past audio the recognizer may still hold
+    assert offsets[:3] == [16000, 16000, 48000]
+
+
+def test_grammar_transcript_is_not_saved_next_to_media(tmp_path, monkeypatch, fake_recognizer):
+    media_file = tmp_path / "jfk.wav"
+    shutil.copy("samples/jfk.wav", media_file)
+    monkeypatch.setattr(transcribe_module, "load_model", lambda model_path=None, model_name=None: None)
+    grammar = get_transcription_dict_grammar(str(media_file), ["word"], cache_dir=str(tmp_path / "a"))
+    assert grammar and not media_file.with_suffix(".json").exists()
+
+    # Another cache doesn't mistake the grammar transcript for a legacy one
+    get_transcription_dict_grammar(str(media_file), cache_dir=str(tmp_path / "b"))
+    assert fake_recognizer.grammars == ['["word"]']
+    assert media_file.with_suffix(".json").exists()
+
+
+def test_recognize_with_grammar(tmp_path, monkeypatch, fake_recognizer):
+    expected = recognize(None, "samples/jfk.wav", None, tmp_path / "full.partial.jsonl", block_size=8000)
+    grammar = ["ask", "country", "", "ask", "fellow americans"]
+    results = recognize(None, "samples/jfk.wav", grammar, tmp_path / "grammar.partial.jsonl", block_size=8001)
+    assert results == expected
+    assert fake_recognizer.grammars == ['["ask", "country", "fellow americans"]']
+
+
+def test_find_split_points_at_pauses():
+    splits = find_split_points(audio_energy("samples/jfk.wav"), 3)
+    assert [split / 16000 for split in splits] == [pytest.approx(2.7, abs=0.5), pytest.approx(7.9, abs=0.3)]
+
+
+def test_merge_chunk_results_keeps_boundary_words_once():
+    def result(*spans):
+        return {"result": [{"word": "w", "start": start, "end": end, "conf": 1.0} for start, end in spans]}
+
+    chunk_results = [
+        [result((0.0, 0.5), (0.9, 1.2)), {"text": ""}],
+        [result((0.9, 1.2), (1.5, 1.8))],
+    ]
+    merged = merge_chunk_results(chunk_results, [0, 16000, 32000])
+    assert [(w["start"], w["end"]) for r in merged for w in r["result"]] == [(0.0, 0.5), (0.9, 1.2), (1.5, 1.8)]
+
+
+def test_binary_transcript_round_trip(tmp_path, transcription_dict):
+    transcript = Transcript.from_transcription_dict(transcription_dict)
+    path = tmp_path / "jfk.transcript"
+    with open(path, "wb") as f:
+        transcript.save(f)
+
+    loaded = Transcript.load(path)
+    assert list(loaded) == list(transcript)
+    assert list(loaded.vocabulary) == transcript.vocabulary
+    assert loaded.fingerprint == transcript.fingerprint
+    assert transcript[1:].fingerprint != transcript.fingerprint
+
+
+def test_transcribe_converts_cached_json_to_binary(transcript_cache):
+    assert list(transcript_cache.directory.glob("*.transcript")) == []
+    transcript = transcribe("samples/jfk.wav")
+    assert len(list(transcript_cache.directory.glob("*.transcript"))) == 1
+    cached = transcribe("samples/jfk.wav")
+    assert list(cached) == list(transcript)
+    # Identified by the cache key, without hashing the words
+    assert (
+        cached.fingerprint
+        == transcript.fingerprint
+        == transcript_cache.key("samples/jfk.wav", model_identity(None, None))
+    )
+
+
+def test_expand_media_files(tmp_path):
+    (tmp_path / "talks" / "day2").mkdir(parents=True)
+    for name in ["talks/a.mp4", "talks/day2/b.WAV", "talks/notes.md"]:
+        (tmp_path / name).write_bytes(b"")
+    expected = [str(tmp_path / "talks" / "a.mp4"), str(tmp_path / "talks" / "day2" / "b.WAV")]
+    assert expand_media_files(str(tmp_path / "talks")) == expected
+    assert expand_media_files(str(tmp_path / "talks" / "**" / "*.[mW][pA]*")) == expected
+    manifest = tmp_path / "files.txt"
+    manifest.write_text("# talks\ntalks/a.mp4\n\ntalks/day2/b.WAV\n")
+    assert expand_media_files(str(manifest)) == expected
+
+
+def test_media_duration():
+    assert media_duration("samples/jfk.wav") == pytest.approx(11.0, abs=0.1)
+
+
+def test_transcribe_batch_writes_cached_transcriptions(tmp_path, transcription_dict):
+    assert transcribe_batch(["samples/jfk.wav"], output_dir=str(tmp_path)) == []
+    assert (tmp_path / "jfk.txt").read_text() == generate_text(transcription_dict)
+
+
+def silent_wav(path, seconds=0.5):
+    with wave.open(str(path), "wb") as f:
+        f.setnchannels(1)
+        f.setsampwidth(2)
+        f.setframerate(16000)
+        f.writeframes(b"\0\0" * int(16000 * seconds))
+    return str(path)
+
+
+def test_transcribe_many_transcribes_identical_files_once(tmp_path, monkeypatch):
+    copies = [tmp_path / "a.wav", tmp_path / "b.wav"]
+    for copy in copies:
+        shutil.copy("samples/jfk.wav", copy)
+    transcribed = []
+
+    def transcribe(media_file, **kwargs):
+        transcribed.append(media_file)
+        return transcribe_module_transcribe(media_file, **kwargs)
+
+    transcribe_module_transcribe = transcribe_module.transcribe
+    monkeypatch.setattr(transcribe_module, "transcribe", transcribe)
+    transcripts = transcribe_many([str(copy) for copy in copies] + ["samples/jfk.wav"], jobs=3)
+    assert len(transcribed) == 1
+    assert transcripts[0] is transcripts[1] is transcripts[2]
+
+
+def test_load_model_raises_for_missing_folder(tmp_path):
+    with pytest.raises(FileNotFoundError):
+        load_model(model_path=str(tmp_path / "missing"))
+
+
+def test_transcribe_batch_fails_without_model(tmp_path, monkeypatch):
+    media_file = silent_wav(tmp_path / "silence.wav")
+    with pytest.raises(FileNotFoundError):
+        transcribe_batch([media_file], model_path=str(tmp_path / "missing"), output_dir=str(tmp_path))
+
+    def load_model(model_path=None, model_name=None):
+        raise RuntimeError("Failed to create a model")
+
+    monkeypatch.setattr(transcribe_module, "load_model", load_model)
+    with pytest.raises(BrokenProcessPool):
+        transcribe_batch([media_file], output_dir=str(tmp_path))
+
+
+def test_recognize_parallel(tmp_path, monkeypatch, fake_recognizer):
+    monkeypatch.setattr(transcribe_module, "load_model", lambda model_path=None, model_name=None: None)
+    results = recognize_parallel("samples/jfk.wav", None, tmp_path / "jfk.json", jobs=2)
+    ends = [word["end"] for result in results for word in result["result"]]
+    assert len(ends) > 2 and ends == sorted(ends)
+
+    with pytest.raises(FileNotFoundError):
+        recognize_parallel(
+            "samples/jfk.wav", None, tmp_path / "jfk.json", jobs=2, model_path=str(tmp_path / "missing")
+        )
+
+    def load_model(model_path=None, model_name=None):
+        raise RuntimeError("Failed to create a model")
+
+    monkeypatch.setattr(transcribe_module, "load_model", load_model)
+    with pytest.raises(BrokenProcessPool):
+        recognize_parallel("samples/jfk.wav", None, tmp_path / "jfk.json", jobs=2)
+
+
+def test_concatenate_transcripts():
+    first = Transcript.from_words(["a", "b"], [0, 1], [0.5, 1.5], [1.0, 1.0])
+    second = Transcript.from_words(["b", "c"], [0, 2], [1, 2.5], [1.0, 0.5])
+    joined, offsets = Transcript.concatenate([first, second], gap_us=1_000_000)
+    assert offsets.tolist() == [0, 3_000_000]
+    assert joined.words == ["a", "b", "b", "c"]
+    assert joined.start_us.tolist() == [0, 1_000_000, 3_000_000, 5_000_000]
+    assert joined.confidence.tolist() == [1.0, 1.0, 1.0, 0.5]